@@ -0,0 +1,437 @@
+import collections
+import csv
+import itertools
+import json
+import multiprocessing
+import threading
+
+import numpy
+
+from election.predictions import MODELS, PredictionEngine
+from election.stats import get_position_vectors, get_prediction_engine, \
+                           get_prediction_states
+from election.utils import get_electoral_vote_winner, predict_winners
+from endorsements.caching import get_versions
+from endorsements.index import get_endorser_index
+from endorsements.registry import get_registry
+from endorsements.timeline import get_timeline
+from wikipedia.models import ElectoralVotes
+
+
+# The endorser groups (see election.stats.PREDICTION_TAGS) a variant can
+# count.
+GROUP_KEYS = ['senate', 'house', 'newspaper', 'republican', 'democrat']
+
+# name: (the keys that count for Clinton, the keys that count for Trump)
+CANDIDATE_KEYS = collections.OrderedDict([
+    ('endorsed', (['clinton'], ['trump'])),
+    ('party', (['democrat'], ['republican'])),
+    ('endorsed-or-party', (['clinton', 'democrat'], ['trump', 'republican'])),
+])
+
+# predict_winner's winner: the value used in winner arrays
+WINNERS = {
+    'clinton': 1,
+    'trump': -1,
+    None: 0,
+}
+
+# Variants are sent to the worker processes in chunks of this many.
+CHUNK_SIZE = 500
+
+# What the backtest data is built from (see get_current_backtest_data).
+DATA_NAMESPACES = ('endorsers', 'tags', 'positions', 'results', 'imports')
+
+MAX_TIEBREAK_LENGTH = 5
+
+
+class BacktestData(object):
+    """Everything needed to score models against the actual results, as
+    plain arrays (so that it can be handed to worker processes). Each array
+    has an element per state, except for the endorser vectors, which have
+    one per endorser."""
+    def __init__(self, state_names, state_matrix, endorser_vectors,
+                 endorser_weights, winners, basic, electoral_votes):
+        self.state_names = state_names
+        self.state_matrix = state_matrix
+        self.endorser_vectors = endorser_vectors
+        self.endorser_weights = endorser_weights
+        self.winners = winners
+        self.basic = basic
+        self.electoral_votes = electoral_votes
+        self.versions = None
+
+    def get_engine(self):
+        return PredictionEngine(
+            self.state_matrix, self.endorser_vectors, self.endorser_weights
+        )
+
+
+def get_backtest_data():
+    registry = get_registry()
+    states = get_prediction_states(registry)
+    engine = get_prediction_engine(states)
+    electoral_votes = dict(
+        ElectoralVotes.objects.values_list('state_id', 'count')
+    )
+    return BacktestData(
+        [state['name'] for state in states],
+        engine.state_matrix,
+        engine.endorser_vectors,
+        engine.endorser_weights,
+        numpy.array([WINNERS[state['votes']['winner']] for state in states]),
+        numpy.array([bool(state['votes']['basic']) for state in states]),
+        numpy.array([electoral_votes[state['tag'].pk] for state in states]),
+    )
+
+
+_current_data = None
+_current_data_lock = threading.Lock()
+
+
+def get_current_backtest_data():
+    """Returns the backtest data, loading it again only if anything it's
+    built from has changed since it was last loaded in this process."""
+    global _current_data
+    versions = get_versions(*DATA_NAMESPACES)
+    data = _current_data
+    if data is None or data.versions != versions:
+        with _current_data_lock:
+            if _current_data is None or _current_data.versions != versions:
+                _current_data = get_backtest_data()
+                _current_data.versions = versions
+            data = _current_data
+    return data
+
+
+def parse_variant(spec, keys, weight_names=()):
+    """Checks a variant (as described in get_variant_counts) that came from
+    a user, e.g., as JSON. `keys` is the set of endorser groups it can use,
+    and weight_names the endorser weights. Returns the variant, or raises
+    ValueError with a message saying what's wrong with it."""
+    if type(spec) != dict:
+        raise ValueError('The model needs to be a dict')
+
+    def parse_keys(name, value):
+        if type(value) != list or not value:
+            raise ValueError('"%s" needs to be a non-empty list' % name)
+        for key in value:
+            # Checked first, since lists and dicts can't be looked up.
+            if not isinstance(key, basestring):
+                raise ValueError('Keys in "%s" must be strings' % name)
+            if key not in keys:
+                raise ValueError('Unknown key in "%s": %s' % (name, key))
+        return value
+
+    variant = {}
+    for name in ('keys', 'clinton_keys', 'trump_keys'):
+        variant[name] = parse_keys(name, spec.get(name))
+
+    threshold = spec.get('threshold', 1)
+    if type(threshold) not in (int, float) or threshold < 0:
+        raise ValueError('"threshold" needs to be a non-negative number')
+    variant['threshold'] = threshold
+
+    weight = spec.get('weight')
+    if weight is not None:
+        if not isinstance(weight, basestring):
+            raise ValueError('"weight" must be a string')
+        if weight not in weight_names:
+            raise ValueError('Unknown weight: %s' % weight)
+        variant['weight'] = weight
+
+    weights = spec.get('weights')
+    if weights is not None:
+        if type(weights) != dict:
+            raise ValueError('"weights" needs to be a dict')
+        variant['weights'] = {}
+        for key in variant['keys']:
+            weight = weights.get(key, 1)
+            if type(weight) not in (int, float):
+                raise ValueError('Weights need to be numbers')
+            variant['weights'][key] = weight
+
+    tiebreak = spec.get('tiebreak', [])
+    if type(tiebreak) != list or len(tiebreak) > MAX_TIEBREAK_LENGTH:
+        raise ValueError(
+            '"tiebreak" needs to be a list of at most %d lists of keys' %
+            MAX_TIEBREAK_LENGTH
+        )
+    variant['tiebreak'] = [
+        parse_keys('tiebreak', tiebreak_keys) for tiebreak_keys in tiebreak
+    ]
+
+    return variant
+
+
+def score_counts(data, clinton_counts, trump_counts, threshold):
+    """Scores the per-state counts of a model the same way as the
+    predictions page does, plus how far off its electoral vote totals
+    are."""
+    winners, basic = predict_winners(clinton_counts, trump_counts, threshold)
+    correct_candidate = winners == data.winners
+    correct_size = correct_candidate & (basic == data.basic)
+
+    clinton_electoral_votes = int(data.electoral_votes[winners == 1].sum())
+    trump_electoral_votes = int(data.electoral_votes[winners == -1].sum())
+    electoral_vote_error = (
+        abs(clinton_electoral_votes -
+            data.electoral_votes[data.winners == 1].sum()) +
+        abs(trump_electoral_votes -
+            data.electoral_votes[data.winners == -1].sum())
+    )
+
+    return {
+        'num_correct_candidate': int(correct_candidate.sum()),
+        'num_correct_size': int(correct_size.sum()),
+        'clinton_electoral_votes': clinton_electoral_votes,
+        'trump_electoral_votes': trump_electoral_votes,
+        'electoral_vote_winner': get_electoral_vote_winner(
+            clinton_electoral_votes, trump_electoral_votes
+        ),
+        'electoral_vote_error': int(electoral_vote_error),
+    }
+
+
+def get_variant_counts(engine, variant):
+    """Returns the Clinton and Trump counts for every state under a model
+    variant, which is a dict with:
+
+    * keys: the endorser groups to count (see GROUP_KEYS)
+    * candidates: which keys count for each candidate (see CANDIDATE_KEYS),
+      or clinton_keys and trump_keys to give them directly
+    * threshold: as for PredictionModel
+    * weights (optional): a weight for each of the keys. Without weights,
+      an endorser in more than one of the groups is only counted once (like
+      PredictionModel); with them, they're counted once per group.
+    * weight (optional): the name of an endorser weight (e.g., 'followers')
+      to sum instead of counting endorsers, as for PredictionModel
+    * tiebreak (optional): a list of lists of keys to count, in order,
+      wherever the counts so far are tied.
+    """
+    if 'candidates' in variant:
+        clinton_keys, trump_keys = CANDIDATE_KEYS[variant['candidates']]
+    else:
+        clinton_keys = variant['clinton_keys']
+        trump_keys = variant['trump_keys']
+
+    weight = variant.get('weight')
+
+    def count(keys, weights=None):
+        if weights is None:
+            return (
+                engine.count(keys, clinton_keys, weight),
+                engine.count(keys, trump_keys, weight),
+            )
+        return (
+            sum(weights[key] * engine.count([key], clinton_keys, weight)
+                for key in keys),
+            sum(weights[key] * engine.count([key], trump_keys, weight)
+                for key in keys),
+        )
+
+    clinton_counts, trump_counts = count(
+        variant['keys'], variant.get('weights')
+    )
+    for keys in variant.get('tiebreak', []):
+        tied = clinton_counts == trump_counts
+        if not tied.any():
+            break
+        tiebreak_clinton_counts, tiebreak_trump_counts = count(keys)
+        clinton_counts = numpy.where(
+            tied, tiebreak_clinton_counts, clinton_counts
+        )
+        trump_counts = numpy.where(tied, tiebreak_trump_counts, trump_counts)
+
+    return clinton_counts, trump_counts
+
+
+def describe_variant(variant):
+    weights = variant.get('weights')
+    if weights:
+        keys = ' + '.join(
+            '%d*%s' % (weights[key], key) for key in variant['keys']
+        )
+    else:
+        keys = ' | '.join(variant['keys'])
+    description = '%s (%s, threshold %d)' % (
+        keys, variant['candidates'], variant['threshold']
+    )
+    if variant.get('weight'):
+        description += ' by %s' % variant['weight']
+    for tiebreak_keys in variant.get('tiebreak', []):
+        description += '; if tied, %s' % ' | '.join(tiebreak_keys)
+    return description
+
+
+def generate_variants(groups=GROUP_KEYS, candidates=CANDIDATE_KEYS,
+                      thresholds=(1, 2, 3), max_keys=3, weights=(1,),
+                      tiebreak_length=1):
+    """Yields every combination of up to max_keys of the groups, each set
+    of candidate keys and each threshold, with each chain of up to
+    tiebreak_length (other) combinations to break ties with.
+
+    If more than one weight is given, every non-uniform assignment of them
+    to the keys of each combination is tried as well.
+    """
+    key_sets = [
+        list(keys)
+        for num_keys in range(1, max_keys + 1)
+        for keys in itertools.combinations(groups, num_keys)
+    ]
+
+    for keys in key_sets:
+        key_weights = [None]
+        if len(keys) > 1:
+            for values in itertools.product(weights, repeat=len(keys)):
+                if len(set(values)) > 1:
+                    key_weights.append(dict(zip(keys, values)))
+
+        other_key_sets = [
+            other_keys for other_keys in key_sets if other_keys != keys
+        ]
+        tiebreaks = [[]]
+        for length in range(1, tiebreak_length + 1):
+            tiebreaks.extend(
+                list(chain)
+                for chain in itertools.permutations(other_key_sets, length)
+            )
+
+        for candidate_keys in candidates:
+            for threshold in thresholds:
+                for variant_weights in key_weights:
+                    for tiebreak in tiebreaks:
+                        variant = {
+                            'keys': keys,
+                            'candidates': candidate_keys,
+                            'threshold': threshold,
+                        }
+                        if variant_weights:
+                            variant['weights'] = variant_weights
+                        if tiebreak:
+                            variant['tiebreak'] = tiebreak
+                        yield variant
+
+
+def score_models(data, engine=None):
+    """Scores the models on the predictions page, for comparison."""
+    if engine is None:
+        engine = data.get_engine()
+    scores = []
+    for category_models in MODELS.itervalues():
+        for model in category_models:
+            counts = engine.apply(model)
+            score = score_counts(
+                data, counts['clinton'], counts['trump'], model.threshold
+            )
+            score['name'] = model.name
+            scores.append(score)
+    return scores
+
+
+def get_prediction_series(dates):
+    """Scores the models on the predictions page as of each of the given
+    dates (in order), in a single pass over the endorsement timeline.
+    Returns a list of {'date', 'models'} dicts."""
+    data = get_backtest_data()
+    index = get_endorser_index()
+    registry = get_registry()
+
+    series = []
+    for date, positions in get_timeline().iter_positions(dates):
+        # Only the position vectors change from one date to the next.
+        endorser_vectors = dict(data.endorser_vectors)
+        endorser_vectors.update(
+            get_position_vectors(index, registry, positions)
+        )
+        engine = PredictionEngine(
+            data.state_matrix, endorser_vectors, data.endorser_weights
+        )
+        series.append({
+            'date': date,
+            'models': score_models(data, engine),
+        })
+    return series
+
+
+# Set in each worker process by init_worker.
+_data = None
+_engine = None
+
+
+def init_worker(data):
+    global _data, _engine
+    _data = data
+    # Each worker shares its counts between all the variants it scores.
+    _engine = data.get_engine()
+
+
+def score_variants(variants):
+    scores = []
+    for variant in variants:
+        clinton_counts, trump_counts = get_variant_counts(_engine, variant)
+        score = score_counts(
+            _data, clinton_counts, trump_counts, variant['threshold']
+        )
+        score['name'] = describe_variant(variant)
+        score['variant'] = variant
+        scores.append(score)
+    return scores
+
+
+def get_rank_key(score):
+    return (
+        -score['num_correct_candidate'],
+        -score['num_correct_size'],
+        score['electoral_vote_error'],
+        len(score['name']),
+        score['name'],
+    )
+
+
+def run_backtest(data, variants, processes=None):
+    """Scores the variants (spread over a pool of processes, or in this one
+    if processes is 1) and returns the scores, best first."""
+    variants = iter(variants)
+    chunks = iter(lambda: list(itertools.islice(variants, CHUNK_SIZE)), [])
+
+    if processes == 1:
+        init_worker(data)
+        results = itertools.imap(score_variants, chunks)
+        scores = [score for chunk in results for score in chunk]
+    else:
+        pool = multiprocessing.Pool(processes, init_worker, (data,))
+        try:
+            results = pool.imap_unordered(score_variants, chunks)
+            scores = [score for chunk in results for score in chunk]
+        finally:
+            pool.close()
+            pool.join()
+
+    scores.sort(key=get_rank_key)
+    return scores
+
+
+SCORE_COLUMNS = [
+    'name',
+    'num_correct_candidate',
+    'num_correct_size',
+    'clinton_electoral_votes',
+    'trump_electoral_votes',
+    'electoral_vote_winner',
+    'electoral_vote_error',
+]
+
+
+def write_scores(path, scores):
+    """Writes the (ranked) scores to a CSV file, with each variant's
+    definition as JSON in the last column."""
+    with open(path, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(['rank'] + SCORE_COLUMNS + ['variant'])
+        for rank, score in enumerate(scores, 1):
+            writer.writerow(
+                [rank] +
+                [score[column] for column in SCORE_COLUMNS] +
+                [json.dumps(score.get('variant'), sort_keys=True)]
+            )
@@ -1,9 +1,84 @@
 import collections
 
+import numpy
+
+
+class PredictionEngine(object):
+    """Evaluates prediction models for every state at once.
+
+    state_matrix is a boolean states x endorsers matrix and endorser_vectors
+    maps each key the models use (e.g., 'senate' or 'clinton') to a boolean
+    vector over the same endorsers. endorser_weights maps the names of
+    weights (e.g., 'followers') to integer arrays over the endorsers, for
+    the weighted models. Each model's apply_matrix returns arrays
+    of counts (one per state) instead of a single state's counts, and every
+    count and model result is computed once and shared, so the combined
+    models don't recount the Senate and House endorsements.
+    """
+    def __init__(self, state_matrix, endorser_vectors, endorser_weights=None):
+        self.state_matrix = numpy.asarray(state_matrix, dtype=numpy.int32)
+        self.num_states, self.num_endorsers = self.state_matrix.shape
+        self.endorser_vectors = endorser_vectors
+        self.endorser_weights = endorser_weights or {}
+        self.unions = {}
+        self.counts = {}
+        self.results = {}
+
+    def get_union(self, keys):
+        keys = frozenset(keys)
+        if keys not in self.unions:
+            union = numpy.zeros(self.num_endorsers, dtype=bool)
+            for key in keys:
+                union |= self.endorser_vectors[key]
+            self.unions[keys] = union
+        return self.unions[keys]
+
+    def count(self, keys, candidate_keys, weight=None):
+        """Returns the number of endorsers in each state that are in any of
+        `keys` and any of `candidate_keys` or, if the name of a weight is
+        given, the sum of their weights."""
+        count_key = (frozenset(keys), frozenset(candidate_keys), weight)
+        if count_key not in self.counts:
+            mask = self.get_union(keys) & self.get_union(candidate_keys)
+            if weight is not None:
+                mask = numpy.where(mask, self.endorser_weights[weight], 0)
+            self.counts[count_key] = self.state_matrix.dot(mask)
+        return self.counts[count_key]
+
+    def apply(self, model):
+        """Returns the model's {'clinton': counts, 'trump': counts} for
+        every state. Don't modify the arrays; they're shared."""
+        if model not in self.results:
+            self.results[model] = model.apply_matrix(self)
+        return self.results[model]
+
+
+def choose(condition, if_true, if_false):
+    """The vectorized version of `if_true if condition else if_false` for
+    model counts."""
+    return {
+        candidate: numpy.where(condition, if_true[candidate],
+                               if_false[candidate])
+        for candidate in ('clinton', 'trump')
+    }
+
 
 class PredictionModel:
+    # The name of the weight to sum for each endorser (see
+    # PredictionEngine), or None to count them.
+    weight = None
+
     @classmethod
-    def apply_model(cls, state_pks, endorser_pks):
+    def apply_matrix(cls, engine):
+        return {
+            'clinton': engine.count(cls.keys, cls.clinton_keys, cls.weight),
+            'trump': engine.count(cls.keys, cls.trump_keys, cls.weight),
+        }
+
+    @classmethod
+    def apply_model(cls, state_pks, endorser_pks, endorser_weights=None):
+        """endorser_weights maps the name of each weight to a dict of
+        endorser pk: weight (only needed for weighted models)."""
         model_pks = set()
         for key in cls.keys:
             model_pks |= endorser_pks[key]
@@ -12,18 +87,26 @@ class PredictionModel:
         clinton_pks = set()
         for clinton_key in cls.clinton_keys:
             clinton_pks |= endorser_pks[clinton_key]
-        clinton_count = len(state_model_pks & clinton_pks)
+        clinton_count = cls.count(state_model_pks & clinton_pks,
+                                  endorser_weights)
 
         trump_pks = set()
         for trump_key in cls.trump_keys:
             trump_pks |= endorser_pks[trump_key]
-        trump_count = len(state_model_pks & trump_pks)
+        trump_count = cls.count(state_model_pks & trump_pks, endorser_weights)
 
         return {
             'clinton': clinton_count,
             'trump': trump_count,
         }
 
+    @classmethod
+    def count(cls, pks, endorser_weights=None):
+        if cls.weight is None:
+            return len(pks)
+        weights = endorser_weights[cls.weight]
+        return sum(weights.get(pk, 0) for pk in pks)
+
 
 class PartyModel(PredictionModel):
     clinton_keys = ['democrat']
@@ -85,6 +168,15 @@ class CongressUnlessTiedThenHouseModel:
         else:
             return congress_counts
 
+    @classmethod
+    def apply_matrix(cls, engine):
+        congress_counts = engine.apply(CongressEndorsementModel)
+        return choose(
+            congress_counts['clinton'] == congress_counts['trump'],
+            engine.apply(HouseEndorsementModel),
+            congress_counts
+        )
+
 
 
 class SenateUnlessTiedModel:
@@ -105,6 +197,15 @@ class SenateUnlessTiedModel:
         else:
             return senate_counts
 
+    @classmethod
+    def apply_matrix(cls, engine):
+        senate_counts = engine.apply(SenateEndorsementModel)
+        return choose(
+            senate_counts['clinton'] == senate_counts['trump'],
+            engine.apply(HouseEndorsementModel),
+            senate_counts
+        )
+
 
 class HouseUnlessTiedModel:
     name = 'House endorsements (unless tied; then, Senate endorsements)'
@@ -124,6 +225,15 @@ class HouseUnlessTiedModel:
         else:
             return house_counts
 
+    @classmethod
+    def apply_matrix(cls, engine):
+        house_counts = engine.apply(HouseEndorsementModel)
+        return choose(
+            house_counts['clinton'] == house_counts['trump'],
+            engine.apply(SenateEndorsementModel),
+            house_counts
+        )
+
 
 class SenateIfUnanimousModel:
     name = (
@@ -150,6 +260,18 @@ class SenateIfUnanimousModel:
         else:
             return house_counts
 
+    @classmethod
+    def apply_matrix(cls, engine):
+        senate_counts = engine.apply(SenateEndorsementModel)
+        house_counts = engine.apply(HouseEndorsementModel)
+        return choose(
+            (senate_counts['clinton'] == 2) |
+            (senate_counts['trump'] == 2) |
+            (house_counts['clinton'] == house_counts['trump']),
+            senate_counts,
+            house_counts
+        )
+
 
 class NewspaperEndorsementModel(PredictionModel):
     keys = ['newspaper']
@@ -175,6 +297,28 @@ class TrumpNewspaperEndorsementModel(PredictionModel):
 
         return counts
 
+    @classmethod
+    def apply_matrix(cls, engine):
+        counts = engine.apply(NewspaperEndorsementModel)
+        clinton, trump = counts['clinton'], counts['trump']
+        return {
+            'clinton': numpy.where(trump > 0, 0, clinton),
+            'trump': numpy.where((trump == 0) & (clinton == 0), 2, trump),
+        }
+
+
+class CongressFollowersModel(EndorsementModel):
+    keys = ['house', 'senate']
+    weight = 'followers'
+    threshold = 100000
+    name = 'Congress - endorsed (by Twitter followers)'
+
+
+class NewspaperCirculationModel(NewspaperEndorsementModel):
+    weight = 'circulation'
+    threshold = 50000
+    name = 'Newspaper endorsements (by circulation)'
+
 
 MODELS = collections.OrderedDict()
 MODELS['Congress - by party'] = [
@@ -197,3 +341,7 @@ MODELS['Newspaper endorsements'] = [
     NewspaperEndorsementModel,
     TrumpNewspaperEndorsementModel,
 ]
+MODELS['Weighted endorsements'] = [
+    CongressFollowersModel,
+    NewspaperCirculationModel,
+]
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -45,6 +47,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE_CLASSES = [
     'django.middleware.cache.UpdateCacheMiddleware',
+    # Turns page-cache hits into 304s when the client already has them.
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -128,6 +132,11 @@ USE_L10N = True
 USE_TZ = True
 
 
+# Recompute stale stats pages in a background thread (see
+# endorsements.caching.get_stale_while_revalidate) rather than in the request.
+REFRESH_IN_BACKGROUND = True
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
 
@@ -137,8 +146,35 @@ JQUERY_URL = ''
 INTERNAL_IPS = ['127.0.0.1']
 
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+# Every process shares one cache, so that anything cached (and the version
+# counters in endorsements.caching) is seen by all of them. Without a
+# memcached server, fall back to a directory (on one host only), which has
+# to be set outside of DEBUG.
+#
+# The file-based cache culls a third of its files, chosen at random, once it
+# has MAX_ENTRIES of them. That can throw away the locks and stale copies
+# that endorsements.caching uses to recompute each value only once, so
+# MAX_ENTRIES is set well above the number of entries the site needs.
+if os.environ.get('CACHE_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION').split(','),
+        }
+    }
+else:
+    if not DEBUG and not os.environ.get('CACHE_DIR'):
+        raise ImproperlyConfigured(
+            'Set CACHE_LOCATION (memcached servers) or CACHE_DIR'
+        )
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get(
+                'CACHE_DIR', os.path.join(BASE_DIR, 'cache')
+            ),
+            'OPTIONS': {
+                'MAX_ENTRIES': 1000000,
+            },
+        }
     }
-}
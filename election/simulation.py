@@ -0,0 +1,266 @@
+import math
+import multiprocessing
+
+import numpy
+
+from election.predictions import MODELS
+
+
+# The winner needs more than this many electoral votes (as in
+# get_electoral_vote_winner).
+ELECTORAL_VOTES_TO_WIN = 270
+
+# How much an endorsement margin counts for, relative to the number of
+# endorsements. With a margin of m out of n endorsements, the chance of
+# winning the state is Phi(SIGNAL_STRENGTH * m / sqrt(n + 1)), so a 1-0
+# state is around 76% and a 10-0 state is certain.
+SIGNAL_STRENGTH = 1.0
+
+DEFAULT_TRIALS = 1000000
+
+# Each state's draw is a whole number below this (so that the draws fit in
+# 16 bits), and the chance of Clinton winning it is rounded to a multiple of
+# one over it.
+DRAW_RESOLUTION = 2 ** 16 - 1
+
+# Trials are run (and handed to worker processes) in batches of this many,
+# to keep the random number matrices small.
+BATCH_SIZE = 20000
+
+# Finding the tipping point means sorting every state in a trial for each
+# model, which costs far more than the rest of it, so it's only done for
+# this many trials (enough to estimate how often each state is the tipping
+# point to within a percentage point or so).
+TIPPING_POINT_TRIALS = 20000
+
+
+def get_win_probabilities(clinton_counts, trump_counts):
+    """Returns the chance of Clinton winning each state given the counts a
+    model came up with for it. Ties (including no endorsements) are 50%."""
+    clinton_counts = numpy.asarray(clinton_counts, dtype=float)
+    trump_counts = numpy.asarray(trump_counts, dtype=float)
+    z = (
+        SIGNAL_STRENGTH * (clinton_counts - trump_counts) /
+        numpy.sqrt(clinton_counts + trump_counts + 1)
+    )
+    return numpy.array([0.5 * (1 + math.erf(x / math.sqrt(2))) for x in z])
+
+
+def get_model_counts(engine, model):
+    """Returns the model's Clinton and Trump counts for every state (see
+    PredictionEngine.apply), as get_win_probabilities expects them.
+
+    Weighted models sum followers or circulation, which would make a margin
+    of a few thousand look like thousands of endorsements (and every state
+    certain), so their counts are scaled down to the number of endorsers
+    that were weighed, split by each candidate's share of the weight.
+    """
+    counts = engine.apply(model)
+    # (Not every model is a PredictionModel.)
+    if getattr(model, 'weight', None) is None:
+        return counts['clinton'], counts['trump']
+
+    clinton_weights = numpy.asarray(counts['clinton'], dtype=float)
+    total_weights = clinton_weights + counts['trump']
+    num_endorsers = (
+        engine.count(model.keys, model.clinton_keys) +
+        engine.count(model.keys, model.trump_keys)
+    )
+    clinton_shares = numpy.where(
+        total_weights > 0,
+        clinton_weights / numpy.maximum(total_weights, 1),
+        0.5
+    )
+    return (
+        num_endorsers * clinton_shares,
+        num_endorsers * (1 - clinton_shares),
+    )
+
+
+def simulate_batch(probabilities, electoral_votes, num_trials,
+                   num_tipping_trials, seed):
+    """Runs num_trials trials for each model (a row of probabilities, with
+    a column per state). Returns the histogram of Clinton's electoral votes
+    for each model, and how often each state was the tipping point in the
+    first num_tipping_trials trials.
+
+    Every model is simulated with the same random numbers, so differences
+    between them are down to the models, not the draw.
+    """
+    random = numpy.random.RandomState(seed)
+    num_models, num_states = probabilities.shape
+    total_electoral_votes = int(electoral_votes.sum())
+
+    histograms = numpy.zeros(
+        (num_models, total_electoral_votes + 1), dtype=numpy.int64
+    )
+    tipping_points = numpy.zeros((num_models, num_states), dtype=numpy.int64)
+
+    # Clinton wins a state when its draw is below the model's threshold for
+    # it. Everything is kept in small integers, states x trials, so that all
+    # the models can be compared in one go.
+    draws = random.randint(
+        0, DRAW_RESOLUTION, (num_states, num_trials), dtype=numpy.uint16
+    )
+    thresholds = numpy.round(probabilities * DRAW_RESOLUTION).astype(
+        numpy.uint16
+    )
+    wins = draws[numpy.newaxis] < thresholds[:, :, numpy.newaxis]
+    all_clinton_votes = numpy.einsum(
+        'mst,s->mt', wins.view(numpy.uint8),
+        electoral_votes.astype(numpy.uint16)
+    )
+
+    for m in range(num_models):
+        clinton_votes = all_clinton_votes[m].astype(numpy.int64)
+        histograms[m] += numpy.bincount(
+            clinton_votes, minlength=total_electoral_votes + 1
+        )
+
+        # The tipping point is the state that takes the winner over the
+        # line when states are sorted from their safest to their closest.
+        if not num_tipping_trials:
+            continue
+        # Positive where Clinton wins, and bigger the more safely she does.
+        margins = (
+            thresholds[m].astype(numpy.int32) -
+            draws[:, :num_tipping_trials].T
+        )
+        clinton_votes = clinton_votes[:num_tipping_trials]
+        order = numpy.argsort(-margins, axis=1)
+        clinton_cumulative = numpy.cumsum(electoral_votes[order], axis=1)
+        trump_cumulative = (
+            total_electoral_votes - clinton_cumulative +
+            electoral_votes[order]
+        )
+        clinton_won = clinton_votes > ELECTORAL_VOTES_TO_WIN
+        trump_won = (
+            total_electoral_votes - clinton_votes > ELECTORAL_VOTES_TO_WIN
+        )
+        clinton_tipping = numpy.argmax(
+            clinton_cumulative > ELECTORAL_VOTES_TO_WIN, axis=1
+        )
+        # Trump's states are at the end; find the last one that's needed.
+        trump_tipping = num_states - 1 - numpy.argmax(
+            trump_cumulative[:, ::-1] > ELECTORAL_VOTES_TO_WIN, axis=1
+        )
+        tipping = order[
+            numpy.arange(num_tipping_trials),
+            numpy.where(clinton_won, clinton_tipping, trump_tipping)
+        ]
+        tipping_points[m] += numpy.bincount(
+            tipping[clinton_won | trump_won], minlength=num_states
+        )
+
+    return histograms, tipping_points
+
+
+def simulate_batch_args(args):
+    return simulate_batch(*args)
+
+
+def simulate(probabilities, electoral_votes, trials=DEFAULT_TRIALS,
+             processes=1, seed=None):
+    """Runs the given number of trials for each row of probabilities (see
+    simulate_batch), in batches spread over a pool of processes if
+    processes isn't 1. Returns the histograms, tipping point counts and the
+    number of trials the tipping points were counted for."""
+    probabilities = numpy.atleast_2d(probabilities)
+    electoral_votes = numpy.asarray(electoral_votes, dtype=numpy.int64)
+    if seed is None:
+        seed = numpy.random.randint(2 ** 31 - 1)
+
+    batches = []
+    for i, start in enumerate(xrange(0, trials, BATCH_SIZE)):
+        num_trials = min(BATCH_SIZE, trials - start)
+        batches.append((
+            probabilities,
+            electoral_votes,
+            num_trials,
+            max(0, min(num_trials, TIPPING_POINT_TRIALS - start)),
+            (seed + i) % (2 ** 32),
+        ))
+
+    if processes == 1:
+        results = map(simulate_batch_args, batches)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(simulate_batch_args, batches)
+        finally:
+            pool.close()
+            pool.join()
+
+    histograms = sum(result[0] for result in results)
+    tipping_points = sum(result[1] for result in results)
+    return histograms, tipping_points, min(trials, TIPPING_POINT_TRIALS)
+
+
+def get_percentile(histogram, percentile):
+    """Returns the smallest value with at least `percentile` percent of the
+    histogram's weight at or below it."""
+    cumulative = numpy.cumsum(histogram)
+    return int(numpy.searchsorted(
+        cumulative, cumulative[-1] * percentile / 100.0
+    ))
+
+
+def summarize(name, histogram, tipping_points, tipping_trials, state_names,
+              interval=90, num_tipping_points=5):
+    """Returns Clinton's mean, median and central `interval` percent of
+    electoral votes, each candidate's chance of winning and the states most
+    often the tipping point (with how often they were)."""
+    trials = float(histogram.sum())
+    votes = numpy.arange(len(histogram))
+    tail = (100 - interval) / 2.0
+    clinton_wins = histogram[votes > ELECTORAL_VOTES_TO_WIN].sum()
+    trump_wins = histogram[
+        len(histogram) - 1 - votes > ELECTORAL_VOTES_TO_WIN
+    ].sum()
+
+    tipping_order = numpy.argsort(-tipping_points, kind='mergesort')
+    return {
+        'name': name,
+        'trials': int(trials),
+        'clinton_mean': float((histogram * votes).sum() / trials),
+        'clinton_median': get_percentile(histogram, 50),
+        'clinton_interval': (
+            get_percentile(histogram, tail),
+            get_percentile(histogram, 100 - tail),
+        ),
+        'clinton_chance': clinton_wins / trials,
+        'trump_chance': trump_wins / trials,
+        'tipping_points': [
+            (state_names[s], tipping_points[s] / float(tipping_trials))
+            for s in tipping_order[:num_tipping_points]
+            if tipping_points[s]
+        ],
+        'histogram': histogram.tolist(),
+    }
+
+
+def simulate_models(data, trials=DEFAULT_TRIALS, processes=1, seed=None,
+                    interval=90):
+    """Simulates the election under every model in MODELS, given the
+    election.backtest.BacktestData for the states. Returns a summary for
+    each model (see summarize)."""
+    engine = data.get_engine()
+    models = [
+        model
+        for category_models in MODELS.itervalues()
+        for model in category_models
+    ]
+    probabilities = numpy.vstack([
+        get_win_probabilities(*get_model_counts(engine, model))
+        for model in models
+    ])
+    histograms, tipping_points, tipping_trials = simulate(
+        probabilities, data.electoral_votes, trials, processes, seed
+    )
+    return [
+        summarize(
+            model.name, histograms[m], tipping_points[m], tipping_trials,
+            data.state_names, interval
+        )
+        for m, model in enumerate(models)
+    ]
@@ -0,0 +1,572 @@
+import collections
+import threading
+
+import numpy
+
+from election.predictions import MODELS, PredictionEngine
+from election.utils import get_electoral_vote_winner, predict_winner
+from endorsements.caching import get_or_compute, get_versions, \
+                                  get_stale_while_revalidate, \
+                                  make_versioned_key, refresh_entry
+from endorsements.index import get_endorser_index
+from endorsements.registry import get_registry
+from endorsements.timeline import get_timeline
+from wikipedia.models import ElectoralVotes, ImportedNewspaper, \
+                             ImportedResult
+
+
+# The category with a tag for each state.
+STATE_CATEGORY_PK = 8
+
+# Stats pages are recomputed (in the background) when they're this old, even
+# if nothing they depend on has changed.
+STATS_SOFT_TIMEOUT = 60 * 10
+
+# Pages for past dates are only recomputed when the data changes, but there
+# can be one for every date, so don't keep them around for too long.
+STATS_AS_OF_TIMEOUT = 60 * 60
+
+# The counts shown for each state and candidate, in order: count key, name of
+# the tag (None for all endorsers).
+STATE_COUNT_TAGS = collections.OrderedDict([
+    ('endorsements', None),
+    ('newspapers', 'Publication'),
+    ('politicians', 'Politician'),
+    ('senators', 'Current Senator'),
+    ('representatives', 'Current U.S. Representative'),
+    ('Republicans', 'Republican Party'),
+])
+
+# The endorser groups the prediction models count: endorsers whose current
+# position is one of these (by slug)...
+PREDICTION_POSITIONS = [
+    'clinton',
+    'trump',
+    'pence',
+    'another-republican',
+    'trump-support',
+]
+# ... and key: name of the tag.
+PREDICTION_TAGS = collections.OrderedDict([
+    ('senate', 'Current Senator'),
+    ('house', 'Current U.S. Representative'),
+    ('republican', 'Republican Party'),
+    ('democrat', 'Democratic Party'),
+    ('newspaper', 'Publication'),
+])
+
+
+def get_position_matrix(index, position_pks, positions=None):
+    """Returns a boolean matrix with a row for each of the given position
+    pks (None matches nobody) and a column for each endorser in the index.
+    Endorsers are matched by their current positions or, if given, by their
+    positions in a snapshot from the endorsement timeline."""
+    if positions is None:
+        return index.get_matrix(
+            index.positions.get(pk, 0) if pk is not None else 0
+            for pk in position_pks
+        )
+    return get_timeline().get_matrix(
+        positions, [pk if pk is not None else -1 for pk in position_pks]
+    )
+
+
+def get_state_stats(candidates=None, as_of=None):
+    """The per-state endorsement counts and results shown by stats_states
+    (for the given candidates), as they are now or as they were at the end
+    of the date as_of. Tags aren't dated, so they're always the current
+    ones.
+
+    Everything comes out of a few products of boolean endorser matrices
+    (built from the endorser index) instead of a query per count: states x
+    endorsers, candidates x endorsers (by current position) and count tags x
+    endorsers.
+    """
+    registry = get_registry()
+    index = get_endorser_index()
+    if candidates is None:
+        candidates = registry.running_candidates
+
+    tags = {}
+    for key, tag_name in STATE_COUNT_TAGS.iteritems():
+        if tag_name is not None:
+            tags[key] = registry.get_tag(tag_name)
+
+    votes = collections.defaultdict(dict)
+    results = ImportedResult.objects.filter(
+        tag__category_id=STATE_CATEGORY_PK
+    ).values_list('tag_id', 'candidate_id', 'count')
+    for tag_pk, candidate_pk, count in results:
+        votes[tag_pk][candidate_pk] = count
+
+    # Only states with results are shown.
+    state_tags = [
+        state_tag
+        for state_tag in registry.category_tags.get(STATE_CATEGORY_PK, [])
+        if state_tag.pk in votes
+    ]
+
+    positions = set(
+        candidate.position.pk for candidate in candidates
+        if candidate.position is not None
+    )
+    other_positions = [
+        position for position in registry.positions
+        if position.pk not in positions
+    ]
+
+    if as_of is None:
+        positions = None
+    else:
+        positions = get_timeline().get_positions(as_of)
+
+    def get_matrix(bitmaps):
+        matrix = index.get_matrix(bitmaps)
+        if positions is not None:
+            # Leave out endorsers who hadn't endorsed anyone yet.
+            matrix &= positions != 0
+        return matrix.astype(numpy.int32)
+
+    state_matrix = get_matrix(
+        index.tags.get(state_tag.pk, 0) for state_tag in state_tags
+    )
+    candidate_matrix = get_position_matrix(
+        index,
+        [
+            candidate.position.pk if candidate.position is not None else None
+            for candidate in candidates
+        ],
+        positions
+    ).astype(numpy.int32)
+    count_matrix = get_matrix(
+        index.tags.get(tags[key].pk, 0) if key in tags else index.all
+        for key in STATE_COUNT_TAGS
+    )
+    other_matrix = get_position_matrix(
+        index, [position.pk for position in other_positions], positions
+    ).astype(numpy.int32)
+
+    # state x candidate x count
+    candidate_counts_by_state = numpy.einsum(
+        'sn,cn,kn->sck', state_matrix, candidate_matrix, count_matrix
+    )
+    # state x count
+    state_counts = state_matrix.dot(count_matrix.T)
+    # state x other position
+    other_counts = state_matrix.dot(other_matrix.T)
+
+    candidate_counts = collections.defaultdict(collections.Counter)
+    max_counts = collections.defaultdict(dict)
+    states = []
+    for s, state_tag in enumerate(state_tags):
+        state_votes = votes[state_tag.pk]
+
+        candidate_values = []
+        for c, candidate in enumerate(candidates):
+            counts = collections.OrderedDict(
+                (key, int(candidate_counts_by_state[s, c, k]))
+                for k, key in enumerate(STATE_COUNT_TAGS)
+            )
+            candidate_votes = state_votes.get(candidate.pk, 0)
+
+            candidate_counts[candidate.pk].update(counts)
+            candidate_counts[candidate.pk]['votes'] += candidate_votes
+            for key, value in counts.items() + [('votes', candidate_votes)]:
+                max_counts[candidate.pk][key] = max(
+                    value, max_counts[candidate.pk].get(key, value)
+                )
+
+            candidate_values.append({
+                'votes': candidate_votes,
+                'counts': [
+                    (key, value, tags.get(key))
+                    for key, value in counts.iteritems()
+                ],
+                'rgb': candidate.rgb,
+            })
+
+        # Figure out the opacity level for each cell in this row.
+        total_votes = sum(state_votes.values())
+        max_votes = max(state_votes.values())
+        winning_color = None
+        for candidate_value in candidate_values:
+            if total_votes:
+                ratio = candidate_value['votes'] / float(total_votes)
+            else:
+                ratio = 0.0
+            candidate_value['percent'] = ratio * 100
+            candidate_value['ratio'] = '{:2.2f}'.format(ratio)
+            candidate_won = candidate_value['votes'] == max_votes
+            candidate_value['won'] = candidate_won
+            if candidate_won:
+                winning_color = candidate_value['rgb']
+
+        state_other_positions = []
+        for p, position in enumerate(other_positions):
+            count = int(other_counts[s, p])
+            if count > 0:
+                state_other_positions.append({
+                    'name': position.get_present_display(),
+                    'count': count,
+                    'slug': position.slug,
+                })
+
+        states.append({
+            'pk': state_tag.pk,
+            'name': state_tag.name,
+            'candidates': candidate_values,
+            'counts': [
+                (key, int(state_counts[s, k]), tags.get(key))
+                for k, key in enumerate(STATE_COUNT_TAGS)
+            ],
+            'votes': total_votes,
+            'winning_color': winning_color,
+            'other_positions': state_other_positions,
+            'num_other_positions': int(other_counts[s].sum()),
+        })
+
+    return {
+        'as_of': as_of,
+        'states': states,
+        'candidates': candidates,
+        'candidate_counts': [
+            (c, dict(candidate_counts[c.pk]), max_counts[c.pk])
+            for c in candidates
+        ],
+    }
+
+
+def get_percent(count, total):
+    if total:
+        return count / float(total) * 100
+    return 0.0
+
+
+# category name: is personal
+CATEGORY_NAMES = {
+    'Gender': True,
+    'Race/ethnicity': True,
+    'Organizations': False,
+}
+def get_tag_stats():
+    registry = get_registry()
+    candidates = registry.running_candidates
+    index = get_endorser_index()
+
+    # One column per candidate (their current supporters), then Other.
+    columns = []
+    for candidate in candidates:
+        if candidate.position is None:
+            columns.append(0)
+        else:
+            columns.append(index.positions.get(candidate.position.pk, 0))
+    candidates_bitmap = 0
+    for column in columns:
+        candidates_bitmap |= column
+    columns.append(index.all & ~candidates_bitmap)
+
+    categories = []
+    for category_name, is_personal in CATEGORY_NAMES.iteritems():
+        category = registry.get_category(category_name)
+        tags = registry.category_tags.get(category.pk, [])
+        tag_bitmaps = [index.tags.get(tag.pk, 0) for tag in tags]
+        category_bitmap = 0
+        for tag_bitmap in tag_bitmaps:
+            category_bitmap |= tag_bitmap
+
+        if is_personal:
+            type_bitmap = index.personal
+        else:
+            type_bitmap = index.all & ~index.personal
+        type_columns = [column & type_bitmap for column in columns]
+
+        # Everything on the page comes from this one table: a row for the
+        # whole category, one for each of its tags, and one with the total
+        # number of endorsers (of this type) in each column.
+        rows = [category_bitmap] + tag_bitmaps + [index.all]
+        counts = index.crosstab(rows, type_columns)
+        category_counts = counts[0]
+        tag_counts = counts[1:-1]
+        column_totals = counts[-1]
+
+        category_candidates = [
+            {
+                'num_tagged': num_tagged,
+                'percent_reporting': get_percent(num_tagged, total),
+            }
+            for num_tagged, total in zip(category_counts, column_totals)
+        ]
+
+        category_tags = []
+        for tag, counts in zip(tags, tag_counts):
+            category_tags.append({
+                'name': tag.name,
+                'candidates': [
+                    {'num_tagged': num_tagged} for num_tagged in counts
+                ],
+            })
+
+        num_tagged = index.count(category_bitmap)
+        categories.append({
+            'name': category.name,
+            'candidates': category_candidates,
+            'tags': category_tags,
+            'num_tagged': num_tagged,
+            'percent_reporting': get_percent(
+                num_tagged, index.count(index.all)
+            ),
+        })
+
+    return {
+        'candidates': candidates,
+        'categories': categories,
+    }
+
+
+def get_position_vectors(index, registry, positions=None):
+    """Returns a boolean vector over the endorser index's endorsers for each
+    of PREDICTION_POSITIONS (see get_position_matrix for `positions`)."""
+    matrix = get_position_matrix(
+        index,
+        [registry.get_position(key).pk for key in PREDICTION_POSITIONS],
+        positions
+    )
+    return dict(zip(PREDICTION_POSITIONS, matrix))
+
+
+def get_endorser_vectors(index, registry, positions=None):
+    """Returns a boolean vector over the endorser index's endorsers for each
+    group in PREDICTION_POSITIONS and PREDICTION_TAGS."""
+    vectors = get_position_vectors(index, registry, positions)
+    tag_matrix = index.get_matrix(
+        index.tags.get(registry.get_tag(tag_name).pk, 0)
+        for tag_name in PREDICTION_TAGS.itervalues()
+    )
+    vectors.update(zip(PREDICTION_TAGS, tag_matrix))
+    return vectors
+
+
+_weights = None
+_weights_lock = threading.Lock()
+
+
+def get_endorser_weights(index):
+    """Returns the weights used by the weighted prediction models, as
+    integer arrays over the endorser index's endorsers: 'followers' (the
+    most followers of any of the endorser's accounts) and 'circulation' (of
+    the newspaper, from the Wikipedia import). They're rebuilt only when the
+    endorsers or imports change."""
+    global _weights
+    version = (index.version, get_versions('imports'))
+    weights = _weights
+    if weights is None or weights[0] != version:
+        with _weights_lock:
+            if _weights is None or _weights[0] != version:
+                circulation = numpy.zeros(len(index.pks), dtype=numpy.int64)
+                newspapers = ImportedNewspaper.objects.filter(
+                    confirmed_endorser__isnull=False,
+                    circulation__isnull=False,
+                ).values_list('confirmed_endorser_id', 'circulation')
+                for endorser_pk, newspaper_circulation in newspapers:
+                    row = index.rows.get(endorser_pk)
+                    if row is not None:
+                        circulation[row] = max(
+                            circulation[row], newspaper_circulation
+                        )
+                _weights = (version, {
+                    'followers': index.followers,
+                    'circulation': circulation,
+                })
+            weights = _weights
+    return weights[1]
+
+
+def get_prediction_states(registry):
+    """Returns the states that have results (for Clinton and Trump), each
+    with its tag and the actual result."""
+    clinton_pk = registry.get_position('clinton').pk
+    trump_pk = registry.get_position('trump').pk
+
+    results = collections.defaultdict(dict)
+    results_query = ImportedResult.objects.filter(
+        candidate__in=[clinton_pk, trump_pk]
+    ).values_list('tag_id', 'candidate_id', 'percent')
+    for tag_pk, candidate_pk, percent in results_query:
+        results[tag_pk][candidate_pk] = percent
+
+    states = []
+    for state_tag in registry.category_tags.get(STATE_CATEGORY_PK, []):
+        if state_tag.pk not in results:
+            continue
+
+        # Find the actual vote spread.
+        clinton_percent = results[state_tag.pk][clinton_pk]
+        trump_percent = results[state_tag.pk][trump_pk]
+
+        votes = predict_winner(
+            clinton_percent,
+            trump_percent,
+            5,
+            is_percent=True
+        )
+
+        states.append({
+            'name': state_tag.name,
+            'tag': state_tag,
+            'votes': votes,
+        })
+
+    return states
+
+
+def get_prediction_engine(states, as_of=None):
+    """Returns a PredictionEngine for the given states (as returned by
+    get_prediction_states), using endorsers' positions as of the given date
+    (or their current ones)."""
+    registry = get_registry()
+    index = get_endorser_index()
+    if as_of is None:
+        positions = None
+    else:
+        positions = get_timeline().get_positions(as_of)
+    state_matrix = index.get_matrix(
+        index.tags.get(state['tag'].pk, 0) for state in states
+    )
+    return PredictionEngine(
+        state_matrix,
+        get_endorser_vectors(index, registry, positions),
+        get_endorser_weights(index)
+    )
+
+
+def get_prediction_stats(as_of=None):
+    registry = get_registry()
+    states = get_prediction_states(registry)
+    engine = get_prediction_engine(states, as_of)
+
+    electoral_votes = {
+        e.state.name: e.count for e in ElectoralVotes.objects.all()
+    }
+
+    # Apply all the different models (to every state at once).
+    categories = []
+    for category, category_models in MODELS.iteritems():
+        category_states = []
+        model_counts = [engine.apply(model) for model in category_models]
+        for s, state in enumerate(states):
+            state_models = []
+            for model, counts in zip(category_models, model_counts):
+                model_data = predict_winner(
+                    int(counts['clinton'][s]),
+                    int(counts['trump'][s]),
+                    model.threshold,
+                )
+                state_models.append(model_data)
+
+            # Figure out which models were correct
+            for model_data in state_models:
+                model_data['correct_candidate'] = (
+                    model_data['color'] == state['votes']['color']
+                )
+                model_data['correct_size'] = (
+                    model_data['correct_candidate'] and
+                    model_data['basic'] == state['votes']['basic']
+                )
+
+            category_states.append({
+                'name': state['name'],
+                'votes': state['votes'],
+                'models': state_models,
+                'electoral_votes': electoral_votes[state['name']],
+            })
+
+        model_summaries = []
+        for i, model in enumerate(category_models):
+            clinton_electoral_votes = sum(
+                state['electoral_votes']
+                for state in category_states
+                if state['models'][i]['winner'] == 'clinton'
+            )
+            trump_electoral_votes = sum(
+                state['electoral_votes']
+                for state in category_states
+                if state['models'][i]['winner'] == 'trump'
+            )
+
+            electoral_vote_winner = get_electoral_vote_winner(
+                clinton_electoral_votes, trump_electoral_votes
+            )
+
+            model_summaries.append({
+                'name': model.name,
+                'num_correct_candidate': sum(
+                    state['models'][i]['correct_candidate']
+                    for state in category_states
+                ),
+                'num_correct_size': sum(
+                    state['models'][i]['correct_size']
+                    for state in category_states
+                ),
+                'clinton_electoral_votes': clinton_electoral_votes,
+                'trump_electoral_votes': trump_electoral_votes,
+                'electoral_vote_winner': electoral_vote_winner,
+            })
+
+        categories.append({
+            'name': category,
+            'states': category_states,
+            'models': model_summaries,
+        })
+
+    return {
+        'as_of': as_of,
+        'categories': categories,
+    }
+
+
+# name: (the namespaces the page depends on, function that computes it)
+STATS_PAGES = {
+    'states': (
+        ('endorsers', 'tags', 'positions', 'results'), get_state_stats
+    ),
+    'tags': (
+        ('endorsers', 'tags', 'positions'), get_tag_stats
+    ),
+    'predictions': (
+        ('endorsers', 'tags', 'positions', 'results', 'imports'),
+        get_prediction_stats
+    ),
+}
+
+
+# The stats pages that can be shown as of a past date.
+DATED_STATS_PAGES = ('states', 'predictions')
+
+
+def get_stats(name, as_of=None):
+    """Returns the context for the named stats page. Once a page has been
+    computed, requests never wait for it again: if it's out of date, the
+    last version is returned while it's recomputed in the background.
+
+    Pages for past dates are cached until anything they depend on changes.
+    """
+    namespaces, compute = STATS_PAGES[name]
+    if as_of is not None:
+        cache_key = make_versioned_key(
+            'stats_' + name, namespaces, as_of.isoformat()
+        )
+        return get_or_compute(
+            cache_key, lambda: compute(as_of=as_of), STATS_AS_OF_TIMEOUT
+        )
+
+    return get_stale_while_revalidate(
+        'stats_' + name, namespaces, compute, STATS_SOFT_TIMEOUT
+    )
+
+
+def refresh_stats(names=None):
+    """Recomputes the given stats pages (all of them by default) right
+    away, e.g., after an import."""
+    for name in names or STATS_PAGES:
+        namespaces, compute = STATS_PAGES[name]
+        refresh_entry('stats_' + name, namespaces, compute)
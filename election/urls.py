@@ -28,6 +28,11 @@ urlpatterns = [
     url(r'^api/tags.json', views.get_tags, name='get_tags'),
     url(r'^api/search.json', views.search_endorsers,
         name='search_endorsers'),
+    url(r'^api/fulltext.json', views.search_full_text,
+        name='search_full_text'),
+    url(r'^api/predictions/series.json', views.get_prediction_series_data,
+        name='get_prediction_series'),
+    url(r'^api/predictions/what-if.json', views.what_if, name='what_if'),
     url(r'^endorser/$', views.add_endorser,
         name='add-endorser'),
     url(r'^endorser/(?P<pk>\d+)/$', views.view_endorser,
@@ -1,3 +1,10 @@
+import base64
+import datetime
+import json
+
+import numpy
+
+
 def predict_winner(clinton_stat, trump_stat, threshold, is_percent=False):
     difference = clinton_stat - trump_stat
     abs_difference = abs(difference)
@@ -28,3 +35,57 @@ def predict_winner(clinton_stat, trump_stat, threshold, is_percent=False):
         'trump': trump_stat,
         'suffix': '%' if is_percent else '',
     }
+
+
+def predict_winners(clinton_stats, trump_stats, threshold):
+    """The vectorized version of predict_winner. Returns an array with 1
+    where Clinton wins, -1 where Trump wins and 0 for ties, along with a
+    boolean array of which of the predictions are "basic" (close)."""
+    clinton_stats = numpy.asarray(clinton_stats)
+    trump_stats = numpy.asarray(trump_stats)
+    difference = clinton_stats - trump_stats
+    abs_difference = numpy.abs(difference)
+    max_stat = numpy.maximum(clinton_stats, trump_stats)
+    basic = (
+        (difference != 0) &
+        (abs_difference <= threshold) &
+        (abs_difference != max_stat)
+    )
+    return numpy.sign(difference), basic
+
+
+def get_electoral_vote_winner(clinton_electoral_votes,
+                              trump_electoral_votes):
+    if clinton_electoral_votes > 270:
+        return 'blue'
+    elif trump_electoral_votes > 270:
+        return 'red'
+    else:
+        return 'grey'
+
+
+def encode_cursor(version, sort_value, key, pk):
+    """Returns an opaque token pointing just past the endorser with the given
+    pk (and sort key), for keyset pagination."""
+    data = json.dumps([version, sort_value, key, pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def decode_cursor(cursor):
+    """The inverse of encode_cursor. Returns a (version, sort_value, key, pk)
+    tuple, or raises ValueError if the token isn't valid."""
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(str(cursor) + padding))
+    except (TypeError, UnicodeEncodeError):
+        raise ValueError('Invalid cursor')
+
+    if type(data) != list or len(data) != 4:
+        raise ValueError('Invalid cursor')
+
+    return tuple(data)
+
+
+def parse_date(value):
+    """Parses a YYYY-MM-DD date, raising ValueError if it isn't one."""
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
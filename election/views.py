@@ -1,294 +1,313 @@
 import collections
+import datetime
 import json
 import random
 
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
-from django.core.cache import cache
-from django.db.models import Count, Max, Min
 from django.http import Http404, JsonResponse
 from django.shortcuts import redirect, render, get_object_or_404
 from django.urls import reverse
 from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
-
-from election.predictions import MODELS
-from election.utils import predict_winner
+from django.utils.cache import patch_cache_control
+from django.utils.http import urlencode
+from django.views.decorators.http import require_http_methods, require_POST
+
+from election.backtest import WINNERS, get_current_backtest_data, \
+                              get_prediction_series, get_variant_counts, \
+                              parse_variant, score_counts
+from election.stats import STATS_PAGES, get_stats
+from election.utils import encode_cursor, decode_cursor, parse_date, \
+                           predict_winner
+from endorsements.caching import cached_json_response, get_data_version, \
+                                  make_cache_key, make_versioned_key
+from endorsements.index import SORT_VALUES, get_endorser_index
+from endorsements.registry import get_registry
+from endorsements.search import get_autocomplete_index, \
+                                 get_full_text_index, normalize
+from endorsements.timeline import get_timeline
 from endorsements.forms import EndorsementForm, SourceForm, \
                                EndorsementFormWithoutPosition, \
                                PersonalTagForm, EndorserForm, \
                                OrganizationTagForm, \
                                TagFilterForm
-from endorsements.models import Account, Endorser, Candidate, Source, Quote, \
-                                Tag, Endorsement, Category, Position
-from endorsements.templatetags.endorsement_extras import shorten
+from endorsements.models import Account, Endorser, Source, Quote, Tag, \
+                                Endorsement, Position, EndorserCard, \
+                                EndorserCounter
 from wikipedia.models import BulkImport, ImportedEndorsement, NEWSPAPER_SLUG, \
-                             ImportedNewspaper, ImportedResult, \
-                             ImportedRepresentative, ElectoralVotes
+                             ImportedNewspaper, ImportedRepresentative
+from wikipedia.resolver import resolve_endorsers
 
 
 def search_endorsers(request):
-    query = request.GET.get('q')
-    endorsers = []
-    endorser_pks = set()
-    if query:
-        # First find the endorsers whose names start with this query.
-        results = Endorser.objects.filter(name__istartswith=query)
-        for endorser in results[:5]:
-            endorser_pks.add(endorser.pk)
-            endorsers.append(endorser)
-
-        if results.count() < 5:
-            results = Endorser.objects.filter(name__icontains=query)
-            for endorser in results:
-                if endorser.pk in endorser_pks:
-                    continue
-
-                endorsers.append(endorser)
-                if len(endorsers) == 5:
-                    break
+    query = normalize(request.GET.get('q', ''))
+    index = get_autocomplete_index()
+
+    def get_results():
+        endorsers = []
+        if query:
+            endorsers = index.search(query)
+        return {
+            'endorsers': [{'pk': pk, 'name': name} for pk, name in endorsers],
+        }
+
+    cache_key = make_cache_key('search', query, index.version)
+    return cached_json_response(request, cache_key, get_results)
+
+
+PAGE_SIZE = 12
 
-    return JsonResponse({
-        'endorsers': [{'pk': e.pk, 'name': e.name} for e in endorsers],
-    })
+
+def get_tag_pks(filter_params, key):
+    tag_pks = []
+    tags = filter_params.get(key)
+    if type(tags) == list:
+        for tag_pk in tags:
+            try:
+                tag_pks.append(int(tag_pk))
+            except (TypeError, ValueError):
+                pass
+    return tag_pks
 
 
-def get_endorsers(filter_params, sort_params, skip=0):
-    filters = {}
+def filter_endorsers(index, filter_params):
+    """Returns the bitmap of endorsers in the index matching the mode and tag
+    filters (but not the candidate) in filter_params."""
     mode = filter_params.get('mode')
     if mode == 'personal':
-        filters['is_personal'] = True
+        is_personal = True
     elif mode == 'organization':
-        filters['is_personal'] = False
-
-    if filters:
-        endorser_query = Endorser.objects.filter(**filters)
+        is_personal = False
     else:
-        endorser_query = Endorser.objects.all()
+        is_personal = None
 
-    # Tags can't be placed in the filters dictionary because we may have to do
-    # multiple filters.
-    tags = filter_params.get('tags')
-    if type(tags) == list and tags:
-        for tag_pk in tags:
-            endorser_query = endorser_query.filter(tags=tag_pk)
+    return index.filter(
+        is_personal=is_personal,
+        tags=get_tag_pks(filter_params, 'tags'),
+        any_tags=get_tag_pks(filter_params, 'tags_show'),
+        hide_tags=get_tag_pks(filter_params, 'tags_hide'),
+    )
+
+
+def get_endorsers(filter_params, sort_params, cursor=None, version=None):
+    """Returns one page of endorser cards matching the given filters. The
+    cursor (if given) is a dict with the sort `key` and `pk` of the last
+    endorser on the previous page.
+
+    Endorsers must have all of the tags in filter_params['tags'], at least one
+    of those in filter_params['tags_show'] (if any), and none of those in
+    filter_params['tags_hide'] (see TagFilterForm).
+    """
+    index = get_endorser_index()
+    endorsers_bitmap = filter_endorsers(index, filter_params)
 
     # Before we apply any candidate-specific filters, we need a count of all
     # the endorsers associated with each position.
-    if skip == 0:
-        position_totals = collections.Counter()
-        for endorser in endorser_query.prefetch_related('current_position'):
-            position_totals['all'] += 1
-            if endorser.current_position:
-                position = endorser.current_position
-            else:
-                endorsement = endorser.get_current_endorsement()
-                if endorsement:
-                    position = endorsement.position
-                else:
-                    position = None
-
-            if position:
-                position_totals[position.pk] += 1
+    position_totals = index.get_facets(endorsers_bitmap, index.positions)
+    position_totals['all'] = index.count(endorsers_bitmap)
 
+    all_positions = get_registry().positions
     candidate = filter_params.get('candidate')
     show_extra_positions = False
     if candidate:
-        try:
-            position = Position.objects.get(slug=candidate)
-
-            endorser_query = endorser_query.filter(current_position=position)
-            # If this position is one of the extra positions, make sure those
-            # are visible on page load.
-            show_extra_positions = not position.show_on_load
-        except Position.DoesNotExist:
-            pass
+        for position in all_positions:
+            if position.slug == candidate:
+                endorsers_bitmap &= index.positions.get(position.pk, 0)
+                # If this position is one of the extra positions, make sure
+                # those are visible on page load.
+                show_extra_positions = not position.show_on_load
+                break
 
     sort_value = sort_params.get('value')
-    sort_key = None
-    annotation_key = None
-    if sort_value == 'most':
-        sort_key = '-max_followers'
-    elif sort_value == 'least':
-        sort_key = 'max_followers'
-    elif sort_value == 'newest':
-        sort_key = '-sort_key'
-        annotation_key = Max('endorsement__quote__date')
-    elif sort_value == 'oldest':
-        sort_key = 'sort_key'
-        annotation_key = Min('endorsement__quote__date')
-    elif sort_value == 'az':
-        sort_key = 'name'
-    elif sort_value == 'za':
-        sort_key = '-name'
-
-    if sort_key:
-        if annotation_key:
-            endorser_query = endorser_query.annotate(
-                sort_key=annotation_key
-            )
-        endorser_query = endorser_query.order_by(sort_key)
-        # This is only needed when ordering by endorsement (otherwise,
-        # duplicates may show up based on their endorsement date).
-
-    category_names = {}
-    for tag in Tag.objects.all().prefetch_related('category'):
-        category_names[tag.pk] = tag.category.name
-
-    # Figure out which endorsers are also candidates.
-    candidate_endorser_pks = set()
-    for candidate in Candidate.objects.values('endorser_link'):
-        candidate_endorser_pks.add(candidate['endorser_link'])
-
-    endorser_query = endorser_query.prefetch_related(
-        'tags',
-        'endorsement_set__position',
-        'endorsement_set__quote',
-        'endorsement_set__quote__source',
-        'endorsement_set__quote__event',
-        'account_set'
+    if sort_value not in SORT_VALUES:
+        sort_value = 'most'
+
+    # Keyset pagination: pick up just after the last endorser on the previous
+    # page, using the primary key to break ties.
+    if cursor is not None:
+        after = (cursor['key'], cursor['pk'])
+    else:
+        after = None
+    endorser_pks, page_end = index.get_page(
+        endorsers_bitmap, sort_value, PAGE_SIZE, after
     )
+
     endorsers = []
-    for endorser in endorser_query[skip:skip + 12]:
-        tags = []
-        for tag in endorser.tags.all():
-            tags.append((tag.name, tag.pk))
-
-        endorsements = []
-        previous_position = None
-        position_pks = set()
-        for i, endorsement in enumerate(endorser.endorsement_set.all()):
-            # Ignore a position if it's the same as the previous one.
-            position = endorsement.position
-            if i == 0:
-                display = position.get_present_display()
-            else:
-                display = position.get_past_display()
-
-            quote = endorsement.quote
-            source = quote.source
-            event = quote.event
-            if event:
-                if event.start_date == event.end_date:
-                    event_dates = event.start_date.strftime('%b %d, %Y')
-                else:
-                    event_dates = '{start} to {end}'.format(
-                        start=event.start_date.strftime('%b %d, %Y'),
-                        end=event.end_date.strftime('%b %d, %Y')
-                    )
-            else:
-                event_dates = None
-
-            endorsements.append({
-                'c': endorsement.position.colour,
-                'di': display,
-                'q': quote.text,
-                'cx': quote.context,
-                'ecx': quote.get_event_context(),
-                'e': event.name if event else '',
-                'ed': event_dates,
-                'da': quote.get_date_display(),
-                'su': source.url,
-                'sd': source.get_date_display(),
-                'sn': source.name,
-            })
+    cards = EndorserCard.objects.in_bulk(endorser_pks)
+    for endorser_pk in endorser_pks:
+        card = cards.get(endorser_pk)
+        if card is None:
+            card = Endorser.objects.get(pk=endorser_pk).refresh_card()
+        endorsers.append(card.get_data())
+
+    # Only hand out a cursor if there's something after this page.
+    next_cursor = None
+    if page_end is not None:
+        next_cursor = encode_cursor(
+            version, sort_value, page_end[0], page_end[1]
+        )
 
-        accounts = []
-        max_followers = 0
-        for account in endorser.account_set.all():
-            if account.followers_count > max_followers:
-                max_followers = account.followers_count
+    # The number of endorsers that would be left after adding each tag to the
+    # current filters (including the candidate).
+    tag_totals = index.get_facets(endorsers_bitmap, index.tags)
 
-            accounts.append({
-                'u': account.screen_name,
-                'n': shorten(account.followers_count),
-            })
+    # Facet counts are cheap to compute, so every page gets them.
+    to_return = {
+        'endorsers': endorsers,
+        'next': next_cursor,
+        'version': version,
+        'tag_counts': tag_totals,
+    }
 
-        # Don't bother checking if it's a candidate unless there are no
-        # endorsements.
-        is_candidate = False
-        if not endorsements and endorser.pk in candidate_endorser_pks:
-            is_candidate = True
+    positions = [
+        {
+            'name': 'All',
+            'slug': 'all',
+            'colour': 'grey',
+            'count': position_totals['all'],
+        }
+    ]
+    extra_positions = []
+    position_query = sorted(
+        all_positions,
+        key=lambda position: position_totals.get(position.pk, 0),
+        reverse=True,
+    )
+    for position in position_query:
+        if position.show_on_load:
+            to_append_to = positions
+        else:
+            to_append_to = extra_positions
 
-        description = endorser.description
-        if description:
-            if len(description) > 80:
-                description = description[:80] + '...'
+        if position.present_tense_prefix == 'Endorses':
+            name = position.suffix
         else:
-            description = 'No description'
+            name = position.get_present_display()
 
-        endorsers.append({
-            'p': endorser.pk,
-            'n': endorser.name,
-            'u': endorser.url,
-            'd': description,
-            't': tags,
-            'e': endorsements,
-            'a': accounts,
-            'c': is_candidate,
-            'i': 'missing' if endorser.missing_image else endorser.pk,
-        })
+        position_count = position_totals.get(position.pk, 0)
+        if position_count > 0:
+            to_append_to.append({
+                'name': name,
+                'slug': position.slug,
+                'colour': position.colour,
+                'count': position_count,
+            })
 
-    to_return = {
-        'endorsers': endorsers,
+    to_return['positions'] = positions
+    to_return['extra_positions'] = extra_positions
+    to_return['show_extra_positions'] = show_extra_positions
+
+    return to_return
+
+
+FULL_TEXT_SORT = 'relevance'
+
+
+def search_full_text(request):
+    """Endorsers whose quotes, quote contexts or descriptions contain all of
+    the words in `q`, best match first, with the same mode, candidate and tag
+    filters as get_endorsers (passed as query parameters)."""
+    query = request.GET.get('q', '')
+    filter_params = {
+        'mode': request.GET.get('mode'),
+        'candidate': request.GET.get('candidate'),
+        'tags': request.GET.getlist('tags'),
+        'tags_show': request.GET.getlist('tags_show'),
+        'tags_hide': request.GET.getlist('tags_hide'),
     }
 
-    # Only return position-related data if it's the first page.
-    if skip == 0:
-        positions = [
-            {
-                'name': 'All',
-                'slug': 'all',
-                'colour': 'grey',
-                'count': position_totals['all'],
-            }
-        ]
-        extra_positions = []
-        position_query = Position.objects.annotate(count=Count('endorser'))
-        for position in position_query.order_by('-count'):
-            if position.show_on_load:
-                to_append_to = positions
-            else:
-                to_append_to = extra_positions
+    cursor = request.GET.get('cursor')
+    after = None
+    if cursor:
+        try:
+            version, cursor_sort, last_key, last_pk = decode_cursor(cursor)
+        except ValueError:
+            cursor_sort = None
 
-            if position.present_tense_prefix == 'Endorses':
-                name = position.suffix
-            else:
-                name = position.get_present_display()
-
-            position_count = position_totals[position.pk]
-            if position_count > 0:
-                to_append_to.append({
-                    'name': name,
-                    'slug': position.slug,
-                    'colour': position.colour,
-                    'count': position_count,
-                })
+        if cursor_sort != FULL_TEXT_SORT:
+            return JsonResponse({
+                'error': True,
+                'message': 'Invalid cursor',
+            })
+        after = (last_key, last_pk)
 
-        to_return['positions'] = positions
-        to_return['extra_positions'] = extra_positions
-        to_return['show_extra_positions'] = show_extra_positions
+    endorser_index = get_endorser_index()
+    endorsers_bitmap = filter_endorsers(endorser_index, filter_params)
+    candidate = filter_params['candidate']
+    if candidate:
+        position = get_registry().positions_by_slug.get(candidate)
+        if position is None:
+            endorsers_bitmap = 0
+        else:
+            endorsers_bitmap &= endorser_index.positions.get(position.pk, 0)
+
+    index = get_full_text_index()
+    # Scores change along with the index, so a cursor from an older version
+    # can't say where to pick up.
+    if cursor and version != index.version:
+        return JsonResponse({
+            'error': True,
+            'message': 'The results have changed; start from the first page',
+        })
 
-    return to_return
+    terms, results, best_documents = index.search(
+        query, endorser_pks=set(endorser_index.get_pks(endorsers_bitmap))
+    )
+    page, page_end = index.get_page(results, PAGE_SIZE, after)
+
+    endorser_pks = [pk for score, pk in page]
+    cards = EndorserCard.objects.in_bulk(endorser_pks)
+    endorsers = []
+    for score, endorser_pk in page:
+        card = cards.get(endorser_pk)
+        if card is None:
+            card = Endorser.objects.get(pk=endorser_pk).refresh_card()
+        endorsers.append({
+            'endorser': card.get_data(),
+            'score': -score,
+            'snippet': index.get_snippet(best_documents[endorser_pk], terms),
+        })
+
+    next_cursor = None
+    if page_end is not None:
+        next_cursor = encode_cursor(
+            index.version, FULL_TEXT_SORT, page_end[0], page_end[1]
+        )
+
+    return JsonResponse({
+        'results': endorsers,
+        'count': len(results),
+        'next': next_cursor,
+    })
 
 
 @csrf_exempt
 def get_tags(request):
-    category_tags = collections.defaultdict(list)
-    for tag in Tag.objects.all():
-        category_tags[tag.category.pk].append({
-            'name': tag.name,
-            'pk': tag.pk,
-        })
+    cache_key = make_versioned_key('tags', ('tags',))
+    return cached_json_response(
+        request, cache_key, get_tag_data, stale_key='tags_stale'
+    )
 
+
+def get_tag_data():
+    registry = get_registry()
     org_tags = []
     personal_tags = []
-    for category_pk in category_tags:
-        category = Category.objects.get(pk=category_pk)
+    for category in registry.categories:
+        category_tags = registry.category_tags.get(category.pk)
+        if not category_tags:
+            continue
+
         tag = {
             'name': category.name,
-            'tags': category_tags[category_pk],
+            'tags': [
+                {
+                    'name': category_tag.name,
+                    'pk': category_tag.pk,
+                }
+                for category_tag in category_tags
+            ],
             'exclusive': category.is_exclusive,
         }
         if category.allow_org:
@@ -296,74 +315,183 @@ def get_tags(request):
         if category.allow_personal:
             personal_tags.append(tag)
 
-    return JsonResponse({
+    return {
         'org': org_tags,
         'personal': personal_tags,
-    })
+    }
+
+
+# How long HTTP caches can keep the first page of a result set (which changes
+# whenever the data does) and later pages (whose cursors pin the version).
+FIRST_PAGE_MAX_AGE = 60
+CURSOR_PAGE_MAX_AGE = 60 * 60
+
+
+def parse_tag_list(value):
+    """Turns a comma-separated list of tag pks into a sorted list of unique
+    ints, ignoring anything that isn't a number."""
+    tag_pks = set()
+    for tag_pk in value.split(','):
+        try:
+            tag_pks.add(int(tag_pk))
+        except ValueError:
+            pass
+    return sorted(tag_pks)
+
+
+def get_endorsements_query(filter_params, sort_value, cursor=None):
+    """Returns the canonical query string for /api/endorsements.json: default
+    values are left out, tags are sorted and the parameters always come in
+    the same order, so equal queries always have identical URLs."""
+    params = []
+    mode = filter_params.get('mode')
+    if mode in ('personal', 'organization'):
+        params.append(('mode', mode))
+    candidate = filter_params.get('candidate')
+    if candidate and candidate != 'all':
+        params.append(('candidate', candidate))
+    for key in ('tags', 'tags_show', 'tags_hide'):
+        tag_pks = sorted(set(get_tag_pks(filter_params, key)))
+        if tag_pks:
+            params.append((key, ','.join(map(str, tag_pks))))
+    if sort_value != 'most':
+        params.append(('sort', sort_value))
+    if cursor:
+        params.append(('cursor', cursor))
+    return urlencode(params)
 
 
-@require_POST
 @csrf_exempt
+@require_http_methods(['GET', 'POST'])
 def get_endorsements(request):
-    params = None
-    if request.body:
+    """The browse page's endorsers. GET requests take the filters as query
+    parameters (see get_endorsements_query) and are redirected to the
+    canonical URL if necessary, so that HTTP caches can share them. POST
+    requests take a JSON body with "filter" and "sort" dicts."""
+    if request.method == 'GET':
+        filter_params = {
+            'mode': request.GET.get('mode', 'none'),
+            'candidate': request.GET.get('candidate', 'all'),
+        }
+        for key in ('tags', 'tags_show', 'tags_hide'):
+            filter_params[key] = parse_tag_list(request.GET.get(key, ''))
+        sort_params = {
+            'value': request.GET.get('sort', 'most'),
+        }
+    else:
+        params = None
+        if request.body:
+            try:
+                params = json.loads(request.body)
+            except ValueError:
+                pass
+
+        if params is not None:
+            filter_params = params.get('filter')
+            if not filter_params or type(filter_params) != dict:
+                return JsonResponse({
+                    'error': True,
+                    'message': 'Need "filter" key with a dict value',
+                })
+
+            sort_params = params.get('sort')
+            if not sort_params or type(sort_params) != dict:
+                return JsonResponse({
+                    'error': True,
+                    'message': 'Need "sort" key with a dict value',
+                })
+        else:
+            filter_params = {}
+            sort_params = {}
+
+    sort_value = sort_params.get('value')
+    if sort_value not in SORT_VALUES:
+        sort_value = 'most'
+
+    cursor_token = request.GET.get('cursor')
+    if request.method == 'GET':
+        query = get_endorsements_query(filter_params, sort_value, cursor_token)
+        if query != request.META.get('QUERY_STRING', ''):
+            url = reverse('get-endorsements')
+            if query:
+                url += '?' + query
+            return redirect(url, permanent=True)
+
+    if cursor_token:
         try:
-            params = json.loads(request.body)
+            version, cursor_sort, last_key, last_pk = decode_cursor(
+                cursor_token
+            )
         except ValueError:
-            pass
+            version = None
 
-    if params is not None:
-        filter_params = params.get('filter')
-        if not filter_params or type(filter_params) != dict:
+        if version is None or cursor_sort != sort_value:
             return JsonResponse({
                 'error': True,
-                'message': 'Need "filter" key with a dict value',
+                'message': 'Invalid cursor',
             })
-
-        sort_params = params.get('sort')
-        if not sort_params or type(sort_params) != dict:
+        # The version only picks the cache key; pages are built from the
+        # current index, so picking up from an older version's cursor could
+        # skip or repeat endorsers.
+        if version != get_data_version():
             return JsonResponse({
                 'error': True,
-                'message': 'Need "sort" key with a dict value',
+                'message':
+                    'The results have changed; start from the first page',
             })
-    else:
-        filter_params = {}
-        sort_params = {}
 
-    try:
-        skip = int(request.GET.get('skip', 0))
-    except ValueError:
-        skip = 0
-
-    params_string = (
-        'query_{sort_by}_{sort_value}_{mode}_{candidate}_{tags}_{skip}'
-    ).format(
-        sort_by=sort_params.get('by', 'followers'),
-        sort_value=sort_params.get('value', 'most'),
-        mode=filter_params.get('mode', 'none'),
-        candidate=filter_params.get('candidate', 'all'),
-        tags=','.join(sorted(map(str, filter_params.get('tags', [])))),
-        skip=skip
+        cursor = {
+            'key': last_key,
+            'pk': last_pk,
+        }
+    else:
+        # The version is carried along in every cursor handed out after this,
+        # so all the pages of one result set share the same cache entries.
+        version = get_data_version()
+        cursor = None
+
+    def get_results():
+        results = get_endorsers(filter_params, sort_params, cursor, version)
+        results['next_url'] = None
+        if results['next']:
+            results['next_url'] = '{url}?{query}'.format(
+                url=reverse('get-endorsements'),
+                query=get_endorsements_query(
+                    filter_params, sort_value, results['next']
+                ),
+            )
+        return results
+
+    query = get_endorsements_query(filter_params, sort_value, cursor_token)
+    cache_key = make_cache_key('query', query, version)
+    # First pages can be stood in for by the same query's previous results
+    # while they're recomputed, but later pages belong to one version.
+    stale_key = None
+    if not cursor_token:
+        stale_key = make_cache_key('query', query)
+    response = cached_json_response(
+        request, cache_key, get_results, stale_key=stale_key
     )
-    print params_string
-
-    results = cache.get(params_string)
-    if results is None:
-        results = get_endorsers(filter_params, sort_params, skip)
-        cache.set(params_string, results, 60 * 60)
-
-    return JsonResponse(results)
+    if request.method == 'GET':
+        if cursor_token:
+            max_age = CURSOR_PAGE_MAX_AGE
+        else:
+            max_age = FIRST_PAGE_MAX_AGE
+        patch_cache_control(response, public=True, max_age=max_age)
+    return response
 
 
 def browse(request):
-    positions = Position.objects.all().annotate(
-        num_endorsers=Count('endorsement__endorser')
-    )
+    positions = [
+        (position.pk, position.slug)
+        for position in get_registry().positions if position.slug
+    ]
+    keys = ['position:%d' % pk for pk, slug in positions]
+    counter_counts = EndorserCounter.objects.get_counts(keys + ['all'])
     counts = {}
-    for position in positions:
-        if position.slug:
-            counts[position.slug] = position.num_endorsers
-    counts['total'] = Endorser.objects.count()
+    for pk, slug in positions:
+        counts[slug] = counter_counts['position:%d' % pk]
+    counts['total'] = counter_counts['all']
 
     context = {
         'counts': counts,
@@ -499,107 +627,8 @@ def random_endorser(request):
     return render(request, 'endorsers/random.html', context)
 
 
-# category name: is personal
-CATEGORY_NAMES = {
-    'Gender': True,
-    'Race/ethnicity': True,
-    'Organizations': False,
-}
 def stats_tags(request):
-    candidates = list(
-        Candidate.objects.filter(still_running=True).order_by('pk')
-    )
-    positions = [
-        candidate.position.pk for candidate in candidates
-    ]
-
-    categories = []
-    for category_name, is_personal in CATEGORY_NAMES.iteritems():
-        category = Category.objects.get(name=category_name)
-        category_candidates = []
-        for candidate in candidates:
-            position = candidate.position
-            endorsers = Endorser.objects.filter(
-                is_personal=is_personal,
-                current_position=position
-            )
-            category_endorsers = endorsers.filter(
-                tags__category=category
-            ).distinct()
-
-            percent_reporting = (
-                category_endorsers.count() / float(endorsers.count()) * 100
-            )
-            category_candidates.append({
-                'num_tagged': category_endorsers.count(),
-                'percent_reporting': percent_reporting
-            })
-
-        # The Other column.
-        endorsers = Endorser.objects.exclude(current_position__in=positions)
-        category_endorsers = endorsers.filter(
-            is_personal=is_personal,
-            tags__category=category
-        )
-
-        percent_reporting = (
-            category_endorsers.count() / float(endorsers.count()) * 100
-        )
-        category_candidates.append({
-            'num_tagged': category_endorsers.count(),
-            'percent_reporting': percent_reporting
-        })
-
-        # Now get the tag-specific stats
-        category_tags = []
-        for tag in category.tag_set.all():
-            tag_candidates = []
-            for candidate in candidates:
-                position = candidate.position
-                endorsers = Endorser.objects.filter(
-                    current_position=position,
-                    is_personal=is_personal,
-                )
-                tag_endorsers = endorsers.filter(tags=tag)
-                num_tagged = tag_endorsers.count()
-                tag_candidates.append({
-                    'num_tagged': num_tagged,
-                })
-
-            # The Other column.
-            endorsers = Endorser.objects.exclude(current_position__in=positions)
-            tag_endorsers = endorsers.filter(
-                tags=tag,
-                current_position=position,
-            )
-
-            tag_candidates.append({
-                'num_tagged': tag_endorsers.count(),
-            })
-
-            category_tags.append({
-                'name': tag.name,
-                'candidates': tag_candidates,
-            })
-
-        num_endorsers = Endorser.objects.count()
-        category_endorsers = Endorser.objects.filter(tags__category=category)
-        num_tagged = category_endorsers.count()
-        percent_reporting = num_tagged / float(num_endorsers) * 100
-
-        categories.append({
-            'name': category.name,
-            'candidates': category_candidates,
-            'tags': category_tags,
-            'num_tagged': num_tagged,
-            'percent_reporting': percent_reporting,
-        })
-
-    context = {
-        'candidates': candidates,
-        'categories': categories,
-    }
-
+    context = get_stats('tags')
     return render(request, 'stats/tags.html', context)
 
 
@@ -779,8 +808,7 @@ def progress_wikipedia_list(request, slug, mode):
         # TODO: Handle newspapers here.
         title = 'Not yet imported'
         query = query.filter(confirmed_endorser__isnull=True)
-        for obj in query:
-            endorser = obj.get_likely_endorser()
+        for obj, (endorser, match) in zip(query, resolve_endorsers(query)):
             url_name = 'admin:wikipedia_importedendorsement_change'
             imported.append({
                 'endorsements': [],
@@ -973,6 +1001,7 @@ def confirm_endorsements(request):
         'has_endorsement': likely_endorser and likely_endorser.endorsement_set.filter(
             position=position
         ).exists(),
+        'suggestions': endorsement.suggestions.select_related('endorser'),
     }
 
     return render(request, 'confirm/endorsement.html', context)
@@ -1037,6 +1066,7 @@ def confirm_newspapers(request):
         'endorsement_form': endorsement_form,
         'name': newspaper.name,
         'source_url': source_url,
+        'suggestions': newspaper.suggestions.select_related('endorser'),
     }
 
     return render(request, 'confirm/newspaper.html', context)
@@ -1131,206 +1161,38 @@ def confirm_newspaper(request, pk):
     return redirect('confirm-newspapers')
 
 
-def stats_states(request):
-    candidates = list(
-        Candidate.objects.filter(still_running=True).order_by('pk')
-    )
-    positions = [
-        candidate.position.pk for candidate in candidates
-    ]
-
-    cache_key = 'stats_states'
-    cached_values = cache.get(cache_key)
-    if cached_values is None:
-        candidate_counts = collections.defaultdict(collections.Counter)
-        states = []
-
-        tags = {
-            'newspapers': Tag.objects.get(name='Publication'),
-            'politicians': Tag.objects.get(name='Politician'),
-            'senators': Tag.objects.get(name='Current Senator'),
-            'representatives': Tag.objects.get(name='Current U.S. Representative'),
-            'Republicans': Tag.objects.get(name='Republican Party'),
-        }
-
-        max_counts = collections.defaultdict(dict)
-        for state_tag in Tag.objects.filter(category_id=8).order_by('name'):
-            results = ImportedResult.objects.filter(
-                tag=state_tag,
-            ).prefetch_related('candidate')
-            if not results.count():
-                continue
-
-            votes = {}
-            for result in results:
-                votes[result.candidate.pk] = result.count
-
-            candidate_values = []
-            for candidate in candidates:
-                endorsements = Endorser.objects.filter(
-                    current_position=candidate.position,
-                    tags=state_tag,
-                ).distinct()
-                num_endorsements = endorsements.count()
-
-                counts = collections.OrderedDict()
-                counts['endorsements'] = num_endorsements
-                counts['newspapers'] = endorsements.filter(
-                    tags=tags['newspapers']
-                ).count()
-                counts['politicians'] = endorsements.filter(
-                    tags=tags['politicians']
-                ).count()
-                counts['senators'] = endorsements.filter(
-                    tags=tags['senators']
-                ).count()
-                counts['representatives'] = endorsements.filter(
-                    tags=tags['representatives']
-                ).count()
-                counts['Republicans'] = endorsements.filter(
-                    tags=tags['Republicans']
-                ).count()
-
-                for key, value in counts.iteritems():
-                    if key in max_counts[candidate.pk]:
-                        max_counts[candidate.pk][key] = max(
-                            value, max_counts[candidate.pk][key]
-                        )
-                    else:
-                        max_counts[candidate.pk][key] = value
-
-                candidate_counts[candidate.pk].update(counts)
-                candidate_counts[candidate.pk]['votes'] += votes[candidate.pk]
-                if 'votes' in max_counts[candidate.pk]:
-                    max_counts[candidate.pk]['votes'] = max(
-                        max_counts[candidate.pk]['votes'], votes[candidate.pk]
-                    )
-                else:
-                    max_counts[candidate.pk]['votes'] = votes[candidate.pk]
-
-                candidate_values.append({
-                    'votes': votes[candidate.pk],
-                    'counts': [
-                        (key, value, tags.get(key))
-                        for key, value in counts.iteritems()
-                    ],
-                    'rgb': candidate.rgb,
-                })
-
-            # Figure out the opacity level for each cell in this row.
-            total_votes = sum(votes.values())
-            max_votes = max(votes.values())
-            winning_color = None
-            for candidate_value in candidate_values:
-                ratio = candidate_value['votes'] / float(total_votes)
-                percent = ratio * 100
-                candidate_value['percent'] = percent
-                candidate_value['ratio'] = '{:2.2f}'.format(ratio)
-                candidate_won = candidate_value['votes'] == max_votes
-                candidate_value['won'] = candidate_won
-                if candidate_won:
-                    winning_color = candidate_value['rgb']
-
-            other_endorsements = Endorser.objects.filter(
-                tags=state_tag,
-            ).exclude(
-                current_position__pk__in=positions,
-            ).prefetch_related('current_position')
-            position_counter = collections.Counter()
-            for endorser in other_endorsements:
-                position = endorser.current_position
-                if position:
-                    position_counter[position.pk] += 1
-
-            other_positions = []
-            for position in Position.objects.exclude(pk__in=positions):
-                count = position_counter[position.pk]
-                if count > 0:
-                    other_positions.append({
-                        'name': position.get_present_display(),
-                        'count': count,
-                        'slug': position.slug,
-                    })
-
-            state_counts = collections.OrderedDict()
-            endorsements = Endorser.objects.filter(
-                tags=state_tag,
-            ).distinct()
-
-            state_counts['endorsements'] = endorsements.count()
-            state_counts['newspapers'] = endorsements.filter(
-                tags=tags['newspapers']
-            ).count()
-            state_counts['politicians'] = endorsements.filter(
-                tags=tags['politicians']
-            ).count()
-            state_counts['senators'] = endorsements.filter(
-                tags=tags['senators']
-            ).count()
-            state_counts['representatives'] = endorsements.filter(
-                tags=tags['representatives']
-            ).count()
-            state_counts['Republicans'] = endorsements.filter(
-                tags=tags['Republicans']
-            ).count()
-
-            states.append({
-                'pk': state_tag.pk,
-                'name': state_tag.name,
-                'candidates': candidate_values,
-                'counts': [
-                    (key, value, tags.get(key))
-                    for key, value in state_counts.iteritems()
-                ],
-                'votes': total_votes,
-                'winning_color': winning_color,
-                'other_positions': other_positions,
-                'num_other_positions': sum(position_counter.values())
-            })
+def get_as_of(request):
+    """Returns the date in the "date" query parameter (for showing stats as
+    of then), or None if there isn't one."""
+    value = request.GET.get('date')
+    if not value:
+        return None
+    try:
+        return parse_date(value)
+    except ValueError:
+        raise Http404
 
-        cached_values = {
-            'states': states,
-            'candidate_counts': [
-                (c, dict(candidate_counts[c.pk]), max_counts[c.pk])
-                for c in candidates
-            ],
-        }
-        cache.set(cache_key, cached_values)
 
-    context = {
-        'states': cached_values['states'],
-        'candidates': candidates,
-        'candidate_counts': cached_values['candidate_counts'],
-    }
+def stats_states(request):
+    context = get_stats('states', get_as_of(request))
     return render(request, 'stats/states.html', context)
 
 
 def progress_tagging(request):
-    org_tags = set(
-        tag.pk for tag in Tag.objects.filter(category__name='Organizations')
-    )
-    gender_tags = set(
-        tag.pk for tag in Tag.objects.filter(category__name='Gender')
-    )
-    race_tags = set(
-        tag.pk for tag in Tag.objects.filter(category__name='Race/ethnicity')
-    )
-    occupation_tags = set(
-        tag.pk for tag in Tag.objects.filter(category__name='Occupation')
-    )
-    politician_tag = Tag.objects.get(name='Politician').pk
-    location_tags = set(
-        tag.pk for tag in Tag.objects.filter(category__name='States and districts')
-    )
-    party_tags = set(
-        tag.pk for tag in Tag.objects.filter(category__name='Party affiliation')
-    )
+    registry = get_registry()
+    org_tags = registry.get_category_tag_pks('Organizations')
+    gender_tags = registry.get_category_tag_pks('Gender')
+    race_tags = registry.get_category_tag_pks('Race/ethnicity')
+    occupation_tags = registry.get_category_tag_pks('Occupation')
+    politician_tag = registry.get_tag('Politician').pk
+    location_tags = registry.get_category_tag_pks('States and districts')
+    party_tags = registry.get_category_tag_pks('Party affiliation')
     needs_keys = ['tags', 'org_type', 'gender', 'race', 'occupation', 'location', 'party']
     IGNORED_SECTIONS = 'Endorsements > International political figures'
     sections_by_page = []
 
     tag_names = {
-        tag['pk']: tag['name'] for tag in Tag.objects.values('name', 'pk')
+        tag.pk: tag.name for tag in registry.tags
     }
 
     admin_url = reverse('admin:wikipedia_importedendorsement_changelist')
@@ -1436,144 +1298,113 @@ def progress_twitter(request):
 
 
 def stats_predictions(request):
-    ENDORSER_TYPES = {
-        'clinton': Position.objects.get(slug='clinton'),
-        'trump': Position.objects.get(slug='trump'),
-        'pence': Position.objects.get(slug='pence'),
-        'another-republican': Position.objects.get(slug='another-republican'),
-        'trump-support': Position.objects.get(slug='trump-support'),
-        'senate': Tag.objects.get(name='Current Senator'),
-        'house': Tag.objects.get(name='Current U.S. Representative'),
-        'republican': Tag.objects.get(name='Republican Party'),
-        'democrat': Tag.objects.get(name='Democratic Party'),
-        'newspaper': Tag.objects.get(name='Publication')
-    }
-    clinton_pk = ENDORSER_TYPES['clinton'].pk
-    trump_pk = ENDORSER_TYPES['trump'].pk
-
-    endorser_pks = {}
-    for key, value in ENDORSER_TYPES.iteritems():
-        endorser_pks[key] = set(
-            value.endorser_set.values_list('id', flat=True)
-        )
-
-    state_tag_pks = set()
-    results = collections.defaultdict(dict)
-    results_query = ImportedResult.objects.filter(
-        candidate__in=[clinton_pk, trump_pk]
-    ).prefetch_related('tag', 'candidate')
-    for result in results_query:
-        results[result.tag.name][result.candidate.pk] = result.percent
-        state_tag_pks.add(result.tag.pk)
-
-    states = []
-    for state_tag in Tag.objects.filter(category_id=8).order_by('name'):
-        if state_tag.name not in results:
-            continue
+    context = get_stats('predictions', get_as_of(request))
+    return render(request, 'stats/predictions.html', context)
 
-        # Find the actual vote spread.
-        clinton_percent = results[state_tag.name][clinton_pk]
-        trump_percent = results[state_tag.name][trump_pk]
 
-        votes = predict_winner(
-            clinton_percent,
-            trump_percent,
-            5,
-            is_percent=True
-        )
+MAX_SERIES_DAYS = 1000
 
-        state_endorser_pks = set(
-            state_tag.endorser_set.values_list('id', flat=True)
-        )
 
-        states.append({
-            'name': state_tag.name,
-            'votes': votes,
-            'endorser_pks': state_endorser_pks,
+def get_prediction_series_data(request):
+    """How each prediction model would have done on each day from "start"
+    to "end" (by default, the first and last dated endorsements)."""
+    timeline = get_timeline()
+    try:
+        start = parse_date(request.GET['start'])
+    except KeyError:
+        start = timeline.dates[0] if timeline.dates else None
+    except ValueError:
+        return JsonResponse({
+            'error': True,
+            'message': 'Invalid start date',
+        })
+    try:
+        end = parse_date(request.GET['end'])
+    except KeyError:
+        end = timeline.dates[-1] if timeline.dates else None
+    except ValueError:
+        return JsonResponse({
+            'error': True,
+            'message': 'Invalid end date',
         })
 
-    electoral_votes = {
-        e.state.name: e.count for e in ElectoralVotes.objects.all()
-    }
-
-    # Apply all the different models.
-    categories = []
-    for category, category_models in MODELS.iteritems():
-        category_states = []
-        for state in states:
-            state_models = []
-            for model in category_models:
-                model_counts = model.apply_model(
-                    state['endorser_pks'],
-                    endorser_pks
-                )
-                model_data = predict_winner(
-                    model_counts['clinton'],
-                    model_counts['trump'],
-                    model.threshold,
-                )
-                state_models.append(model_data)
-
-            # Figure out which models were correct
-            for model_data in state_models:
-                model_data['correct_candidate'] = (
-                    model_data['color'] == state['votes']['color']
-                )
-                model_data['correct_size'] = (
-                    model_data['correct_candidate'] and
-                    model_data['basic'] == state['votes']['basic']
-                )
-
-            category_states.append({
-                'name': state['name'],
-                'votes': state['votes'],
-                'models': state_models,
-                'electoral_votes': electoral_votes[state['name']],
+    if start is None or end is None:
+        dates = []
+    else:
+        num_days = (end - start).days + 1
+        if num_days > MAX_SERIES_DAYS:
+            return JsonResponse({
+                'error': True,
+                'message': 'At most %d days at a time' % MAX_SERIES_DAYS,
             })
+        dates = [
+            start + datetime.timedelta(days=i) for i in xrange(num_days)
+        ]
 
-        model_summaries = []
-        for i, model in enumerate(category_models):
-            clinton_electoral_votes = sum(
-                state['electoral_votes']
-                for state in category_states
-                if state['models'][i]['winner'] == 'clinton'
-            )
-            trump_electoral_votes = sum(
-                state['electoral_votes']
-                for state in category_states
-                if state['models'][i]['winner'] == 'trump'
-            )
+    def get_results():
+        return {
+            'series': get_prediction_series(dates),
+        }
 
-            if clinton_electoral_votes > 270:
-                electoral_vote_winner = 'blue'
-            elif trump_electoral_votes > 270:
-                electoral_vote_winner = 'red'
-            else:
-                electoral_vote_winner = 'grey'
+    namespaces = STATS_PAGES['predictions'][0]
+    cache_key = make_versioned_key(
+        'prediction_series', namespaces,
+        start and start.isoformat(), end and end.isoformat()
+    )
+    return cached_json_response(request, cache_key, get_results)
 
-            model_summaries.append({
-                'name': model.name,
-                'num_correct_candidate': sum(
-                    state['models'][i]['correct_candidate']
-                    for state in category_states
-                ),
-                'num_correct_size': sum(
-                    state['models'][i]['correct_size']
-                    for state in category_states
-                ),
-                'clinton_electoral_votes': clinton_electoral_votes,
-                'trump_electoral_votes': trump_electoral_votes,
-                'electoral_vote_winner': electoral_vote_winner,
-            })
 
-        categories.append({
-            'name': category,
-            'states': category_states,
-            'models': model_summaries,
+@csrf_exempt
+@require_POST
+def what_if(request):
+    """Evaluates a user-defined prediction model for every state. Takes a
+    JSON body with a "model" dict (see election.backtest.parse_variant),
+    e.g., {"model": {"keys": ["senate", "house"], "clinton_keys":
+    ["clinton"], "trump_keys": ["trump"], "threshold": 1}}."""
+    try:
+        params = json.loads(request.body)
+    except ValueError:
+        params = None
+    if type(params) != dict or 'model' not in params:
+        return JsonResponse({
+            'error': True,
+            'message': 'Need "model" key with a dict value',
         })
 
-    context = {
-        'categories': categories,
-    }
+    data = get_current_backtest_data()
+    try:
+        variant = parse_variant(
+            params['model'], data.endorser_vectors, data.endorser_weights
+        )
+    except ValueError as e:
+        return JsonResponse({
+            'error': True,
+            'message': str(e),
+        })
 
-    return render(request, 'stats/predictions.html', context)
+    clinton_counts, trump_counts = get_variant_counts(
+        data.get_engine(), variant
+    )
+    states = []
+    for s, name in enumerate(data.state_names):
+        prediction = predict_winner(
+            clinton_counts[s].item(),
+            trump_counts[s].item(),
+            variant['threshold'],
+        )
+        states.append({
+            'name': name,
+            'electoral_votes': int(data.electoral_votes[s]),
+            'prediction': prediction,
+            'correct_candidate': bool(
+                WINNERS[prediction['winner']] == data.winners[s]
+            ),
+        })
+
+    summary = score_counts(
+        data, clinton_counts, trump_counts, variant['threshold']
+    )
+    return JsonResponse({
+        'states': states,
+        'summary': summary,
+    })
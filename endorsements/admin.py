@@ -5,6 +5,7 @@ from django.utils.html import format_html
 from endorsements.models import Account, Candidate, Endorsement, Endorser, \
                                 Source, Quote, Comment, Position, Tag, \
                                 Category, Event
+from endorsements.signals import refresh_cards
 
 
 @admin.register(Account)
@@ -45,6 +46,12 @@ class EndorserAdminForm(forms.ModelForm):
     class Meta:
         model = Endorser
         fields = '__all__'
+        # These are kept up to date automatically.
+        exclude = (
+            'current_endorsement',
+            'first_endorsement_date',
+            'latest_endorsement_date',
+        )
 
 
 def add_tag(modeladmin, request, queryset):
@@ -162,6 +169,9 @@ def change_event(modeladmin, request, queryset):
 
     queryset.update(event=event)
 
+    # update() doesn't send post_save, so the cards need to be rebuilt here.
+    refresh_cards(Endorser.objects.filter(endorsement__quote__in=queryset))
+
     modeladmin.message_user(
         request,
         "Added event {event} for {n} quotes".format(
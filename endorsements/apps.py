@@ -5,3 +5,7 @@ from django.apps import AppConfig
 
 class EndorsementsConfig(AppConfig):
     name = 'endorsements'
+
+    def ready(self):
+        # Connect the signal handlers that keep denormalized data up to date.
+        from endorsements import signals
@@ -0,0 +1,420 @@
+import contextlib
+import fcntl
+import gzip
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+# Each namespace has a version counter that's bumped (from model signals)
+# whenever anything in it is written. Cache keys built from the versions of
+# the namespaces they depend on go stale as soon as any of them changes.
+NAMESPACES = ('endorsers', 'tags', 'positions', 'results', 'imports')
+VERSION_KEY = 'version_{namespace}'
+# Kept in the cache directory when the cache is file-based (see
+# version_lock).
+VERSION_LOCK_FILENAME = 'versions.lock'
+# Which endorsers each bump of the data version was for (see
+# bump_data_version). Processes catch up by replaying the changes they've
+# missed, as long as there aren't too many of them (and they haven't
+# expired).
+DATA_CHANGE_KEY = 'data_change_{version}'
+DATA_CHANGE_TIMEOUT = 60 * 60
+MAX_DATA_CHANGES = 100
+# Single-flight settings (see get_or_compute): how long one process can hold
+# the lock while recomputing a value, how long the others wait for it when
+# there's no stale value to hand out, and how long stale values are kept.
+LOCK_TIMEOUT = 60
+WAIT_TIMEOUT = 5
+WAIT_INTERVAL = 0.05
+STALE_TIMEOUT = 60 * 60 * 24
+# Higher values make early refreshes more likely (1 is the usual choice).
+EARLY_REFRESH_BETA = 1.0
+# Best first. Brotli is only used if the brotli module is installed.
+ENCODING_PREFERENCE = ('br', 'gzip', 'identity')
+
+
+def get_initial_version():
+    # If a version counter is evicted, starting it again from the current
+    # time (rather than 1) means it can't come back as a value that was
+    # already used for something that's since changed.
+    return int(time.time() * 1000)
+
+
+def get_version(key):
+    """Returns the current value of the version counter stored at key."""
+    version = cache.get(key)
+    if version is None:
+        # add() is a no-op if another process got there first.
+        version = get_initial_version()
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+@contextlib.contextmanager
+def version_lock():
+    """Makes bumping a version counter atomic between processes when the
+    cache's incr() isn't. FileBasedCache's is a get followed by a set, so two
+    processes bumping at once could both write the same value (and one of
+    the bumps would be lost); memcached's is atomic already."""
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    if not isinstance(backend, FileBasedCache):
+        yield
+        return
+
+    backend._createdir()
+    path = os.path.join(backend._dir, VERSION_LOCK_FILENAME)
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def bump_version(key):
+    """Increments the version counter stored at key and returns its new
+    value."""
+    with version_lock():
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # The key has been evicted (or was never set).
+            version = get_version(key) + 1
+            cache.set(key, version, None)
+            return version
+
+
+def get_versions(*namespaces):
+    """Returns a list of the current versions of the given namespaces (with
+    a single cache lookup in the usual case)."""
+    keys = [VERSION_KEY.format(namespace=namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    return [versions.get(key) or get_version(key) for key in keys]
+
+
+def bump_versions(*namespaces):
+    """Bumps the versions of the given namespaces once the current
+    transaction (if any) commits. Bumping them any earlier would let another
+    process see the new version, rebuild something from data that isn't
+    committed yet, and cache the result under that version for good."""
+    def bump():
+        for namespace in namespaces:
+            bump_version(VERSION_KEY.format(namespace=namespace))
+    transaction.on_commit(bump)
+
+
+def get_data_version():
+    """Returns a number that changes whenever endorser data (endorsers,
+    their endorsements, quotes and accounts, or anything shown on their
+    cards) is written. Anything derived from that data (cached pages,
+    indexes, pagination cursors) can include it to know whether it's still
+    current."""
+    return get_version(VERSION_KEY.format(namespace='endorsers'))
+
+
+def bump_data_version(endorser_pks=None):
+    """Bumps the data version once the current transaction (if any)
+    commits. If endorser_pks is given, it's recorded as the endorsers the
+    change was for, so that in-process indexes can reload just those (see
+    get_data_changes); otherwise they have to be rebuilt."""
+    if endorser_pks is not None:
+        endorser_pks = list(endorser_pks)
+
+    def bump():
+        version = bump_version(VERSION_KEY.format(namespace='endorsers'))
+        if endorser_pks is not None:
+            cache.set(
+                DATA_CHANGE_KEY.format(version=version),
+                endorser_pks,
+                DATA_CHANGE_TIMEOUT
+            )
+    transaction.on_commit(bump)
+
+
+def get_data_changes(from_version, to_version):
+    """Returns the set of endorser pks changed by the data version bumps
+    after from_version up to to_version, or None if that isn't known (a
+    bump wasn't for specific endorsers, or its record has expired) or there
+    are too many to be worth replaying."""
+    if from_version is None or \
+       not from_version < to_version <= from_version + MAX_DATA_CHANGES:
+        return None
+
+    keys = [
+        DATA_CHANGE_KEY.format(version=version)
+        for version in xrange(from_version + 1, to_version + 1)
+    ]
+    changes = cache.get_many(keys)
+    if len(changes) != len(keys):
+        return None
+    return set(pk for endorser_pks in changes.itervalues()
+               for pk in endorser_pks)
+
+
+def make_versioned_key(prefix, namespaces, *parts):
+    """Like make_cache_key, but the key also changes whenever anything in
+    the given namespaces is written."""
+    versions = get_versions(*namespaces)
+    return make_cache_key(prefix, zip(namespaces, versions), *parts)
+
+
+def make_cache_key(prefix, *parts):
+    """Returns a cache key (safe for memcached) identifying the given parts,
+    which can be anything JSON-serializable."""
+    data = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return '{prefix}_{hash}'.format(
+        prefix=prefix,
+        hash=hashlib.md5(data).hexdigest(),
+    )
+
+
+def should_refresh(entry, now):
+    """Decides whether to recompute a cached entry before it expires. The
+    closer it is to expiring, and the longer it took to compute, the more
+    likely a refresh is, so that one request (usually) recomputes a hot key
+    before it runs out instead of all of them at once after."""
+    delta = entry['delta'] * EARLY_REFRESH_BETA
+    return now - delta * math.log(1 - random.random()) >= entry['expires']
+
+
+def compute_entry(key, compute, timeout, stale_key=None):
+    start = time.time()
+    value = compute()
+    now = time.time()
+    entry = {
+        'value': value,
+        'delta': now - start,
+        'expires': now + timeout,
+    }
+    cache.set(key, entry, timeout)
+    if stale_key is not None:
+        cache.set(stale_key, entry, STALE_TIMEOUT)
+    return value
+
+
+def get_or_compute(key, compute, timeout, stale_key=None):
+    """Returns the value cached at key, calling compute() to fill it in if
+    it's missing (or about to expire).
+
+    Only one process recomputes a given key at a time. While it does, the
+    others get the value that's about to expire, or the last value stored at
+    stale_key (typically the same key without any versions in it), or wait
+    up to WAIT_TIMEOUT seconds for the new value before giving up and
+    computing it themselves.
+    """
+    entry = cache.get(key)
+    if entry is not None and not should_refresh(entry, time.time()):
+        return entry['value']
+
+    lock_key = key + '_lock'
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        try:
+            return compute_entry(key, compute, timeout, stale_key)
+        finally:
+            cache.delete(lock_key)
+
+    # Someone else is already recomputing it.
+    if entry is not None:
+        return entry['value']
+    if stale_key is not None:
+        stale_entry = cache.get(stale_key)
+        if stale_entry is not None:
+            return stale_entry['value']
+
+    deadline = time.time() + WAIT_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['value']
+
+    return compute_entry(key, compute, timeout, stale_key)
+
+
+def refresh_entry(key, namespaces, compute):
+    """Recomputes the value stored at key by get_stale_while_revalidate and
+    returns it."""
+    # Versions from before the computation, so that anything written while
+    # it runs makes the result stale straight away.
+    versions = get_versions(*namespaces)
+    value = compute()
+    cache.set(key, {
+        'value': value,
+        'versions': versions,
+        'refreshed_at': time.time(),
+    }, STALE_TIMEOUT)
+    return value
+
+
+def refresh_entry_in_background(key, namespaces, compute):
+    lock_key = key + '_refresh_lock'
+    if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        # Another request has already started a refresh.
+        return
+
+    def refresh():
+        try:
+            refresh_entry(key, namespaces, compute)
+        except Exception:
+            logger.exception('Refreshing %s failed', key)
+        finally:
+            cache.delete(lock_key)
+
+    def refresh_in_thread():
+        try:
+            refresh()
+        finally:
+            # Threads get their own database connection; don't leak it.
+            connection.close()
+
+    if settings.REFRESH_IN_BACKGROUND:
+        thread = threading.Thread(target=refresh_in_thread)
+        thread.daemon = True
+        thread.start()
+    else:
+        refresh()
+
+
+def get_stale_while_revalidate(key, namespaces, compute, soft_timeout):
+    """Returns the value stored at key, calling compute() to fill it in if
+    there isn't one yet.
+
+    If anything in the given namespaces has been written since the value
+    was computed, or it's older than soft_timeout, the stored value is
+    returned anyway and recomputed in a background thread, so only the very
+    first request ever waits for compute().
+    """
+    entry = cache.get(key)
+    if entry is None:
+        return get_or_compute(
+            key + '_initial',
+            lambda: refresh_entry(key, namespaces, compute),
+            LOCK_TIMEOUT
+        )
+
+    is_current = entry['versions'] == get_versions(*namespaces)
+    is_recent = time.time() < entry['refreshed_at'] + soft_timeout
+    if not (is_current and is_recent):
+        refresh_entry_in_background(key, namespaces, compute)
+    return entry['value']
+
+
+def get_accepted_encodings(request):
+    """Returns the set of content codings in the request's Accept-Encoding
+    header that aren't explicitly refused (with q=0)."""
+    encodings = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        params = item.strip().split(';')
+        coding = params[0].strip().lower()
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    pass
+        if coding and quality > 0:
+            encodings.add(coding)
+    return encodings
+
+
+def encode_response_data(data):
+    """Serializes data to JSON and compresses it once, returning everything
+    needed to answer any request for it (see cached_json_response)."""
+    body = json.dumps(data, cls=DjangoJSONEncoder)
+    digest = hashlib.sha1(body).hexdigest()
+
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as gzip_file:
+        gzip_file.write(body)
+
+    variants = {
+        'identity': body,
+        'gzip': buf.getvalue(),
+    }
+    if brotli is not None:
+        variants['br'] = brotli.compress(body)
+
+    return {
+        'digest': digest,
+        'variants': variants,
+    }
+
+
+def get_etag(digest, encoding):
+    # Each encoding is a different representation, so it gets its own
+    # (strong) validator.
+    if encoding == 'identity':
+        return '"{digest}"'.format(digest=digest)
+    return '"{digest}-{encoding}"'.format(digest=digest, encoding=encoding)
+
+
+def cached_json_response(request, cache_key, get_data, timeout=60 * 60,
+                         stale_key=None):
+    """Returns a JSON response for the data returned by get_data(), which is
+    only called (and serialized and compressed) on a cache miss (see
+    get_or_compute for stale_key).
+
+    Conditional requests whose If-None-Match matches get a 304, and the body
+    is sent compressed if the client accepts it.
+    """
+    encoded = get_or_compute(
+        cache_key,
+        lambda: encode_response_data(get_data()),
+        timeout,
+        stale_key
+    )
+
+    digest = encoded['digest']
+    variants = encoded['variants']
+    accepted = get_accepted_encodings(request)
+    for encoding in ENCODING_PREFERENCE:
+        if encoding in variants and encoding in accepted:
+            break
+    else:
+        encoding = 'identity'
+    etag = get_etag(digest, encoding)
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    if if_none_match:
+        etags = set(tag.strip() for tag in if_none_match.split(','))
+        if '*' in etags or \
+           any(get_etag(digest, other) in etags for other in variants):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            patch_vary_headers(response, ('Accept-Encoding',))
+            return response
+
+    response = HttpResponse(
+        variants[encoding], content_type='application/json'
+    )
+    if encoding != 'identity':
+        response['Content-Encoding'] = encoding
+    response['Content-Length'] = len(variants[encoding])
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,376 @@
+import binascii
+import bisect
+import collections
+import threading
+
+import numpy
+
+from endorsements.caching import get_data_changes, get_data_version
+from endorsements.models import Endorser
+
+
+# Endorsers without any endorsements go at the end for both date sorts.
+NO_LATEST_DATE = '0001-01-01'
+NO_EARLIEST_DATE = '9999-12-31'
+
+# Where each sort key is in an endorser's entry (see EndorserIndex).
+SORT_KEYS = {
+    'followers': 0,
+    'latest': 1,
+    'earliest': 2,
+    'name': 3,
+}
+
+# sort value: the sorted list it reads (ascending or descending)
+SORT_LISTS = {
+    'most': 'followers',
+    'least': 'followers',
+    'newest': 'latest',
+    'oldest': 'earliest',
+    'az': 'name',
+    'za': 'name',
+}
+
+# sort value: descending
+SORT_VALUES = {
+    'most': True,
+    'least': False,
+    'newest': True,
+    'oldest': False,
+    'az': False,
+    'za': True,
+}
+
+
+def count_bits(bitmap):
+    return bin(bitmap).count('1')
+
+
+def bitmap_to_array(bitmap, size):
+    """Returns a boolean array of length size whose element i is set if bit
+    i of bitmap is."""
+    hex_digits = '%x' % bitmap
+    if len(hex_digits) % 2:
+        hex_digits = '0' + hex_digits
+    data = numpy.frombuffer(binascii.unhexlify(hex_digits), dtype=numpy.uint8)
+    # unpackbits gives the most significant bit first.
+    bits = numpy.unpackbits(data)[::-1][:size]
+    array = numpy.zeros(size, dtype=bool)
+    array[:len(bits)] = bits
+    return array
+
+
+class EndorserIndex(object):
+    """Bitmaps of which endorsers have each tag, position and type, plus every
+    endorser sorted by each of the browse page's sort options.
+
+    Bit i of a bitmap corresponds to self.pks[i], so any combination of
+    filters is a handful of &, | and ~ operations on Python integers, no
+    matter how many tags are involved.
+
+    The index is never changed once built: apply_changes returns an updated
+    copy, so threads can keep reading the one they have. Deleted endorsers
+    leave a gap (a None in self.pks, with no bits set) until the next full
+    rebuild.
+    """
+    def __init__(self, version=None):
+        self.version = version
+        self.pks = []
+        self.rows = {}
+        # pk -> (sort keys, position pk, tag pks)
+        self.entries = {}
+        self.all = 0
+        self.personal = 0
+        self.positions = collections.defaultdict(int)
+        self.tags = collections.defaultdict(int)
+
+        endorser_rows, endorser_tags = self.load()
+        followers = []
+        for row in endorser_rows:
+            pk, max_followers = row[0], row[3]
+            self.rows[pk] = len(self.pks)
+            self.pks.append(pk)
+            followers.append(max_followers)
+            self.set_entry(row, endorser_tags[pk])
+        # Indexed like the columns of get_matrix.
+        self.followers = numpy.array(followers, dtype=numpy.int64)
+
+        # Each list is of (key, pk), in ascending order.
+        self.lists = {}
+        for name, i in SORT_KEYS.iteritems():
+            self.lists[name] = sorted(
+                (entry[0][i], pk) for pk, entry in self.entries.iteritems()
+            )
+        self.sorts = {}
+        for sort_value, name in SORT_LISTS.iteritems():
+            self.sorts[sort_value] = self.lists[name]
+        # sort value -> row -> place in the sort (see get_sort_places).
+        self.sort_places = {}
+
+    @staticmethod
+    def load(endorser_pks=None):
+        """Returns the endorsers' rows (ordered by pk) and a dict mapping
+        each endorser pk to a list of its tag pks."""
+        endorsers = Endorser.objects.order_by('pk')
+        tag_links = Endorser.tags.through.objects.all()
+        if endorser_pks is not None:
+            endorsers = endorsers.filter(pk__in=endorser_pks)
+            tag_links = tag_links.filter(endorser_id__in=endorser_pks)
+
+        endorser_tags = collections.defaultdict(list)
+        for endorser_pk, tag_pk in tag_links.values_list(
+            'endorser_id', 'tag_id'
+        ):
+            endorser_tags[endorser_pk].append(tag_pk)
+
+        rows = endorsers.values_list(
+            'pk', 'name', 'is_personal', 'max_followers',
+            'current_position_id', 'first_endorsement_date',
+            'latest_endorsement_date'
+        )
+        return rows, endorser_tags
+
+    def set_entry(self, row, tag_pks):
+        """Sets the bits for an endorser (whose row must already be
+        assigned) and records its sort keys, without touching the sorted
+        lists."""
+        pk, name, is_personal, max_followers, position_pk = row[:5]
+        first_date, latest_date = row[5:]
+        bit = 1 << self.rows[pk]
+        self.all |= bit
+        if is_personal:
+            self.personal |= bit
+        if position_pk is not None:
+            self.positions[position_pk] |= bit
+        for tag_pk in tag_pks:
+            self.tags[tag_pk] |= bit
+
+        if first_date:
+            earliest = first_date.isoformat()
+        else:
+            earliest = NO_EARLIEST_DATE
+        if latest_date:
+            latest = latest_date.isoformat()
+        else:
+            latest = NO_LATEST_DATE
+        sort_keys = (max_followers, latest, earliest, name.lower())
+        self.entries[pk] = (sort_keys, position_pk, tuple(tag_pks))
+
+    def clear_entry(self, pk):
+        """Clears an endorser's bits and takes it out of the sorted
+        lists."""
+        sort_keys, position_pk, tag_pks = self.entries.pop(pk)
+        bit = 1 << self.rows[pk]
+        self.all &= ~bit
+        self.personal &= ~bit
+        if position_pk is not None:
+            self.positions[position_pk] &= ~bit
+        for tag_pk in tag_pks:
+            self.tags[tag_pk] &= ~bit
+
+        for name, i in SORT_KEYS.iteritems():
+            ordered = self.lists[name]
+            del ordered[bisect.bisect_left(ordered, (sort_keys[i], pk))]
+
+    def copy(self, version):
+        index = EndorserIndex.__new__(EndorserIndex)
+        index.version = version
+        index.pks = list(self.pks)
+        index.rows = dict(self.rows)
+        index.entries = dict(self.entries)
+        index.all = self.all
+        index.personal = self.personal
+        index.positions = collections.defaultdict(int, self.positions)
+        index.tags = collections.defaultdict(int, self.tags)
+        index.followers = self.followers.copy()
+        index.lists = dict(
+            (name, list(ordered)) for name, ordered in self.lists.iteritems()
+        )
+        index.sorts = dict(
+            (sort_value, index.lists[name])
+            for sort_value, name in SORT_LISTS.iteritems()
+        )
+        index.sort_places = {}
+        return index
+
+    def apply_changes(self, endorser_pks, version):
+        """Returns a copy of the index for the given version, with the given
+        endorsers reloaded from the database (and any that no longer exist
+        removed)."""
+        index = self.copy(version)
+        for pk in endorser_pks:
+            if pk in index.entries:
+                index.clear_entry(pk)
+
+        endorser_rows, endorser_tags = self.load(endorser_pks)
+        new_followers = []
+        loaded_pks = set()
+        for row in endorser_rows:
+            pk, max_followers = row[0], row[3]
+            loaded_pks.add(pk)
+            if pk in index.rows:
+                index.followers[index.rows[pk]] = max_followers
+            else:
+                index.rows[pk] = len(index.pks)
+                index.pks.append(pk)
+                new_followers.append(max_followers)
+            index.set_entry(row, endorser_tags[pk])
+            sort_keys = index.entries[pk][0]
+            for name, i in SORT_KEYS.iteritems():
+                bisect.insort(index.lists[name], (sort_keys[i], pk))
+        if new_followers:
+            index.followers = numpy.append(
+                index.followers, numpy.array(new_followers, dtype=numpy.int64)
+            )
+
+        for pk in set(endorser_pks) - loaded_pks:
+            # Deleted, so leave a gap.
+            row = index.rows.pop(pk, None)
+            if row is not None:
+                index.pks[row] = None
+                index.followers[row] = 0
+
+        return index
+
+    def filter(self, is_personal=None, tags=None, any_tags=None,
+               hide_tags=None, position=None):
+        """Returns the bitmap of endorsers that have all of `tags`, at least
+        one of `any_tags` (if given) and none of `hide_tags`."""
+        bitmap = self.all
+        if is_personal is True:
+            bitmap &= self.personal
+        elif is_personal is False:
+            bitmap &= ~self.personal
+
+        for tag_pk in tags or []:
+            bitmap &= self.tags.get(tag_pk, 0)
+
+        if any_tags:
+            any_bitmap = 0
+            for tag_pk in any_tags:
+                any_bitmap |= self.tags.get(tag_pk, 0)
+            bitmap &= any_bitmap
+
+        for tag_pk in hide_tags or []:
+            bitmap &= ~self.tags.get(tag_pk, 0)
+
+        if position is not None:
+            bitmap &= self.positions.get(position, 0)
+
+        return bitmap
+
+    def get_sort_places(self, sort_value):
+        """Returns an array with the place of each row in the (ascending)
+        list for the given sort. Rows that are gaps are left at 0, but they
+        never have any bits set."""
+        places = self.sort_places.get(sort_value)
+        if places is None:
+            rows = self.rows
+            ordered_rows = numpy.array(
+                [rows[pk] for key, pk in self.sorts[sort_value]],
+                dtype=numpy.int64
+            )
+            places = numpy.zeros(len(self.pks), dtype=numpy.int64)
+            places[ordered_rows] = numpy.arange(len(ordered_rows))
+            self.sort_places[sort_value] = places
+        return places
+
+    def get_page(self, bitmap, sort_value, size, after=None):
+        """Returns the pks of the first `size` endorsers in `bitmap` (in the
+        given sort order) that come after the (key, pk) tuple `after`, along
+        with the (key, pk) to pass in to get the next page (or None if this is
+        the last page)."""
+        ordered = self.sorts[sort_value]
+        descending = SORT_VALUES[sort_value]
+
+        # Only the endorsers in the bitmap are looked at, however few.
+        rows = numpy.flatnonzero(bitmap_to_array(bitmap, len(self.pks)))
+        places = self.get_sort_places(sort_value)[rows]
+        if after is not None:
+            if descending:
+                end = bisect.bisect_left(ordered, tuple(after))
+                places = places[places < end]
+            else:
+                start = bisect.bisect_right(ordered, tuple(after))
+                places = places[places >= start]
+
+        # The size + 1 places nearest the start of the page (the extra one
+        # says whether there's another page).
+        if descending:
+            places = -places
+        if len(places) > size + 1:
+            places = numpy.partition(places, size)[:size + 1]
+        places = numpy.sort(places)
+        if descending:
+            places = -places
+
+        page = [ordered[place] for place in places[:size]]
+        endorser_pks = [pk for key, pk in page]
+        if len(places) > size:
+            return endorser_pks, page[-1]
+        return endorser_pks, None
+
+    def get_pks(self, bitmap):
+        """Returns the pks of the endorsers in `bitmap`, in row order."""
+        rows = numpy.flatnonzero(bitmap_to_array(bitmap, len(self.pks)))
+        return [self.pks[row] for row in rows]
+
+    def count(self, bitmap):
+        return count_bits(bitmap)
+
+    def crosstab(self, rows, columns):
+        """Returns the number of endorsers in each pair of row and column
+        bitmaps, as a list with a list of column counts for each row."""
+        return [
+            [count_bits(row & column) for column in columns]
+            for row in rows
+        ]
+
+    def get_matrix(self, bitmaps):
+        """Returns a boolean matrix with a row for each of the given bitmaps
+        and a column for each endorser (in the order of self.pks)."""
+        size = len(self.pks)
+        rows = [bitmap_to_array(bitmap, size) for bitmap in bitmaps]
+        if not rows:
+            return numpy.zeros((0, size), dtype=bool)
+        return numpy.vstack(rows)
+
+    def get_facets(self, bitmap, facet_bitmaps):
+        """Returns a dict mapping each key in facet_bitmaps (e.g., self.tags)
+        to the number of endorsers in `bitmap` that are also in that facet's
+        bitmap. Facets with no endorsers are left out."""
+        counts = {}
+        for key, facet_bitmap in facet_bitmaps.iteritems():
+            count = count_bits(bitmap & facet_bitmap)
+            if count:
+                counts[key] = count
+        return counts
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def refresh_endorser_index(index, version):
+    """Brings index up to the given version, reloading just the endorsers
+    that have changed if possible and rebuilding it from scratch
+    otherwise."""
+    if index is not None:
+        endorser_pks = get_data_changes(index.version, version)
+        if endorser_pks is not None:
+            return index.apply_changes(endorser_pks, version)
+    return EndorserIndex(version)
+
+
+def get_endorser_index():
+    """Returns the index for the current data version, updating it if any
+    endorser data has been written since it was last built."""
+    global _index
+    version = get_data_version()
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            if _index is None or _index.version != version:
+                _index = refresh_endorser_index(_index, version)
+            index = _index
+    return index
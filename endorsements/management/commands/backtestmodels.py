@@ -0,0 +1,93 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from election.backtest import generate_variants, get_backtest_data, \
+                              run_backtest, score_models, write_scores
+
+
+class Command(BaseCommand):
+    help = 'Score variants of the prediction models against the results'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            default='backtest.csv',
+            help='Where to write the ranked scores (CSV)',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=None,
+            help='Number of worker processes (default: one per CPU)',
+        )
+        parser.add_argument(
+            '--thresholds',
+            type=int,
+            nargs='+',
+            default=[1, 2, 3],
+        )
+        parser.add_argument(
+            '--weights',
+            type=int,
+            nargs='+',
+            default=[1],
+            help='Also try every non-uniform weighting of these values',
+        )
+        parser.add_argument(
+            '--max-keys',
+            type=int,
+            default=3,
+            dest='max_keys',
+            help='The most endorser groups a variant counts at once',
+        )
+        parser.add_argument(
+            '--tiebreak-length',
+            type=int,
+            default=1,
+            dest='tiebreak_length',
+            help='The longest chain of tie-breaks to try',
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=10,
+            help='Number of the best variants to print',
+        )
+
+    def handle(self, *args, **options):
+        data = get_backtest_data()
+        print "Backtesting against", len(data.state_names), "states"
+
+        print "Current models:"
+        for score in score_models(data):
+            self.print_score(score)
+
+        variants = generate_variants(
+            thresholds=options['thresholds'],
+            max_keys=options['max_keys'],
+            weights=options['weights'],
+            tiebreak_length=options['tiebreak_length'],
+        )
+        start = time.time()
+        scores = run_backtest(data, variants, options['processes'])
+        print "Scored", len(scores), "variants in %.1fs" % (
+            time.time() - start
+        )
+
+        write_scores(options['output'], scores)
+        print "Wrote", options['output']
+
+        print "Best variants:"
+        for score in scores[:options['top']]:
+            self.print_score(score)
+
+    def print_score(self, score):
+        print "  %3d correct (%3d size), %3d-%3d EVs (off by %d): %s" % (
+            score['num_correct_candidate'],
+            score['num_correct_size'],
+            score['clinton_electoral_votes'],
+            score['trump_electoral_votes'],
+            score['electoral_vote_error'],
+            score['name'],
+        )
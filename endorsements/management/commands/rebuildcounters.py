@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from endorsements.models import EndorserCounter
+
+
+class Command(BaseCommand):
+    help = 'Recount the endorser counters (by position, type and tag)'
+
+    def handle(self, *args, **options):
+        EndorserCounter.objects.rebuild()
+        print "Rebuilt", EndorserCounter.objects.count(), "counters"
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from endorsements.models import Endorser
+from endorsements.signals import refresh_cards
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the stored browse-page card for every Endorser'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing',
+            action='store_true',
+            dest='missing',
+            default=False,
+            help="Only build cards for endorsers that don't have one yet",
+        )
+
+    def handle(self, *args, **options):
+        endorsers = Endorser.objects.all()
+        if options['missing']:
+            endorsers = endorsers.filter(card=None)
+
+        endorser_pks = list(endorsers.values_list('pk', flat=True))
+        for i in xrange(0, len(endorser_pks), 500):
+            print i
+            refresh_cards(
+                Endorser.objects.filter(pk__in=endorser_pks[i:i + 500])
+            )
+
+        print "Refreshed", len(endorser_pks)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from election.stats import STATS_PAGES, refresh_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the cached stats pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'pages',
+            nargs='*',
+            help='The pages to refresh (default: all of them)',
+        )
+
+    def handle(self, *args, **options):
+        pages = options['pages']
+        for page in pages:
+            if page not in STATS_PAGES:
+                raise CommandError('Unknown stats page: %s' % page)
+
+        refresh_stats(pages)
+        print "Refreshed", ', '.join(pages or sorted(STATS_PAGES))
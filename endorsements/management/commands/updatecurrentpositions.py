@@ -1,20 +1,65 @@
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
 
-from endorsements.models import Endorser
+from endorsements.caching import bump_data_version
+from endorsements.models import Endorsement, Endorser, EndorserCounter
 
 
 class Command(BaseCommand):
-    help = 'Refresh the current_position field for all Endorsers'
+    help = (
+        'Refresh the current_position, current_endorsement and endorsement '
+        'date fields for all Endorsers'
+    )
 
     def handle(self, *args, **options):
+        # The first and latest endorsement dates, in one grouped query (the
+        # default ordering has to be cleared so it isn't grouped by as well).
+        dates = Endorsement.objects.order_by().values('endorser').annotate(
+            first=Min('quote__date'),
+            latest=Max('quote__date'),
+        )
+        expected = {}
+        for row in dates:
+            expected[row['endorser']] = [None, None, row['first'],
+                                         row['latest']]
+
+        # The current endorsement is the first one in the same order as
+        # Endorser.get_current_endorsement's latest('quote') (which follows
+        # Quote's ordering).
+        seen = set()
+        endorsements = Endorsement.objects.order_by('-quote').values_list(
+            'endorser_id', 'pk', 'position_id'
+        )
+        for endorser_pk, endorsement_pk, position_pk in endorsements:
+            if endorser_pk not in seen:
+                seen.add(endorser_pk)
+                expected[endorser_pk][:2] = [endorsement_pk, position_pk]
+
+        # Only write the rows that are actually out of date.
         n = 0
-        for i, e in enumerate(Endorser.objects.all()):
-            if i % 100 == 0:
-                print i
-            endorsement = e.get_current_endorsement()
-            if endorsement and e.current_position != endorsement.position:
-                e.current_position = endorsement.position
-                e.save()
+        endorsers = Endorser.objects.values_list(
+            'pk', 'current_endorsement_id', 'current_position_id',
+            'first_endorsement_date', 'latest_endorsement_date'
+        )
+        with transaction.atomic():
+            for row in endorsers:
+                endorser_pk = row[0]
+                values = expected.get(endorser_pk, [None] * 4)
+                if list(row[1:]) == values:
+                    continue
+
+                Endorser.objects.filter(pk=endorser_pk).update(
+                    current_endorsement=values[0],
+                    current_position=values[1],
+                    first_endorsement_date=values[2],
+                    latest_endorsement_date=values[3],
+                )
                 n += 1
 
+        if n:
+            # update() bypasses the incremental counter updates.
+            EndorserCounter.objects.rebuild()
+            bump_data_version()
+
         print "Refreshed", n
@@ -1,10 +1,16 @@
 from __future__ import unicode_literals
+import collections
+import contextlib
+import json
 import shutil
+import threading
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Max, Min
 from django.urls import reverse
 import requests
 
+from endorsements.templatetags.endorsement_extras import shorten
 from endorsements.utils import get_twitter_client
 
 
@@ -54,7 +60,36 @@ class Tag(models.Model):
             return 'organization'
 
 
+# What this thread is in the middle of deleting (see deleting_endorsers).
+_deleting = threading.local()
+
+
+@contextlib.contextmanager
+def deleting_endorsers(endorser_pks):
+    """Marks the given endorsers as being deleted (by this thread) until
+    the block exits, however it exits. Their endorsements and accounts are
+    deleted before they are, and nothing should be rebuilt for them then."""
+    previous_pks = get_deleting_endorser_pks()
+    _deleting.endorser_pks = previous_pks | frozenset(endorser_pks)
+    try:
+        yield
+    finally:
+        _deleting.endorser_pks = previous_pks
+
+
+def get_deleting_endorser_pks():
+    return getattr(_deleting, 'endorser_pks', frozenset())
+
+
+class EndorserQuerySet(models.QuerySet):
+    def delete(self):
+        with deleting_endorsers(self.values_list('pk', flat=True)):
+            return super(EndorserQuerySet, self).delete()
+
+
 class Endorser(models.Model):
+    objects = EndorserQuerySet.as_manager()
+
     name = models.CharField(max_length=100)
     description = models.TextField(null=True, blank=True)
     url = models.URLField(null=True, blank=True)
@@ -63,6 +98,21 @@ class Endorser(models.Model):
     tags = models.ManyToManyField(Tag, blank=True)
     missing_image = models.BooleanField(default=True)
     current_position = models.ForeignKey('Position', blank=True, null=True)
+    # The fields below are denormalized from the endorser's endorsements, and
+    # are kept up to date by refresh_endorsement_fields().
+    current_endorsement = models.ForeignKey(
+        'Endorsement',
+        blank=True,
+        null=True,
+        related_name='+',
+        on_delete=models.SET_NULL,
+    )
+    first_endorsement_date = models.DateField(
+        blank=True, null=True, db_index=True
+    )
+    latest_endorsement_date = models.DateField(
+        blank=True, null=True, db_index=True
+    )
 
     class Meta:
         ordering = ['-max_followers']
@@ -70,6 +120,10 @@ class Endorser(models.Model):
     def __unicode__(self):
         return self.name
 
+    def delete(self, *args, **kwargs):
+        with deleting_endorsers([self.pk]):
+            return super(Endorser, self).delete(*args, **kwargs)
+
     def has_url(self):
         return bool(self.url)
     has_url.boolean = True
@@ -83,6 +137,40 @@ class Endorser(models.Model):
         except Endorsement.DoesNotExist:
             pass
 
+    def refresh_endorsement_fields(self):
+        """Recalculates the current endorsement (and position) and the
+        first/latest endorsement dates. Uses update() so that no post_save
+        signal is sent for the endorser."""
+        dates = self.endorsement_set.aggregate(
+            first=Min('quote__date'),
+            latest=Max('quote__date'),
+        )
+        current_endorsement = self.get_current_endorsement()
+        if current_endorsement:
+            current_position_id = current_endorsement.position_id
+        else:
+            current_position_id = None
+
+        if current_position_id != self.current_position_id:
+            tag_pks = list(self.tags.values_list('pk', flat=True))
+            EndorserCounter.objects.apply_delta(
+                get_counter_keys(self.current_position_id, self.is_personal,
+                                 tag_pks),
+                get_counter_keys(current_position_id, self.is_personal,
+                                 tag_pks),
+            )
+
+        self.current_endorsement = current_endorsement
+        self.current_position_id = current_position_id
+        self.first_endorsement_date = dates['first']
+        self.latest_endorsement_date = dates['latest']
+        Endorser.objects.filter(pk=self.pk).update(
+            current_endorsement=current_endorsement,
+            current_position=current_position_id,
+            first_endorsement_date=dates['first'],
+            latest_endorsement_date=dates['latest'],
+        )
+
     def get_image(self):
         return '<img src="{url}" width="100" />'.format(
             url=self.get_image_url()
@@ -101,6 +189,113 @@ class Endorser(models.Model):
     def get_absolute_url(self):
         return reverse('view-endorser', args=[self.pk])
 
+    def get_card_data(self):
+        """Returns the (compact) dict used to render this endorser's card on
+        the browse page. Use prefetch_related on tags, endorsements (with
+        their positions, quotes, sources and events) and accounts when
+        calling this for many endorsers at once."""
+        tags = []
+        for tag in self.tags.all():
+            tags.append((tag.name, tag.pk))
+
+        endorsements = []
+        for i, endorsement in enumerate(self.endorsement_set.all()):
+            position = endorsement.position
+            if i == 0:
+                display = position.get_present_display()
+            else:
+                display = position.get_past_display()
+
+            quote = endorsement.quote
+            source = quote.source
+            event = quote.event
+            if event:
+                if event.start_date == event.end_date:
+                    event_dates = event.start_date.strftime('%b %d, %Y')
+                else:
+                    event_dates = '{start} to {end}'.format(
+                        start=event.start_date.strftime('%b %d, %Y'),
+                        end=event.end_date.strftime('%b %d, %Y')
+                    )
+            else:
+                event_dates = None
+
+            endorsements.append({
+                'c': position.colour,
+                'di': display,
+                'q': quote.text,
+                'cx': quote.context,
+                'ecx': quote.get_event_context(),
+                'e': event.name if event else '',
+                'ed': event_dates,
+                'da': quote.get_date_display(),
+                'su': source.url,
+                'sd': source.get_date_display(),
+                'sn': source.name,
+            })
+
+        accounts = []
+        for account in self.account_set.all():
+            accounts.append({
+                'u': account.screen_name,
+                'n': shorten(account.followers_count),
+            })
+
+        # Don't bother checking if it's a candidate unless there are no
+        # endorsements.
+        is_candidate = False
+        if not endorsements:
+            from endorsements.registry import get_registry
+            is_candidate = self.pk in get_registry().candidate_endorser_pks
+
+        description = self.description
+        if description:
+            if len(description) > 80:
+                description = description[:80] + '...'
+        else:
+            description = 'No description'
+
+        return {
+            'p': self.pk,
+            'n': self.name,
+            'u': self.url,
+            'd': description,
+            't': tags,
+            'e': endorsements,
+            'a': accounts,
+            'c': is_candidate,
+            'i': 'missing' if self.missing_image else self.pk,
+        }
+
+    def refresh_card(self):
+        """Rebuilds the stored card for this endorser and returns it."""
+        card, _ = EndorserCard.objects.update_or_create(
+            endorser=self,
+            defaults={
+                'data': json.dumps(self.get_card_data()),
+            }
+        )
+        return card
+
+
+class EndorserCard(models.Model):
+    """A pre-serialized copy of Endorser.get_card_data(), so that a page of
+    endorsers can be returned without touching any of the related tables.
+    Kept up to date by the handlers in endorsements.signals."""
+    endorser = models.OneToOneField(
+        Endorser,
+        primary_key=True,
+        related_name='card',
+    )
+    data = models.TextField()
+    last_updated = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return unicode(self.endorser)
+
+    def get_data(self):
+        return json.loads(self.data)
+
 
 class AccountManager(models.Manager):
     def get_from_username(self, username, endorser=None):
@@ -402,3 +597,111 @@ class Endorsement(models.Model):
             return self.quote.text[:100] + '...'
         else:
             return self.quote.text
+
+
+def get_counter_keys(position_pk, is_personal, tag_pks):
+    """Returns the keys of all the counters an endorser with the given current
+    position, type and tags counts towards."""
+    endorser_type = 'personal' if is_personal else 'org'
+    keys = ['all', 'all:' + endorser_type]
+    if position_pk is not None:
+        keys.append('position:%d' % position_pk)
+        keys.append('position:%d:%s' % (position_pk, endorser_type))
+
+    for tag_pk in tag_pks:
+        keys.append('tag:%d' % tag_pk)
+        if position_pk is not None:
+            keys.append('tag:%d:position:%d' % (tag_pk, position_pk))
+
+    return keys
+
+
+class EndorserCounterManager(models.Manager):
+    def get_endorser_keys(self, endorser_pks=None):
+        """Returns a dict mapping each endorser pk to the counter keys that
+        endorser currently counts towards (for every endorser if endorser_pks
+        is None)."""
+        endorsers = Endorser.objects.all()
+        links = Endorser.tags.through.objects.all()
+        if endorser_pks is not None:
+            endorsers = endorsers.filter(pk__in=endorser_pks)
+            links = links.filter(endorser_id__in=endorser_pks)
+
+        endorser_tags = collections.defaultdict(list)
+        for endorser_pk, tag_pk in links.values_list('endorser_id', 'tag_id'):
+            endorser_tags[endorser_pk].append(tag_pk)
+
+        endorser_keys = {}
+        rows = endorsers.values_list('pk', 'current_position_id', 'is_personal')
+        for endorser_pk, position_pk, is_personal in rows:
+            endorser_keys[endorser_pk] = get_counter_keys(
+                position_pk, is_personal, endorser_tags[endorser_pk]
+            )
+        return endorser_keys
+
+    def rebuild(self):
+        """Recounts everything from scratch."""
+        counts = collections.Counter()
+        for keys in self.get_endorser_keys().itervalues():
+            counts.update(keys)
+
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(
+                EndorserCounter(key=key, count=count)
+                for key, count in counts.iteritems()
+            )
+
+    def get_counts(self, keys):
+        counts = dict.fromkeys(keys, 0)
+        counts.update(self.filter(key__in=keys).values_list('key', 'count'))
+        return counts
+
+    def apply_delta(self, old_keys, new_keys):
+        """Decrements the counters for old_keys and increments the ones for
+        new_keys (keys that appear in both are left alone)."""
+        deltas = collections.Counter(new_keys)
+        deltas.subtract(old_keys)
+
+        keys_by_delta = collections.defaultdict(list)
+        for key, delta in deltas.iteritems():
+            if delta:
+                keys_by_delta[delta].append(key)
+
+        if not keys_by_delta:
+            return
+
+        all_keys = [key for keys in keys_by_delta.values() for key in keys]
+        existing_keys = set(
+            self.filter(key__in=all_keys).values_list('key', flat=True)
+        )
+
+        for delta, keys in keys_by_delta.iteritems():
+            self.filter(
+                key__in=[key for key in keys if key in existing_keys]
+            ).update(count=F('count') + delta)
+            for key in keys:
+                if key not in existing_keys:
+                    self.create_or_add(key, delta)
+
+    def create_or_add(self, key, delta):
+        """Creates the counter for key with a count of delta, or adds delta
+        to it if another transaction has created it in the meantime."""
+        try:
+            # In a savepoint, so that a clash doesn't break the transaction.
+            with transaction.atomic():
+                self.create(key=key, count=delta)
+        except IntegrityError:
+            self.filter(key=key).update(count=F('count') + delta)
+
+
+class EndorserCounter(models.Model):
+    """The number of endorsers at each position, by type and by tag, updated
+    incrementally as endorsers change (see get_counter_keys for the keys)."""
+    objects = EndorserCounterManager()
+
+    key = models.CharField(max_length=50, unique=True)
+    count = models.IntegerField(default=0)
+
+    def __unicode__(self):
+        return "{key}: {count}".format(key=self.key, count=self.count)
@@ -0,0 +1,102 @@
+import collections
+import threading
+
+from endorsements.caching import get_versions
+from endorsements.models import Candidate, Category, Position, Tag
+
+
+REGISTRY_NAMESPACES = ('tags', 'positions')
+
+
+class Registry(object):
+    """Every tag, category, position and candidate, loaded once per process
+    and shared by all requests until one of them changes. The model instances
+    in here are shared, so treat them as read-only.
+    """
+    def __init__(self, version=None):
+        self.version = version
+
+        self.categories = list(Category.objects.order_by('pk'))
+        self.categories_by_pk = {}
+        self.categories_by_name = {}
+        for category in self.categories:
+            self.categories_by_pk[category.pk] = category
+            self.categories_by_name[category.name] = category
+
+        # Tags are in name order (within each category, too).
+        self.tags = list(Tag.objects.all())
+        self.tags_by_pk = {}
+        self.tags_by_name = {}
+        self.category_tags = collections.defaultdict(list)
+        for tag in self.tags:
+            # Fill in the foreign key so that tag.category doesn't query.
+            tag.category = self.categories_by_pk.get(tag.category_id)
+            self.tags_by_pk[tag.pk] = tag
+            self.tags_by_name[tag.name] = tag
+            if tag.category_id is not None:
+                self.category_tags[tag.category_id].append(tag)
+
+        self.positions = list(Position.objects.order_by('pk'))
+        self.positions_by_pk = {}
+        self.positions_by_slug = {}
+        for position in self.positions:
+            self.positions_by_pk[position.pk] = position
+            if position.slug:
+                self.positions_by_slug.setdefault(position.slug, position)
+
+        self.candidates = list(Candidate.objects.order_by('pk'))
+        for candidate in self.candidates:
+            candidate.position = self.positions_by_pk.get(
+                candidate.position_id
+            )
+        self.running_candidates = [
+            candidate for candidate in self.candidates
+            if candidate.still_running
+        ]
+        self.candidate_endorser_pks = set(
+            candidate.endorser_link_id for candidate in self.candidates
+        )
+
+    def get_tag(self, name):
+        try:
+            return self.tags_by_name[name]
+        except KeyError:
+            raise Tag.DoesNotExist(name)
+
+    def get_category(self, name):
+        try:
+            return self.categories_by_name[name]
+        except KeyError:
+            raise Category.DoesNotExist(name)
+
+    def get_position(self, slug):
+        try:
+            return self.positions_by_slug[slug]
+        except KeyError:
+            raise Position.DoesNotExist(slug)
+
+    def get_category_tag_pks(self, name):
+        """Returns the set of pks of the tags in the named category (which
+        is empty if there's no such category)."""
+        category = self.categories_by_name.get(name)
+        if category is None:
+            return set()
+        return set(tag.pk for tag in self.category_tags[category.pk])
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Returns the registry, reloading it first if any tags, categories,
+    positions or candidates have changed since it was loaded."""
+    global _registry
+    version = tuple(get_versions(*REGISTRY_NAMESPACES))
+    registry = _registry
+    if registry is None or registry.version != version:
+        with _registry_lock:
+            if _registry is None or _registry.version != version:
+                _registry = Registry(version)
+            registry = _registry
+    return registry
@@ -0,0 +1,579 @@
+import bisect
+import collections
+import itertools
+import math
+import re
+import threading
+import unicodedata
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.html import escape
+
+from endorsements.caching import bump_version, get_data_changes, \
+                                  get_data_version, get_version
+from endorsements.models import Account, Endorsement, Endorser
+
+
+AUTOCOMPLETE_VERSION_KEY = 'autocomplete_version'
+AUTOCOMPLETE_CHANGE_KEY = 'autocomplete_change_{version}'
+# Other processes catch up by replaying the changes they've missed, as long
+# as there aren't too many of them (and they haven't expired).
+AUTOCOMPLETE_CHANGE_TIMEOUT = 60 * 60
+MAX_AUTOCOMPLETE_CHANGES = 100
+AUTOCOMPLETE_LIMIT = 5
+# Queries up to this long are looked up directly; longer ones are checked
+# against the endorsers matching their first PREFIX_LENGTH characters.
+PREFIX_LENGTH = 4
+NGRAM_SIZE = 3
+
+# BM25 parameters for full-text ranking.
+K1 = 1.2
+B = 0.75
+SNIPPET_LENGTH = 200
+# Each full-text index keeps the results of up to this many searches.
+MAX_CACHED_SEARCHES = 1000
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has',
+    'he', 'i', 'in', 'is', 'it', 'its', 'of', 'on', 'or', 'that', 'the',
+    'this', 'to', 'was', 'we', 'will', 'with',
+])
+
+NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def normalize(text):
+    """Lowercases text, strips accents and collapses runs of anything that
+    isn't a letter or a digit into a single space."""
+    if not isinstance(text, unicode):
+        text = text.decode('utf-8')
+    text = unicodedata.normalize('NFKD', text)
+    text = u''.join(c for c in text if not unicodedata.combining(c))
+    return NON_WORD.sub(u' ', text.lower()).strip()
+
+
+def get_terms(name, screen_names):
+    terms = set([normalize(name)])
+    terms.update(normalize(screen_name) for screen_name in screen_names)
+    terms.discard(u'')
+    return terms
+
+
+def get_prefixes(terms):
+    prefixes = set()
+    for term in terms:
+        for i in xrange(1, min(len(term), PREFIX_LENGTH) + 1):
+            prefixes.add(term[:i])
+    return prefixes
+
+
+def get_ngrams(terms):
+    """Returns every NGRAM_SIZE-character substring of the given terms."""
+    ngrams = set()
+    for term in terms:
+        for i in xrange(len(term) - NGRAM_SIZE + 1):
+            ngrams.add(term[i:i + NGRAM_SIZE])
+    return ngrams
+
+
+def record_endorser_change(endorser_pk):
+    """Called whenever an endorser's name, followers or accounts change (or
+    the endorser is deleted) so that every process can update its index.
+    The change is only recorded once the current transaction commits, so no
+    process can reload the endorser before the change is visible."""
+    def record():
+        version = bump_version(AUTOCOMPLETE_VERSION_KEY)
+        cache.set(
+            AUTOCOMPLETE_CHANGE_KEY.format(version=version),
+            endorser_pk,
+            AUTOCOMPLETE_CHANGE_TIMEOUT
+        )
+    transaction.on_commit(record)
+
+
+class AutocompleteIndex(object):
+    """Normalized endorser names and Twitter screen names, for answering
+    search-as-you-type queries without going to the database.
+
+    Each prefix (up to PREFIX_LENGTH characters) and each n-gram maps to a
+    list of the endorsers that have it, kept sorted by (-max_followers, pk),
+    so the best matches are always at the front of the list.
+
+    An index is never changed once built, so searches don't need a lock:
+    apply_changes returns a copy that shares every list it doesn't change.
+    """
+    def __init__(self, version=None):
+        self.version = version
+        self.endorsers = {}
+        self.prefixes = collections.defaultdict(list)
+        self.ngrams = collections.defaultdict(list)
+
+        for pk, row in self.load().iteritems():
+            self.add(pk, *row, sort=False)
+
+        for postings in self.prefixes.itervalues():
+            postings.sort()
+        for postings in self.ngrams.itervalues():
+            postings.sort()
+        self.prefixes = dict(self.prefixes)
+        self.ngrams = dict(self.ngrams)
+
+    @staticmethod
+    def load(endorser_pks=None):
+        """Returns a dict mapping each endorser pk to its name, max_followers
+        and search terms."""
+        endorsers = Endorser.objects.all()
+        accounts = Account.objects.all()
+        if endorser_pks is not None:
+            endorsers = endorsers.filter(pk__in=endorser_pks)
+            accounts = accounts.filter(endorser_id__in=endorser_pks)
+
+        screen_names = collections.defaultdict(list)
+        for endorser_pk, screen_name in accounts.values_list(
+            'endorser_id', 'screen_name'
+        ):
+            screen_names[endorser_pk].append(screen_name)
+
+        rows = {}
+        for pk, name, max_followers in endorsers.values_list(
+            'pk', 'name', 'max_followers'
+        ):
+            terms = get_terms(name, screen_names[pk])
+            rows[pk] = (name, max_followers, terms)
+        return rows
+
+    def get_keys(self, terms):
+        # Every endorser has the empty prefix, so its list is everyone in
+        # order (see search).
+        return ((self.prefixes, get_prefixes(terms) | set([u''])),
+                (self.ngrams, get_ngrams(terms)))
+
+    def add(self, pk, name, max_followers, terms, sort=True,
+            copied_keys=None):
+        """Adds an endorser to the postings. If copied_keys is given, lists
+        that may be shared with another index are copied before they're
+        changed (and recorded in copied_keys)."""
+        rank = (-max_followers, pk)
+        self.endorsers[pk] = (rank, name, terms)
+        for postings, keys in self.get_keys(terms):
+            for key in keys:
+                if copied_keys is None:
+                    ranks = postings[key]
+                else:
+                    ranks = self.get_ranks(postings, key, copied_keys)
+                if sort:
+                    bisect.insort(ranks, rank)
+                else:
+                    ranks.append(rank)
+
+    def remove(self, pk, copied_keys):
+        rank, name, terms = self.endorsers.pop(pk)
+        for postings, keys in self.get_keys(terms):
+            for key in keys:
+                ranks = self.get_ranks(postings, key, copied_keys)
+                del ranks[bisect.bisect_left(ranks, rank)]
+                if not ranks:
+                    del postings[key]
+
+    @staticmethod
+    def get_ranks(postings, key, copied_keys):
+        """Returns the list for the key, copying it first if it hasn't been
+        already."""
+        copied_key = (id(postings), key)
+        if copied_key in copied_keys:
+            # (It may have been emptied and deleted since.)
+            return postings.setdefault(key, [])
+        copied_keys.add(copied_key)
+        ranks = postings[key] = list(postings.get(key, ()))
+        return ranks
+
+    def copy(self, version):
+        index = AutocompleteIndex.__new__(AutocompleteIndex)
+        index.version = version
+        index.endorsers = dict(self.endorsers)
+        # The lists themselves are copied as they're changed.
+        index.prefixes = dict(self.prefixes)
+        index.ngrams = dict(self.ngrams)
+        return index
+
+    def apply_changes(self, endorser_pks, version):
+        """Returns a copy of the index for the given version, with the given
+        endorsers reloaded from the database (and any that no longer exist
+        removed)."""
+        index = self.copy(version)
+        copied_keys = set()
+        for pk in endorser_pks:
+            if pk in index.endorsers:
+                index.remove(pk, copied_keys)
+        for pk, row in self.load(endorser_pks).iteritems():
+            index.add(pk, *row, copied_keys=copied_keys)
+        return index
+
+    def get_matches(self, ranks, matches):
+        """Yields the pks in ranks (in order) for which matches(terms) is
+        true."""
+        for rank in ranks:
+            pk = rank[1]
+            if matches(self.endorsers[pk][2]):
+                yield pk
+
+    def search(self, query, limit=AUTOCOMPLETE_LIMIT):
+        """Returns a list of (pk, name) for the endorsers best matching the
+        query: names or screen names starting with it come first, then ones
+        containing it, each ordered by max_followers."""
+        query = normalize(query)
+        if not query:
+            return []
+
+        if len(query) <= PREFIX_LENGTH:
+            prefix_ranks = self.prefixes.get(query, [])
+            pks = [rank[1] for rank in prefix_ranks[:limit]]
+        else:
+            pks = list(itertools.islice(self.get_matches(
+                self.prefixes.get(query[:PREFIX_LENGTH], []),
+                lambda terms: any(term.startswith(query) for term in terms)
+            ), limit))
+
+        if len(pks) < limit:
+            if len(query) < NGRAM_SIZE:
+                # Too short for n-grams, so check everyone (in order, so
+                # common letters stop the scan early).
+                ngram_ranks = self.prefixes.get(u'', [])
+            else:
+                # Only the endorsers with the query's rarest n-gram can
+                # possibly contain it.
+                ngram_ranks = min(
+                    (self.ngrams.get(query[i:i + NGRAM_SIZE], [])
+                     for i in xrange(len(query) - NGRAM_SIZE + 1)),
+                    key=len
+                )
+
+            prefix_pks = set(pks)
+            matches = self.get_matches(
+                ngram_ranks,
+                lambda terms: any(query in term for term in terms)
+            )
+            for pk in matches:
+                if pk not in prefix_pks:
+                    pks.append(pk)
+                    if len(pks) == limit:
+                        break
+
+        return [(pk, self.endorsers[pk][1]) for pk in pks]
+
+
+_autocomplete_index = None
+_autocomplete_lock = threading.Lock()
+
+
+def refresh_autocomplete_index(index, version):
+    """Brings index up to the given version, replaying the recorded changes
+    if possible and rebuilding it from scratch otherwise."""
+    if index is not None and \
+       index.version < version <= index.version + MAX_AUTOCOMPLETE_CHANGES:
+        keys = [
+            AUTOCOMPLETE_CHANGE_KEY.format(version=v)
+            for v in xrange(index.version + 1, version + 1)
+        ]
+        changes = cache.get_many(keys)
+        if len(changes) == len(keys):
+            return index.apply_changes(set(changes.itervalues()), version)
+
+    return AutocompleteIndex(version)
+
+
+def get_autocomplete_index():
+    global _autocomplete_index
+    version = get_version(AUTOCOMPLETE_VERSION_KEY)
+    index = _autocomplete_index
+    if index is None or index.version != version:
+        with _autocomplete_lock:
+            if _autocomplete_index is None or \
+               _autocomplete_index.version != version:
+                _autocomplete_index = refresh_autocomplete_index(
+                    _autocomplete_index, version
+                )
+            index = _autocomplete_index
+    return index
+
+
+def tokenize(text):
+    """Returns the normalized words in text, leaving out stop words."""
+    return [
+        word for word in normalize(text).split() if word not in STOP_WORDS
+    ]
+
+
+def make_snippet(text, terms, length=SNIPPET_LENGTH):
+    """Returns an HTML excerpt of text around the first word in terms, with
+    every matching word wrapped in <mark>."""
+    matches = [
+        match for match in WORD.finditer(text)
+        if normalize(match.group()) in terms
+    ]
+    if matches:
+        start = max(0, matches[0].start() - length // 3)
+        # Don't start in the middle of a word.
+        if start > 0:
+            space = text.find(' ', start)
+            if space != -1 and space < matches[0].start():
+                start = space + 1
+    else:
+        start = 0
+    end = min(len(text), start + length)
+
+    pieces = []
+    if start > 0:
+        pieces.append(u'...')
+    position = start
+    for match in matches:
+        if match.start() < start:
+            continue
+        if match.end() > end:
+            break
+        pieces.append(escape(text[position:match.start()]))
+        pieces.append(u'<mark>%s</mark>' % escape(match.group()))
+        position = match.end()
+    pieces.append(escape(text[position:end]))
+    if end < len(text):
+        pieces.append(u'...')
+    return u''.join(pieces)
+
+
+class FullTextIndex(object):
+    """An inverted index over quotes, their contexts and endorser
+    descriptions, ranked with BM25.
+
+    Every quote, context and description is a separate document belonging
+    to an endorser; an endorser matches a query if their documents contain
+    all of its words between them, and their score is the sum of the scores
+    of those documents.
+
+    Like EndorserIndex, an index is never changed once built: apply_changes
+    returns a copy that shares everything but the postings it changes.
+    """
+    def __init__(self, version=None):
+        self.version = version
+        # doc id -> (endorser pk, field, text)
+        self.documents = {}
+        self.lengths = {}
+        self.total_length = 0
+        self.next_doc_id = 0
+        # endorser pk -> tuple of doc ids
+        self.endorser_documents = {}
+        # term -> dict mapping doc id to term frequency
+        self.postings = {}
+        # frozenset of terms -> (results, best documents); see get_results.
+        self.results = {}
+
+        for endorser_pk, field, text in self.load():
+            self.add(endorser_pk, field, text)
+
+    @staticmethod
+    def load(endorser_pks=None):
+        """Returns (endorser pk, field, text) for each of the endorsers'
+        documents."""
+        endorsements = Endorsement.objects.all()
+        endorsers = Endorser.objects.all()
+        if endorser_pks is not None:
+            endorsements = endorsements.filter(endorser_id__in=endorser_pks)
+            endorsers = endorsers.filter(pk__in=endorser_pks)
+
+        documents = []
+        for endorser_pk, text, context in endorsements.values_list(
+            'endorser_id', 'quote__text', 'quote__context'
+        ):
+            documents.append((endorser_pk, 'quote', text))
+            documents.append((endorser_pk, 'context', context))
+        for endorser_pk, description in endorsers.values_list(
+            'pk', 'description'
+        ):
+            documents.append((endorser_pk, 'description', description))
+        return documents
+
+    def get_postings(self, term, copied_terms=None):
+        """Returns the term's postings for changing. If copied_terms is
+        given, postings that may be shared with another index are copied
+        first (and the term added to copied_terms)."""
+        postings = self.postings.get(term)
+        if postings is None:
+            postings = self.postings[term] = {}
+        elif copied_terms is not None and term not in copied_terms:
+            postings = self.postings[term] = dict(postings)
+        if copied_terms is not None:
+            copied_terms.add(term)
+        return postings
+
+    def add(self, endorser_pk, field, text, copied_terms=None):
+        if not text:
+            return
+        words = tokenize(text)
+        if not words:
+            return
+
+        doc_id = self.next_doc_id
+        self.next_doc_id += 1
+        self.documents[doc_id] = (endorser_pk, field, text)
+        self.lengths[doc_id] = len(words)
+        self.total_length += len(words)
+        self.endorser_documents[endorser_pk] = \
+            self.endorser_documents.get(endorser_pk, ()) + (doc_id,)
+        for term, frequency in collections.Counter(words).iteritems():
+            self.get_postings(term, copied_terms)[doc_id] = frequency
+
+    def remove(self, endorser_pk, copied_terms):
+        """Removes all of the endorser's documents."""
+        for doc_id in self.endorser_documents.pop(endorser_pk, ()):
+            text = self.documents.pop(doc_id)[2]
+            self.total_length -= self.lengths.pop(doc_id)
+            for term in set(tokenize(text)):
+                postings = self.get_postings(term, copied_terms)
+                del postings[doc_id]
+                if not postings:
+                    del self.postings[term]
+
+    def copy(self, version):
+        index = FullTextIndex.__new__(FullTextIndex)
+        index.version = version
+        index.documents = dict(self.documents)
+        index.lengths = dict(self.lengths)
+        index.total_length = self.total_length
+        index.next_doc_id = self.next_doc_id
+        index.endorser_documents = dict(self.endorser_documents)
+        # The postings dicts themselves are copied as they're changed.
+        index.postings = dict(self.postings)
+        index.results = {}
+        return index
+
+    def apply_changes(self, endorser_pks, version):
+        """Returns a copy of the index for the given version, with the given
+        endorsers' documents reloaded from the database."""
+        index = self.copy(version)
+        copied_terms = set()
+        for endorser_pk in endorser_pks:
+            index.remove(endorser_pk, copied_terms)
+        for endorser_pk, field, text in self.load(endorser_pks):
+            index.add(endorser_pk, field, text, copied_terms)
+        return index
+
+    def get_results(self, terms):
+        """Returns a list of (-score, endorser pk) for every endorser
+        matching all of the terms (best first) and a dict mapping each of
+        those endorsers to the id of their best-matching document.
+
+        Scores only change with the index, so each index keeps the results
+        of its most recent searches."""
+        results = self.results.get(terms)
+        if results is not None:
+            return results
+        if not terms or any(term not in self.postings for term in terms):
+            return [], {}
+
+        num_documents = len(self.documents)
+        average_length = float(self.total_length) / num_documents
+        endorser_scores = collections.defaultdict(float)
+        endorser_terms = collections.defaultdict(int)
+        document_scores = collections.defaultdict(float)
+        for term in terms:
+            postings = self.postings[term]
+            idf = math.log(
+                1 + (num_documents - len(postings) + 0.5) /
+                (len(postings) + 0.5)
+            )
+            seen = set()
+            for doc_id, frequency in postings.iteritems():
+                endorser_pk = self.documents[doc_id][0]
+                length_ratio = self.lengths[doc_id] / average_length
+                score = idf * frequency * (K1 + 1) / (
+                    frequency + K1 * (1 - B + B * length_ratio)
+                )
+                endorser_scores[endorser_pk] += score
+                document_scores[doc_id] += score
+                if endorser_pk not in seen:
+                    seen.add(endorser_pk)
+                    endorser_terms[endorser_pk] += 1
+
+        matches = sorted(
+            (-score, endorser_pk)
+            for endorser_pk, score in endorser_scores.iteritems()
+            if endorser_terms[endorser_pk] == len(terms)
+        )
+
+        best_documents = {}
+        for doc_id, score in document_scores.iteritems():
+            endorser_pk = self.documents[doc_id][0]
+            if endorser_terms[endorser_pk] != len(terms):
+                continue
+            best = best_documents.get(endorser_pk)
+            if best is None or score > document_scores[best]:
+                best_documents[endorser_pk] = doc_id
+
+        if len(self.results) >= MAX_CACHED_SEARCHES:
+            self.results.clear()
+        self.results[terms] = matches, best_documents
+        return matches, best_documents
+
+    def search(self, query, endorser_pks=None):
+        """Returns the query's terms, a list of (-score, endorser pk) for the
+        matching endorsers (best first) and a dict mapping each of those
+        endorsers to the id of their best-matching document. If given, only
+        the endorsers in the set endorser_pks are considered."""
+        terms = frozenset(tokenize(query))
+        results, best_documents = self.get_results(terms)
+        if endorser_pks is not None:
+            results = [
+                result for result in results if result[1] in endorser_pks
+            ]
+        return terms, results, best_documents
+
+    def get_page(self, results, size, after=None):
+        """Returns the (-score, pk) tuples for the `size` results after the
+        `after` tuple, and the tuple to pass in for the next page (or None
+        if this is the last page)."""
+        start = 0
+        if after is not None:
+            start = bisect.bisect_right(results, tuple(after))
+        page = results[start:start + size]
+        if start + size < len(results):
+            return page, page[-1]
+        return page, None
+
+    def get_snippet(self, doc_id, terms):
+        endorser_pk, field, text = self.documents[doc_id]
+        return {
+            'field': field,
+            'html': make_snippet(text, terms),
+        }
+
+
+_full_text_index = None
+_full_text_lock = threading.Lock()
+
+
+def refresh_full_text_index(index, version):
+    """Brings index up to the given version, reloading just the endorsers
+    that have changed if possible and rebuilding it from scratch
+    otherwise."""
+    if index is not None:
+        endorser_pks = get_data_changes(index.version, version)
+        if endorser_pks is not None:
+            return index.apply_changes(endorser_pks, version)
+    return FullTextIndex(version)
+
+
+def get_full_text_index():
+    """Returns the full-text index for the current data version, updating it
+    if anything has been written since it was last built."""
+    global _full_text_index
+    version = get_data_version()
+    index = _full_text_index
+    if index is None or index.version != version:
+        with _full_text_lock:
+            if _full_text_index is None or \
+               _full_text_index.version != version:
+                _full_text_index = refresh_full_text_index(
+                    _full_text_index, version
+                )
+            index = _full_text_index
+    return index
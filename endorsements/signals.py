@@ -0,0 +1,223 @@
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, \
+                                     pre_delete, pre_save
+from django.dispatch import receiver
+
+from endorsements.caching import bump_data_version, bump_versions
+from endorsements.models import Account, Candidate, Category, Endorsement, \
+                                Endorser, EndorserCounter, Event, Position, \
+                                Quote, Source, Tag, get_deleting_endorser_pks
+from endorsements.search import record_endorser_change
+
+
+def refresh_cards(endorsers):
+    """Rebuilds the stored cards for the given endorsers (a queryset), and
+    marks everything derived from endorser data as out of date."""
+    deleting_endorser_pks = get_deleting_endorser_pks()
+    if deleting_endorser_pks:
+        endorsers = endorsers.exclude(pk__in=deleting_endorser_pks)
+    endorsers = endorsers.distinct().prefetch_related(
+        'tags',
+        'endorsement_set__position',
+        'endorsement_set__quote',
+        'endorsement_set__quote__source',
+        'endorsement_set__quote__event',
+        'account_set'
+    )
+    endorser_pks = []
+    for endorser in endorsers:
+        endorser.refresh_card()
+        endorser_pks.append(endorser.pk)
+    bump_data_version(endorser_pks)
+
+
+def refresh_endorsement_fields(endorsers):
+    """Recalculates the denormalized endorsement fields (current position,
+    first/latest dates) for the given endorsers (a queryset)."""
+    deleting_endorser_pks = get_deleting_endorser_pks()
+    if deleting_endorser_pks:
+        endorsers = endorsers.exclude(pk__in=deleting_endorser_pks)
+    for endorser in endorsers.distinct():
+        endorser.refresh_endorsement_fields()
+
+
+def refresh_card_for_pk(endorser_pk):
+    # The endorser may have just been deleted (e.g., during a cascade).
+    refresh_cards(Endorser.objects.filter(pk=endorser_pk))
+
+
+def flatten_keys(endorser_keys):
+    return [key for keys in endorser_keys.itervalues() for key in keys]
+
+
+def update_counters(old_endorser_keys, endorser_pks):
+    """Applies the difference between the counter keys the given endorsers
+    had before a change (as returned by get_endorser_keys) and now."""
+    new_endorser_keys = EndorserCounter.objects.get_endorser_keys(endorser_pks)
+    EndorserCounter.objects.apply_delta(
+        flatten_keys(old_endorser_keys), flatten_keys(new_endorser_keys)
+    )
+
+
+@receiver(pre_save, sender=Endorser)
+def endorser_saving(sender, instance, raw=False, **kwargs):
+    if not raw:
+        if instance.pk is None:
+            instance._old_counter_keys = {}
+        else:
+            instance._old_counter_keys = \
+                EndorserCounter.objects.get_endorser_keys([instance.pk])
+
+
+@receiver(post_save, sender=Endorser)
+def endorser_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_counters(instance._old_counter_keys, [instance.pk])
+        refresh_card_for_pk(instance.pk)
+        record_endorser_change(instance.pk)
+
+
+@receiver(pre_delete, sender=Endorser)
+def endorser_deleting(sender, instance, **kwargs):
+    instance._old_counter_keys = \
+        EndorserCounter.objects.get_endorser_keys([instance.pk])
+
+
+@receiver(post_delete, sender=Endorser)
+def endorser_deleted(sender, instance, **kwargs):
+    EndorserCounter.objects.apply_delta(
+        flatten_keys(instance._old_counter_keys), []
+    )
+    bump_data_version([instance.pk])
+    record_endorser_change(instance.pk)
+
+
+@receiver(post_save, sender=Endorsement)
+@receiver(post_delete, sender=Endorsement)
+def endorsement_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        endorsers = Endorser.objects.filter(pk=instance.endorser_id)
+        refresh_endorsement_fields(endorsers)
+        refresh_cards(endorsers)
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def account_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_card_for_pk(instance.endorser_id)
+        record_endorser_change(instance.endorser_id)
+
+
+@receiver(post_save, sender=Quote)
+def quote_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        # The quote's date may have changed.
+        endorsers = Endorser.objects.filter(endorsement__quote=instance)
+        refresh_endorsement_fields(endorsers)
+        refresh_cards(endorsers)
+
+
+@receiver(post_save, sender=Source)
+def source_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_cards(
+            Endorser.objects.filter(endorsement__quote__source=instance)
+        )
+
+
+@receiver(post_save, sender=Event)
+def event_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_cards(
+            Endorser.objects.filter(endorsement__quote__event=instance)
+        )
+
+
+@receiver(post_save, sender=Position)
+def position_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_versions('positions')
+        refresh_cards(Endorser.objects.filter(endorsement__position=instance))
+
+
+@receiver(post_delete, sender=Position)
+def position_deleted(sender, instance, **kwargs):
+    bump_versions('positions')
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_versions('tags')
+        refresh_cards(Endorser.objects.filter(tags=instance))
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleting(sender, instance, **kwargs):
+    # The tag links are gone by the time post_delete is sent.
+    instance._endorser_pks = list(
+        instance.endorser_set.values_list('pk', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    bump_versions('tags')
+    # Only the tag's own counters change.
+    tag_key = 'tag:%d' % instance.pk
+    EndorserCounter.objects.filter(
+        Q(key=tag_key) | Q(key__startswith=tag_key + ':')
+    ).delete()
+    refresh_cards(Endorser.objects.filter(pk__in=instance._endorser_pks))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_versions('tags')
+
+
+@receiver(post_save, sender=Candidate)
+def candidate_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_versions('positions')
+        refresh_card_for_pk(instance.endorser_link_id)
+
+
+@receiver(post_delete, sender=Candidate)
+def candidate_deleted(sender, instance, **kwargs):
+    bump_versions('positions')
+    refresh_card_for_pk(instance.endorser_link_id)
+
+
+@receiver(m2m_changed, sender=Endorser.tags.through)
+def endorser_tags_changed(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    if action.startswith('post_'):
+        bump_versions('tags')
+
+    if not reverse:
+        if action.startswith('pre_'):
+            instance._old_counter_keys = \
+                EndorserCounter.objects.get_endorser_keys([instance.pk])
+        else:
+            update_counters(instance._old_counter_keys, [instance.pk])
+            refresh_card_for_pk(instance.pk)
+        return
+
+    # Called from the tag's side (e.g., tag.endorser_set.add(...)).
+    if action == 'pre_clear':
+        instance._endorser_pks = list(
+            instance.endorser_set.values_list('pk', flat=True)
+        )
+    elif action.startswith('pre_'):
+        instance._endorser_pks = list(pk_set)
+
+    if action.startswith('pre_'):
+        instance._old_counter_keys = \
+            EndorserCounter.objects.get_endorser_keys(instance._endorser_pks)
+    else:
+        update_counters(instance._old_counter_keys, instance._endorser_pks)
+        refresh_cards(Endorser.objects.filter(pk__in=instance._endorser_pks))
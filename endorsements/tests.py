@@ -1,6 +1,53 @@
-from django.test import TestCase
+from datetime import date
+import gzip
+import io
+import json
+import random
 
+import numpy
+
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from election.backtest import generate_variants, get_backtest_data, \
+                              run_backtest, score_models
+from election.predictions import MODELS, CongressEndorsementModel, \
+                                 CongressFollowersModel, PredictionEngine
+from election.simulation import get_model_counts, simulate, \
+                                simulate_models
+from election.stats import PREDICTION_POSITIONS, PREDICTION_TAGS, \
+                           STATE_CATEGORY_PK, STATE_COUNT_TAGS, \
+                           get_prediction_stats, get_state_stats
+from election.utils import decode_cursor, encode_cursor
+from endorsements.caching import get_or_compute, \
+                                  get_stale_while_revalidate, \
+                                  make_versioned_key
+from election.views import get_endorsements_query, get_endorsers
+from endorsements.index import SORT_VALUES, EndorserIndex, \
+                               bitmap_to_array, get_endorser_index
+from endorsements.registry import get_registry
+from endorsements.models import Candidate, Category, Endorsement, Endorser, \
+                                EndorserCard, EndorserCounter, Position, \
+                                Quote, Source, Tag, deleting_endorsers, \
+                                get_deleting_endorser_pks
+from endorsements import timeline
+from endorsements.search import FullTextIndex, get_autocomplete_index, \
+                                 get_full_text_index, make_snippet
 from endorsements.templatetags.endorsement_extras import shorten
+from wikipedia.models import BulkImport, ElectoralVotes, \
+                             ImportedNewspaper, ImportedResult
+
+
+# A cache local to the test run, so that tests can't see or wipe what's in
+# the shared one (see CACHES in the settings).
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'endorsements-tests',
+    }
+}
 
 
 class TestShortenFilter(TestCase):
@@ -26,3 +73,1126 @@ class TestShortenFilter(TestCase):
                     actual_output
                 )
             )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestEndorserCard(TestCase):
+    def setUp(self):
+        self.endorser = Endorser.objects.create(
+            name='Test Endorser',
+            description='A' * 100,
+        )
+        self.position = Position.objects.create(
+            present_tense_prefix='Endorses',
+            past_tense_prefix='Endorsed',
+            suffix='Test Candidate',
+            slug='test',
+            colour='blue',
+        )
+
+    def get_card(self):
+        return EndorserCard.objects.get(endorser=self.endorser).get_data()
+
+    def test_created_with_endorser(self):
+        card = self.get_card()
+        self.assertEqual(card['n'], 'Test Endorser')
+        self.assertEqual(card['d'], 'A' * 80 + '...')
+        self.assertEqual(card['e'], [])
+
+    def test_refreshed_on_related_changes(self):
+        source = Source.objects.create(
+            url='http://example.com',
+            name='Example',
+            date=date(2016, 10, 1),
+        )
+        quote = Quote.objects.create(
+            source=source,
+            text='Vote for them',
+            date=date(2016, 10, 1),
+        )
+        Endorsement.objects.create(
+            endorser=self.endorser,
+            quote=quote,
+            position=self.position,
+        )
+        card = self.get_card()
+        self.assertEqual(len(card['e']), 1)
+        self.assertEqual(card['e'][0]['di'], 'Endorses Test Candidate')
+        self.assertEqual(card['e'][0]['sn'], 'Example')
+
+        source.name = 'Renamed'
+        source.save()
+        self.assertEqual(self.get_card()['e'][0]['sn'], 'Renamed')
+
+        tag = Tag.objects.create(name='Test tag')
+        self.endorser.tags.add(tag)
+        self.assertEqual(self.get_card()['t'], [['Test tag', tag.pk]])
+
+        tag.delete()
+        self.assertEqual(self.get_card()['t'], [])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestCursorPagination(TestCase):
+    def setUp(self):
+        position = Position.objects.create(suffix='Test', slug='test')
+        source = Source.objects.create(url='http://example.com')
+        for i in range(30):
+            endorser = Endorser.objects.create(
+                name='Endorser %d' % (i % 7),
+                max_followers=i % 4,
+            )
+            if i % 3:
+                quote = Quote.objects.create(
+                    source=source,
+                    date=date(2016, 10, i % 5 + 1),
+                )
+                Endorsement.objects.create(
+                    endorser=endorser,
+                    quote=quote,
+                    position=position,
+                )
+
+    def runTest(self):
+        for sort_value in SORT_VALUES:
+            endorser_pks = []
+            cursor = None
+            while True:
+                results = get_endorsers({}, {'value': sort_value}, cursor)
+                endorser_pks.extend(e['p'] for e in results['endorsers'])
+                if not results['next']:
+                    break
+
+                version, sort, key, pk = decode_cursor(results['next'])
+                self.assertEqual(sort, sort_value)
+                cursor = {'key': key, 'pk': pk}
+
+            self.assertEqual(len(endorser_pks), 30, sort_value)
+            self.assertEqual(len(set(endorser_pks)), 30, sort_value)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestEndorserIndex(TestCase):
+    def setUp(self):
+        self.tags = [Tag.objects.create(name='Tag %d' % i) for i in range(3)]
+        self.endorsers = []
+        for i in range(8):
+            endorser = Endorser.objects.create(
+                name='Endorser %d' % i,
+                max_followers=i,
+                is_personal=i % 2 == 0,
+            )
+            # Endorser i gets tag j if bit j of i is set.
+            for j, tag in enumerate(self.tags):
+                if i >> j & 1:
+                    endorser.tags.add(tag)
+            self.endorsers.append(endorser)
+
+    def get_names(self, **kwargs):
+        index = EndorserIndex()
+        bitmap = index.filter(**kwargs)
+        endorser_pks, _ = index.get_page(bitmap, 'least', 100)
+        return [int(Endorser.objects.get(pk=pk).name[-1]) for pk in endorser_pks]
+
+    def runTest(self):
+        tag_pks = [tag.pk for tag in self.tags]
+        self.assertEqual(self.get_names(), range(8))
+        self.assertEqual(self.get_names(is_personal=True), [0, 2, 4, 6])
+        self.assertEqual(self.get_names(tags=tag_pks[:2]), [3, 7])
+        self.assertEqual(self.get_names(any_tags=tag_pks[1:]),
+                         [2, 3, 4, 5, 6, 7])
+        self.assertEqual(self.get_names(hide_tags=tag_pks[:2]), [0, 4])
+        self.assertEqual(
+            self.get_names(tags=[tag_pks[2]], hide_tags=[tag_pks[0]],
+                           is_personal=True),
+            [4, 6]
+        )
+
+        index = EndorserIndex()
+        facets = index.get_facets(
+            index.filter(is_personal=False), index.tags
+        )
+        self.assertEqual(facets, {tag_pks[0]: 4, tag_pks[1]: 2,
+                                  tag_pks[2]: 2})
+
+        # Applying changes should give the same pages as rebuilding.
+        self.endorsers[3].max_followers = 100
+        self.endorsers[3].save()
+        self.endorsers[3].tags.remove(self.tags[0])
+        deleted_pk = self.endorsers[5].pk
+        self.endorsers[5].delete()
+        new_endorser = Endorser.objects.create(
+            name='Endorser 8', max_followers=-1
+        )
+        new_endorser.tags.add(self.tags[0])
+        changed_pks = [self.endorsers[3].pk, deleted_pk, new_endorser.pk]
+        updated_index = index.apply_changes(changed_pks, 1)
+        rebuilt_index = EndorserIndex()
+        for sort_value in SORT_VALUES:
+            for kwargs in [{}, {'tags': [tag_pks[0]]}, {'is_personal': True}]:
+                updated_page = updated_index.get_page(
+                    updated_index.filter(**kwargs), sort_value, 3
+                )
+                rebuilt_page = rebuilt_index.get_page(
+                    rebuilt_index.filter(**kwargs), sort_value, 3
+                )
+                self.assertEqual(updated_page, rebuilt_page, sort_value)
+        # The original index is left as it was.
+        self.assertIn(deleted_pk, index.rows)
+        self.assertEqual(index.count(index.all), 8)
+        self.assertEqual(updated_index.count(updated_index.all), 8)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestEndorsementFields(TestCase):
+    def runTest(self):
+        endorser = Endorser.objects.create(name='Test Endorser')
+        position = Position.objects.create(suffix='Test', slug='test')
+        source = Source.objects.create(url='http://example.com')
+        quotes = [
+            Quote.objects.create(source=source, date=date(2016, 10, i))
+            for i in (5, 1)
+        ]
+        endorsements = [
+            Endorsement.objects.create(
+                endorser=endorser,
+                quote=quote,
+                position=position,
+            )
+            for quote in quotes
+        ]
+
+        endorser = Endorser.objects.get(pk=endorser.pk)
+        self.assertEqual(endorser.current_endorsement, endorsements[0])
+        self.assertEqual(endorser.current_position, position)
+        self.assertEqual(endorser.first_endorsement_date, date(2016, 10, 1))
+        self.assertEqual(endorser.latest_endorsement_date, date(2016, 10, 5))
+
+        quotes[1].date = date(2016, 10, 9)
+        quotes[1].save()
+        endorser = Endorser.objects.get(pk=endorser.pk)
+        self.assertEqual(endorser.current_endorsement, endorsements[1])
+        self.assertEqual(endorser.first_endorsement_date, date(2016, 10, 5))
+        self.assertEqual(endorser.latest_endorsement_date, date(2016, 10, 9))
+
+        endorsements[1].delete()
+        endorser = Endorser.objects.get(pk=endorser.pk)
+        self.assertEqual(endorser.current_endorsement, endorsements[0])
+        self.assertEqual(endorser.latest_endorsement_date, date(2016, 10, 5))
+
+        endorser.delete()
+        self.assertFalse(EndorserCard.objects.exists())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestEndorserCounters(TestCase):
+    def assertCountsMatchRebuild(self):
+        counts = dict(EndorserCounter.objects.values_list('key', 'count'))
+        counts = dict((key, count) for key, count in counts.items() if count)
+        EndorserCounter.objects.rebuild()
+        rebuilt = dict(EndorserCounter.objects.values_list('key', 'count'))
+        self.assertEqual(counts, rebuilt)
+
+    def runTest(self):
+        position = Position.objects.create(suffix='Test', slug='test')
+        source = Source.objects.create(url='http://example.com')
+        quote = Quote.objects.create(source=source, date=date(2016, 10, 1))
+        tags = [Tag.objects.create(name='Tag %d' % i) for i in range(2)]
+
+        endorser = Endorser.objects.create(name='Test', is_personal=True)
+        other = Endorser.objects.create(name='Other', is_personal=False)
+        Endorsement.objects.create(
+            endorser=endorser, quote=quote, position=position
+        )
+        endorser.tags.add(tags[0], tags[1])
+        tags[1].endorser_set.add(other)
+        self.assertCountsMatchRebuild()
+
+        counts = EndorserCounter.objects.get_counts([
+            'all', 'position:%d' % position.pk,
+            'tag:%d:position:%d' % (tags[0].pk, position.pk),
+            'tag:%d' % tags[1].pk,
+        ])
+        self.assertEqual(counts['all'], 2)
+        self.assertEqual(counts['position:%d' % position.pk], 1)
+        self.assertEqual(
+            counts['tag:%d:position:%d' % (tags[0].pk, position.pk)], 1
+        )
+        self.assertEqual(counts['tag:%d' % tags[1].pk], 2)
+
+        endorser.is_personal = False
+        endorser.save()
+        endorser.tags.remove(tags[0])
+        tags[1].endorser_set.clear()
+        self.assertCountsMatchRebuild()
+
+        tags[0].delete()
+        endorser.delete()
+        self.assertCountsMatchRebuild()
+
+        # Deleting through a queryset works the same way, and nothing is
+        # left marked as being deleted afterwards (even if a delete fails).
+        Endorser.objects.filter(pk=other.pk).delete()
+        self.assertCountsMatchRebuild()
+        with self.assertRaises(ValueError):
+            with deleting_endorsers([endorser.pk]):
+                raise ValueError
+        self.assertEqual(get_deleting_endorser_pks(), frozenset())
+
+        # A counter created by someone else in the meantime is added to.
+        EndorserCounter.objects.create_or_add('all', 2)
+        EndorserCounter.objects.create_or_add('new', 3)
+        counts = EndorserCounter.objects.get_counts(['all', 'new'])
+        self.assertEqual(counts, {'all': 2, 'new': 3})
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestAutocompleteIndex(TransactionTestCase):
+    def runTest(self):
+        names = [
+            ('Ann Arbor News', 10),
+            ('Sandra Annis', 500),
+            (u'Jos\xe9 Ann\xe9e', 50),
+            ('Bob', 1000),
+        ]
+        endorsers = [
+            Endorser.objects.create(name=name, max_followers=followers)
+            for name, followers in names
+        ]
+
+        def search(query):
+            return [pk for pk, name in get_autocomplete_index().search(query)]
+
+        # Prefixes first, then substrings, each by followers.
+        self.assertEqual(
+            search('ann'),
+            [endorsers[0].pk, endorsers[1].pk, endorsers[2].pk]
+        )
+        self.assertEqual(search('jose anne'), [endorsers[2].pk])
+        self.assertEqual(search('sa'), [endorsers[1].pk])
+        # Queries too short for n-grams still match anywhere in a name.
+        self.assertEqual(search('nn'), [endorsers[1].pk, endorsers[2].pk,
+                                        endorsers[0].pk])
+        self.assertEqual(search('ob'), [endorsers[3].pk])
+        self.assertEqual(search('xyz'), [])
+
+        old_index = get_autocomplete_index()
+        endorsers[3].name = 'Bob Annenberg'
+        endorsers[3].save()
+        self.assertEqual(search('ann')[1], endorsers[3].pk)
+
+        deleted_pk = endorsers[1].pk
+        endorsers[1].delete()
+        self.assertNotIn(deleted_pk, search('ann'))
+
+        # Changes go into a new index, leaving the old one as it was for
+        # any searches still using it.
+        self.assertEqual(
+            [pk for pk, name in old_index.search('ann')],
+            [endorsers[0].pk, deleted_pk, endorsers[2].pk]
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestFullTextSearch(TestCase):
+    def setUp(self):
+        # Don't pick up pages cached by an earlier test.
+        cache.clear()
+
+    def get_matches(self, index, query):
+        terms, results, best_documents = index.search(query)
+        return [
+            (round(score, 6), pk,
+             index.get_snippet(best_documents[pk], terms))
+            for score, pk in results
+        ]
+
+    def runTest(self):
+        position = Position.objects.create(suffix='Test', slug='test')
+        source = Source.objects.create(url='http://example.com')
+        endorsers = []
+        for i, (text, description) in enumerate([
+            ('Her plan for trade is the best plan.', ''),
+            ('We support her plan.', 'A union for trade workers'),
+            ('Nothing relevant here.', 'Trade association'),
+        ]):
+            endorser = Endorser.objects.create(
+                name='Endorser %d' % i,
+                description=description,
+                is_personal=i != 1,
+            )
+            quote = Quote.objects.create(source=source, text=text)
+            Endorsement.objects.create(
+                endorser=endorser, quote=quote, position=position
+            )
+            endorsers.append(endorser)
+
+        url = reverse('search_full_text')
+        response = self.client.get(url, {'q': 'trade plan'}).json()
+        self.assertEqual(response['count'], 2)
+        self.assertEqual(
+            [result['endorser']['p'] for result in response['results']],
+            [endorsers[0].pk, endorsers[1].pk]
+        )
+        self.assertIn(
+            '<mark>plan</mark>', response['results'][0]['snippet']['html']
+        )
+        self.assertIsNone(response['next'])
+
+        response = self.client.get(
+            url, {'q': 'trade plan', 'mode': 'organization'}
+        ).json()
+        self.assertEqual(
+            [result['endorser']['p'] for result in response['results']],
+            [endorsers[1].pk]
+        )
+
+        response = self.client.get(url, {'q': 'the'}).json()
+        self.assertEqual(response['count'], 0)
+
+        # Cursors from another version of the index are turned away.
+        version = get_full_text_index().version
+        response = self.client.get(url, {
+            'q': 'trade plan',
+            'cursor': encode_cursor(version - 1, 'relevance', -1.0, 1),
+        }).json()
+        self.assertTrue(response['error'])
+
+        # Applying changes should give the same results as rebuilding.
+        index = FullTextIndex(version)
+        endorsers[0].description = 'Trade plan'
+        endorsers[0].save()
+        Endorsement.objects.filter(endorser=endorsers[1]).delete()
+        changed_pks = [endorsers[0].pk, endorsers[1].pk]
+        updated_index = index.apply_changes(changed_pks, version + 1)
+        rebuilt_index = FullTextIndex(version + 1)
+        for query in ['trade plan', 'plan', 'trade', 'relevant']:
+            self.assertEqual(self.get_matches(updated_index, query),
+                             self.get_matches(rebuilt_index, query), query)
+        self.assertEqual(updated_index.search('support')[1], [])
+        self.assertNotEqual(index.search('support')[1], [])
+
+        self.assertEqual(
+            make_snippet(u'A <b> and trade', set(['trade'])),
+            u'A &lt;b&gt; and <mark>trade</mark>'
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestCachedJsonResponse(TransactionTestCase):
+    def setUp(self):
+        # Don't pick up pages cached by an earlier test.
+        cache.clear()
+
+    def runTest(self):
+        category = Category.objects.create(name='Test category')
+        Tag.objects.create(name='Test tag', category=category)
+        url = reverse('get_tags')
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        etag = response['ETag']
+        self.assertEqual(
+            json.loads(gzip.GzipFile(
+                fileobj=io.BytesIO(response.content)
+            ).read())['org'],
+            self.client.get(url).json()['org']
+        )
+
+        response = self.client.get(
+            url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # A new tag means a new ETag (and an uncompressed response here).
+        Tag.objects.create(name='Another tag', category=category)
+        response = self.client.get(url + '?v=2', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestEndorsementsGetApi(TestCase):
+    def setUp(self):
+        # Don't pick up pages cached by an earlier test.
+        cache.clear()
+
+    def runTest(self):
+        for i in range(15):
+            Endorser.objects.create(name='Endorser %d' % i, max_followers=i)
+
+        url = reverse('get-endorsements')
+        response = self.client.get(url + '?sort=most&tags=3,1,x,1&mode=none')
+        self.assertEqual(response.status_code, 301)
+        self.assertTrue(response['Location'].endswith(url + '?tags=1%2C3'))
+
+        response = self.client.get(url + '?sort=az')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+        data = response.json()
+        self.assertEqual(len(data['endorsers']), 12)
+
+        response = self.client.get(data['next_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['endorsers']), 3)
+        self.assertIsNone(response.json()['next_url'])
+
+        # Cursors from before a data change are turned away.
+        version, sort_value, key, pk = decode_cursor(data['next'])
+        query = get_endorsements_query(
+            {}, sort_value, encode_cursor(version - 1, sort_value, key, pk)
+        )
+        response = self.client.get(url + '?' + query)
+        self.assertTrue(response.json()['error'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestVersionedKeys(TransactionTestCase):
+    def runTest(self):
+        tags_key = make_versioned_key('test', ('tags',))
+        positions_key = make_versioned_key('test', ('positions',))
+
+        Tag.objects.create(name='Test tag')
+        self.assertNotEqual(make_versioned_key('test', ('tags',)), tags_key)
+        self.assertEqual(
+            make_versioned_key('test', ('positions',)), positions_key
+        )
+
+        Position.objects.create(suffix='Test', slug='test')
+        self.assertNotEqual(
+            make_versioned_key('test', ('positions',)), positions_key
+        )
+
+        # Versions are only bumped once the write is committed.
+        tags_key = make_versioned_key('test', ('tags',))
+        with transaction.atomic():
+            Tag.objects.create(name='Another tag')
+            self.assertEqual(make_versioned_key('test', ('tags',)), tags_key)
+        self.assertNotEqual(make_versioned_key('test', ('tags',)), tags_key)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestGetOrCompute(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def runTest(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(get_or_compute('test_1', compute, 60, 'test'), 1)
+        self.assertEqual(get_or_compute('test_1', compute, 60, 'test'), 1)
+        self.assertEqual(len(calls), 1)
+
+        # While another process holds the lock for a new version, the stale
+        # value is used instead of recomputing it.
+        cache.add('test_2_lock', 1)
+        self.assertEqual(get_or_compute('test_2', compute, 60, 'test'), 1)
+        self.assertEqual(len(calls), 1)
+
+        cache.delete('test_2_lock')
+        self.assertEqual(get_or_compute('test_2', compute, 60, 'test'), 2)
+        self.assertEqual(get_or_compute('test_3', compute, 60, 'test'), 3)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestRegistry(TransactionTestCase):
+    def runTest(self):
+        category = Category.objects.create(name='Test category')
+        tag = Tag.objects.create(name='Test tag', category=category)
+        position = Position.objects.create(suffix='Test', slug='test')
+
+        registry = get_registry()
+        with self.assertNumQueries(0):
+            registry = get_registry()
+            self.assertEqual(registry.get_tag('Test tag'), tag)
+            self.assertEqual(registry.get_tag('Test tag').category, category)
+            self.assertEqual(registry.get_position('test'), position)
+            self.assertEqual(
+                registry.get_category_tag_pks('Test category'), set([tag.pk])
+            )
+        self.assertRaises(Tag.DoesNotExist, registry.get_tag, 'Missing')
+
+        tag.name = 'Renamed tag'
+        tag.save()
+        self.assertEqual(get_registry().get_tag('Renamed tag'), tag)
+
+
+@override_settings(CACHES=TEST_CACHES, REFRESH_IN_BACKGROUND=False)
+class TestStatsTags(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def runTest(self):
+        position = Position.objects.create(suffix='Test', slug='test')
+        other_position = Position.objects.create(suffix='Other', slug='other')
+        Candidate.objects.create(
+            endorser_link=Endorser.objects.create(name='Candidate'),
+            name='Candidate',
+            description='',
+            color='000000',
+            rgb='0,0,0',
+            still_running=True,
+            position=position,
+        )
+        tags = {}
+        for name in ('Gender', 'Race/ethnicity', 'Organizations'):
+            category = Category.objects.create(name=name)
+            tags[name] = Tag.objects.create(name=name + ' tag',
+                                            category=category)
+
+        source = Source.objects.create(url='http://example.com')
+        quote = Quote.objects.create(source=source)
+        for endorser_position, tag_names in (
+            (position, ['Gender']),
+            (position, []),
+            (other_position, ['Gender', 'Race/ethnicity']),
+        ):
+            endorser = Endorser.objects.create(name='Test', is_personal=True)
+            Endorsement.objects.create(
+                endorser=endorser, quote=quote, position=endorser_position
+            )
+            endorser.tags.add(*[tags[name] for name in tag_names])
+
+        response = self.client.get(reverse('stats-tags'))
+        categories = dict(
+            (category['name'], category)
+            for category in response.context['categories']
+        )
+        gender = categories['Gender']
+        self.assertEqual(gender['num_tagged'], 2)
+        self.assertEqual(
+            [column['num_tagged'] for column in gender['candidates']], [1, 1]
+        )
+        self.assertEqual(gender['candidates'][0]['percent_reporting'], 50.0)
+        # The Other column counts endorsers of every other position.
+        tag_columns = gender['tags'][0]['candidates']
+        self.assertEqual(
+            [column['num_tagged'] for column in tag_columns], [1, 1]
+        )
+        self.assertEqual(categories['Organizations']['num_tagged'], 0)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestStateStats(TestCase):
+    def runTest(self):
+        self.assertEqual(
+            list(bitmap_to_array(0b10110, 6)),
+            [False, True, True, False, True, False]
+        )
+
+        states = Category.objects.create(pk=STATE_CATEGORY_PK, name='States')
+        state_tags = [
+            Tag.objects.create(name=name, category=states)
+            for name in ('Alaska', 'Maine', 'Texas')
+        ]
+        tags = dict(
+            (name, Tag.objects.create(name=name))
+            for name in STATE_COUNT_TAGS.values() if name
+        )
+        positions = [
+            Position.objects.create(suffix=slug, slug=slug)
+            for slug in ('first', 'second', 'other')
+        ]
+        candidates = [
+            Candidate.objects.create(
+                endorser_link=Endorser.objects.create(name=slug),
+                name=slug,
+                description='',
+                color='000000',
+                rgb='0,0,0',
+                still_running=True,
+                position=position,
+            )
+            for slug, position in zip(('first', 'second'), positions)
+        ]
+
+        bulk_import = BulkImport.objects.create(slug='results', text='')
+        for state_tag in state_tags[:2]:
+            for i, candidate in enumerate(candidates):
+                ImportedResult.objects.create(
+                    bulk_import=bulk_import,
+                    tag=state_tag,
+                    candidate=candidate,
+                    count=100 + i,
+                    percent=50,
+                )
+
+        source = Source.objects.create(url='http://example.com')
+        quote = Quote.objects.create(source=source)
+        for position, tag_names in (
+            (positions[0], ['Alaska', 'Publication']),
+            (positions[0], ['Alaska', 'Politician', 'Republican Party']),
+            (positions[1], ['Alaska', 'Politician']),
+            (positions[1], ['Maine', 'Texas']),
+            (positions[2], ['Alaska']),
+        ):
+            endorser = Endorser.objects.create(name='Test')
+            Endorsement.objects.create(
+                endorser=endorser, quote=quote, position=position
+            )
+            endorser.tags.add(*[
+                tags.get(name) or Tag.objects.get(name=name)
+                for name in tag_names
+            ])
+
+        stats = get_state_stats(candidates)
+        self.assertEqual(
+            [state['name'] for state in stats['states']], ['Alaska', 'Maine']
+        )
+
+        alaska = stats['states'][0]
+        first_counts = dict(
+            (key, value)
+            for key, value, tag in alaska['candidates'][0]['counts']
+        )
+        self.assertEqual(first_counts['endorsements'], 2)
+        self.assertEqual(first_counts['newspapers'], 1)
+        self.assertEqual(first_counts['Republicans'], 1)
+        self.assertEqual(alaska['counts'][0][1], 4)
+        self.assertEqual(alaska['num_other_positions'], 1)
+        self.assertEqual(alaska['other_positions'][0]['slug'], 'other')
+        self.assertTrue(alaska['candidates'][1]['won'])
+
+        candidate, totals, maximums = stats['candidate_counts'][1]
+        self.assertEqual(totals['endorsements'], 2)
+        self.assertEqual(totals['votes'], 202)
+        self.assertEqual(maximums['endorsements'], 1)
+
+
+@override_settings(CACHES=TEST_CACHES, REFRESH_IN_BACKGROUND=False)
+class TestStaleWhileRevalidate(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def runTest(self):
+        def get():
+            return get_stale_while_revalidate(
+                'test', ('tags',), lambda: Tag.objects.count(), 60
+            )
+
+        self.assertEqual(get(), 0)
+        Tag.objects.create(name='Test tag')
+        # The stale value is served while it's refreshed (which happens
+        # right away here, instead of in a thread).
+        self.assertEqual(get(), 0)
+        self.assertEqual(get(), 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestPredictionEngine(TestCase):
+    def runTest(self):
+        random.seed(0)
+        num_endorsers = 200
+        keys = [
+            'clinton', 'trump', 'senate', 'house', 'republican', 'democrat',
+            'newspaper',
+        ]
+        endorser_pks = dict(
+            (key, set(random.sample(xrange(num_endorsers), 20)))
+            for key in keys
+        )
+        states = [
+            set(random.sample(xrange(num_endorsers), random.randint(0, 50)))
+            for i in range(40)
+        ]
+
+        def to_array(pks):
+            return numpy.array(
+                [i in pks for i in xrange(num_endorsers)], dtype=bool
+            )
+
+        endorser_weights = dict(
+            (name, [random.randint(0, 1000) for i in xrange(num_endorsers)])
+            for name in ('followers', 'circulation')
+        )
+
+        engine = PredictionEngine(
+            numpy.vstack([to_array(state_pks) for state_pks in states]),
+            dict((key, to_array(pks)) for key, pks in endorser_pks.items()),
+            dict(
+                (name, numpy.array(weights))
+                for name, weights in endorser_weights.items()
+            )
+        )
+        for category_models in MODELS.values():
+            for model in category_models:
+                counts = engine.apply(model)
+                for s, state_pks in enumerate(states):
+                    if getattr(model, 'weight', None):
+                        expected = model.apply_model(
+                            state_pks,
+                            endorser_pks,
+                            dict(
+                                (name, dict(enumerate(weights)))
+                                for name, weights in endorser_weights.items()
+                            )
+                        )
+                    else:
+                        expected = model.apply_model(state_pks, endorser_pks)
+                    self.assertEqual(
+                        (counts['clinton'][s], counts['trump'][s]),
+                        (expected['clinton'], expected['trump']),
+                        model.name
+                    )
+
+
+class PredictionDataMixin(object):
+    def create_prediction_data(self):
+        """Creates three states with results and electoral votes, plus an
+        endorser for each (position, tags) below."""
+        self.positions = {}
+        for pk, slug in enumerate(PREDICTION_POSITIONS, 1):
+            self.positions[slug] = Position.objects.create(
+                pk=pk, suffix=slug, slug=slug
+            )
+        # Results are stored by candidate, with the same pks as positions.
+        for slug in ('clinton', 'trump'):
+            position = self.positions[slug]
+            Candidate.objects.create(
+                pk=position.pk,
+                endorser_link=Endorser.objects.create(name=slug),
+                name=slug,
+                description='',
+                color='000000',
+                rgb='0,0,0',
+                position=position,
+            )
+        self.tags = dict(
+            (key, Tag.objects.create(name=name))
+            for key, name in PREDICTION_TAGS.iteritems()
+        )
+
+        states = Category.objects.create(pk=STATE_CATEGORY_PK, name='States')
+        bulk_import = BulkImport.objects.create(slug='results', text='')
+        self.states = {}
+        for name, clinton, trump, votes in (
+            ('Alaska', 40, 55, 3),
+            ('Maine', 50, 45, 4),
+            ('Texas', 45, 50, 38),
+        ):
+            state = Tag.objects.create(name=name, category=states)
+            self.states[name] = state
+            ElectoralVotes.objects.create(state=state, count=votes)
+            for slug, percent in (('clinton', clinton), ('trump', trump)):
+                ImportedResult.objects.create(
+                    bulk_import=bulk_import,
+                    tag=state,
+                    candidate_id=self.positions[slug].pk,
+                    percent=percent,
+                )
+
+        source = Source.objects.create(url='http://example.com')
+        quote = Quote.objects.create(source=source, date=date(2016, 8, 1))
+        newspapers = BulkImport.objects.create(slug='newspapers', text='')
+        for slug, tag_keys, followers, circulation in (
+            ('trump', ['Alaska', 'senate', 'republican'], 1000, None),
+            ('trump', ['Alaska', 'house', 'republican'], 500, None),
+            ('clinton', ['Maine', 'senate', 'democrat'], 2000, None),
+            ('clinton', ['Maine', 'newspaper'], 0, 100000),
+            ('trump', ['Texas', 'newspaper'], 0, 200000),
+            ('pence', ['Texas', 'house', 'republican'], 3000, None),
+        ):
+            endorser = Endorser.objects.create(
+                name='Test', max_followers=followers
+            )
+            if circulation:
+                ImportedNewspaper.objects.create(
+                    bulk_import=newspapers,
+                    confirmed_endorser=endorser,
+                    section=3,
+                    name='Test',
+                    endorsement_2016=slug,
+                    circulation=circulation,
+                )
+            Endorsement.objects.create(
+                endorser=endorser, quote=quote, position=self.positions[slug]
+            )
+            endorser.tags.add(*[
+                self.tags.get(key) or self.states[key] for key in tag_keys
+            ])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestPredictionStats(PredictionDataMixin, TransactionTestCase):
+    def runTest(self):
+        self.create_prediction_data()
+        stats = get_prediction_stats()
+
+        categories = dict(
+            (category['name'], category) for category in stats['categories']
+        )
+        by_endorsements = categories['Congress - by endorsements']
+        self.assertEqual(
+            [state['name'] for state in by_endorsements['states']],
+            ['Alaska', 'Maine', 'Texas']
+        )
+        # Senate, House and Congress (endorsements) for Alaska.
+        alaska = by_endorsements['states'][0]
+        self.assertEqual(
+            [model['winner'] for model in alaska['models']],
+            ['trump', 'trump', 'trump']
+        )
+        self.assertEqual(alaska['models'][2]['trump'], 2)
+        congress = by_endorsements['models'][2]
+        self.assertEqual(congress['num_correct_candidate'], 2)
+        self.assertEqual(congress['clinton_electoral_votes'], 4)
+        self.assertEqual(congress['trump_electoral_votes'], 3)
+
+        newspapers = categories['Newspaper endorsements']
+        # Trump gets every state without a Clinton newspaper endorsement.
+        self.assertEqual(newspapers['models'][1]['trump_electoral_votes'], 41)
+
+        weighted = categories['Weighted endorsements']
+        followers = weighted['states'][0]['models'][0]
+        self.assertEqual((followers['clinton'], followers['trump']),
+                         (0, 1500))
+        circulation = weighted['states'][2]['models'][1]
+        self.assertEqual((circulation['clinton'], circulation['trump']),
+                         (0, 200000))
+        self.assertEqual(circulation['basic'], '')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestBacktest(PredictionDataMixin, TransactionTestCase):
+    def runTest(self):
+        self.create_prediction_data()
+        data = get_backtest_data()
+        self.assertEqual(data.state_names, ['Alaska', 'Maine', 'Texas'])
+
+        page_scores = dict(
+            (model['name'], model)
+            for category in get_prediction_stats()['categories']
+            for model in category['models']
+        )
+        for score in score_models(data):
+            page_score = page_scores[score['name']]
+            for key in ('num_correct_candidate', 'num_correct_size',
+                        'clinton_electoral_votes', 'trump_electoral_votes'):
+                self.assertEqual(score[key], page_score[key])
+
+        variants = list(generate_variants(
+            thresholds=[1], max_keys=2, weights=[1, 2]
+        ))
+        # 15 key sets, 3 sets of candidate keys, 14 or 15 tie-breaks, and
+        # 2 extra weightings for pairs of keys.
+        self.assertEqual(len(variants), 5 * 3 * 15 + 10 * 3 * 3 * 15)
+
+        scores = run_backtest(data, variants, processes=1)
+        self.assertEqual(len(scores), len(variants))
+        self.assertEqual(scores[0]['num_correct_candidate'], 3)
+        self.assertEqual(scores[0]['electoral_vote_error'], 0)
+        self.assertEqual(
+            [score['name'] for score in run_backtest(data, variants, 2)],
+            [score['name'] for score in scores]
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestSimulation(PredictionDataMixin, TransactionTestCase):
+    def runTest(self):
+        histograms, tipping_points, tipping_trials = simulate(
+            [[1.0, 1.0, 0.0], [0.5, 0.5, 0.5]], [200, 100, 238],
+            trials=1000, seed=0
+        )
+        self.assertEqual(histograms[0][300], 1000)
+        # Either of Clinton's states can be the one that takes her over 270.
+        self.assertEqual(tipping_points[0][2], 0)
+        self.assertEqual(tipping_points[0].sum(), tipping_trials)
+        self.assertEqual(histograms[1].sum(), 1000)
+        self.assertEqual(
+            sorted(numpy.nonzero(histograms[1])[0]),
+            [0, 100, 200, 238, 300, 338, 438, 538]
+        )
+
+        self.create_prediction_data()
+        data = get_backtest_data()
+        # Weighted counts are scaled to the number of endorsers, so one
+        # endorser with 2000 followers counts as one endorsement.
+        engine = data.get_engine()
+        counts = engine.apply(CongressEndorsementModel)
+        weighted_counts = get_model_counts(engine, CongressFollowersModel)
+        self.assertEqual(weighted_counts[0].tolist(),
+                         counts['clinton'].tolist())
+        self.assertEqual(weighted_counts[1].tolist(), counts['trump'].tolist())
+
+        summaries = simulate_models(data, trials=1000, seed=0)
+        self.assertEqual(
+            [summary['name'] for summary in summaries],
+            [model.name for models in MODELS.values() for model in models]
+        )
+        for summary in summaries:
+            self.assertEqual(summary['trials'], 1000)
+            low, high = summary['clinton_interval']
+            self.assertTrue(0 <= low <= summary['clinton_median'] <= high)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestTimeline(PredictionDataMixin, TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def runTest(self):
+        self.create_prediction_data()
+        source = Source.objects.create(url='http://example.com/2')
+        # A Maine senator who went from Trump to Clinton.
+        endorser = Endorser.objects.create(name='Switcher')
+        endorser.tags.add(self.states['Maine'], self.tags['senate'])
+        for day, slug in ((date(2016, 6, 1), 'trump'),
+                          (date(2016, 9, 1), 'clinton')):
+            Endorsement.objects.create(
+                endorser=endorser,
+                quote=Quote.objects.create(source=source, date=day),
+                position=self.positions[slug],
+            )
+
+        index = get_endorser_index()
+        row = index.rows[endorser.pk]
+        dates = [date(2016, 5, 1), date(2016, 6, 1), date(2016, 8, 1),
+                 date(2016, 12, 1)]
+        expected = [
+            0,
+            self.positions['trump'].pk,
+            self.positions['trump'].pk,
+            self.positions['clinton'].pk,
+        ]
+
+        checkpoint_interval = timeline.CHECKPOINT_INTERVAL
+        for interval in (2, checkpoint_interval):
+            timeline.CHECKPOINT_INTERVAL = interval
+            try:
+                endorsement_timeline = timeline.EndorsementTimeline(index)
+                swept = [
+                    positions.copy() for day, positions
+                    in endorsement_timeline.iter_positions(dates)
+                ]
+                for i, day in enumerate(dates):
+                    positions = endorsement_timeline.get_positions(day)
+                    self.assertEqual(positions[row], expected[i])
+                    self.assertEqual(list(positions), list(swept[i]))
+            finally:
+                timeline.CHECKPOINT_INTERVAL = checkpoint_interval
+
+        def get_maine(stats):
+            category = stats['categories'][1]
+            self.assertEqual(category['name'], 'Congress - by endorsements')
+            return category['states'][1]['models'][0]
+
+        senate = get_maine(get_prediction_stats(date(2016, 6, 1)))
+        self.assertEqual((senate['clinton'], senate['trump']), (0, 1))
+        senate = get_maine(get_prediction_stats(date(2016, 8, 1)))
+        self.assertEqual((senate['clinton'], senate['trump']), (1, 1))
+        senate = get_maine(get_prediction_stats())
+        self.assertEqual((senate['clinton'], senate['trump']), (2, 0))
+
+        Tag.objects.create(name='Politician')
+        stats = get_state_stats(as_of=date(2016, 7, 1))
+        self.assertEqual(stats['as_of'], date(2016, 7, 1))
+        maine_counts = dict(
+            (key, count) for key, count, tag in stats['states'][1]['counts']
+        )
+        self.assertEqual(maine_counts['endorsements'], 1)
+
+        response = self.client.get(
+            reverse('get_prediction_series'),
+            {'start': '2016-05-31', 'end': '2016-09-01'}
+        )
+        series = json.loads(response.content)['series']
+        self.assertEqual(len(series), 94)
+        self.assertEqual(series[0]['date'], '2016-05-31')
+        senate = dict(
+            (point['date'], point['models'][3]) for point in series
+        )
+        self.assertEqual(senate['2016-05-31']['trump_electoral_votes'], 0)
+        self.assertEqual(senate['2016-06-01']['trump_electoral_votes'], 4)
+        self.assertEqual(senate['2016-09-01']['clinton_electoral_votes'], 4)
+        self.assertEqual(senate['2016-09-01']['trump_electoral_votes'], 3)
+
+        response = self.client.get(
+            reverse('stats-predictions'), {'date': '2016-06-01'}
+        )
+        self.assertContains(response, 'on or before Jun 1, 2016')
+        response = self.client.get(
+            reverse('stats-predictions'), {'date': 'yesterday'}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestWhatIf(PredictionDataMixin, TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def post(self, data):
+        response = self.client.post(
+            reverse('what_if'),
+            json.dumps(data),
+            content_type='application/json'
+        )
+        return json.loads(response.content)
+
+    def runTest(self):
+        self.create_prediction_data()
+
+        # The same as CongressEndorsementModel.
+        results = self.post({'model': {
+            'keys': ['senate', 'house'],
+            'clinton_keys': ['clinton'],
+            'trump_keys': ['trump'],
+        }})
+        self.assertEqual(
+            [state['prediction']['winner'] for state in results['states']],
+            ['trump', 'clinton', None]
+        )
+        self.assertEqual(results['summary']['num_correct_candidate'], 2)
+
+        # Count Pence supporters as Trump's, with House members counting
+        # double.
+        results = self.post({'model': {
+            'keys': ['senate', 'house'],
+            'clinton_keys': ['clinton'],
+            'trump_keys': ['trump', 'pence'],
+            'weights': {'house': 2},
+        }})
+        texas = results['states'][2]
+        self.assertEqual(texas['prediction']['trump'], 2)
+        self.assertTrue(texas['correct_candidate'])
+        self.assertEqual(results['summary']['trump_electoral_votes'], 41)
+
+        results = self.post({'model': {
+            'keys': ['senate'],
+            'clinton_keys': ['clinton'],
+            'trump_keys': ['trump'],
+            'weight': 'followers',
+        }})
+        self.assertEqual(results['states'][1]['prediction']['clinton'], 2000)
+
+        results = self.post({'model': {
+            'keys': ['newspaper'],
+            'clinton_keys': ['clinton'],
+            'trump_keys': ['trump'],
+            'tiebreak': [['senate']],
+        }})
+        self.assertEqual(results['summary']['num_correct_candidate'], 3)
+
+        for data, message in (
+            ({}, 'Need "model" key with a dict value'),
+            ({'model': []}, 'The model needs to be a dict'),
+            ({'model': {'keys': ['x'], 'clinton_keys': ['clinton'],
+                        'trump_keys': ['trump']}},
+             'Unknown key in "keys": x'),
+            ({'model': {'keys': [['x']], 'clinton_keys': ['clinton'],
+                        'trump_keys': ['trump']}},
+             'Keys in "keys" must be strings'),
+            ({'model': {'keys': ['senate'], 'clinton_keys': ['clinton'],
+                        'trump_keys': ['trump'], 'weight': []}},
+             '"weight" must be a string'),
+        ):
+            results = self.post(data)
+            self.assertTrue(results['error'])
+            self.assertEqual(results['message'], message)
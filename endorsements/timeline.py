@@ -0,0 +1,103 @@
+import bisect
+import threading
+
+import numpy
+
+from endorsements.index import get_endorser_index
+from endorsements.models import Endorsement
+
+
+# A copy of every endorser's position is kept after every this many events,
+# so that a snapshot never has to replay more than this many.
+CHECKPOINT_INTERVAL = 256
+
+
+class EndorsementTimeline(object):
+    """Every dated endorsement, in the order they happened, for working out
+    what each endorser's position was on any date.
+
+    Positions are numpy arrays with the pk of each endorser's position (or 0
+    for none), in the order of the endorser index's pks, like the columns of
+    EndorserIndex.get_matrix. An endorser's position on a date is the one
+    they most recently endorsed on or before that date; endorsements without
+    a date are left out, since there's no telling when they happened.
+    """
+    def __init__(self, index):
+        self.version = index.version
+        self.pks = index.pks
+
+        endorsements = Endorsement.objects.filter(
+            quote__date__isnull=False
+        ).order_by('quote__date', 'quote__pk', 'pk').values_list(
+            'quote__date', 'endorser_id', 'position_id'
+        )
+        self.dates = []
+        self.rows = []
+        self.position_pks = []
+        for date, endorser_pk, position_pk in endorsements:
+            row = index.rows.get(endorser_pk)
+            if row is None:
+                continue
+            self.dates.append(date)
+            self.rows.append(row)
+            self.position_pks.append(position_pk)
+
+        # checkpoints[i] is the positions after the first
+        # i * CHECKPOINT_INTERVAL events.
+        positions = self.get_empty_positions()
+        self.checkpoints = [positions.copy()]
+        for start in xrange(0, len(self.dates), CHECKPOINT_INTERVAL):
+            self.apply_events(positions, start, start + CHECKPOINT_INTERVAL)
+            self.checkpoints.append(positions.copy())
+
+    def get_empty_positions(self):
+        return numpy.zeros(len(self.pks), dtype=numpy.int64)
+
+    def apply_events(self, positions, start, end):
+        for i in xrange(start, min(end, len(self.dates))):
+            positions[self.rows[i]] = self.position_pks[i]
+
+    def get_positions(self, date):
+        """Returns every endorser's position as of the end of the given
+        date."""
+        end = bisect.bisect_right(self.dates, date)
+        checkpoint = end // CHECKPOINT_INTERVAL
+        positions = self.checkpoints[checkpoint].copy()
+        self.apply_events(positions, checkpoint * CHECKPOINT_INTERVAL, end)
+        return positions
+
+    def iter_positions(self, dates):
+        """Yields (date, positions) for each of the given dates (which must
+        be in order) in a single pass over the timeline. The positions array
+        is updated in place, so copy it to keep it."""
+        positions = self.get_empty_positions()
+        end = 0
+        for date in dates:
+            start, end = end, bisect.bisect_right(self.dates, date)
+            self.apply_events(positions, start, end)
+            yield date, positions
+
+    def get_matrix(self, positions, position_pks):
+        """Returns a boolean matrix with a row for each of the given
+        position pks and a column for each endorser, like
+        EndorserIndex.get_matrix with the index's position bitmaps."""
+        position_pks = numpy.array(list(position_pks), dtype=numpy.int64)
+        return positions[numpy.newaxis, :] == position_pks[:, numpy.newaxis]
+
+
+_timeline = None
+_timeline_lock = threading.Lock()
+
+
+def get_timeline():
+    """Returns the timeline for the current data version (and endorser
+    index), rebuilding it if anything has changed since it was built."""
+    global _timeline
+    index = get_endorser_index()
+    timeline = _timeline
+    if timeline is None or timeline.version != index.version:
+        with _timeline_lock:
+            if _timeline is None or _timeline.version != index.version:
+                _timeline = EndorsementTimeline(index)
+            timeline = _timeline
+    return timeline
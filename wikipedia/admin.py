@@ -1,13 +1,61 @@
 # encoding: utf-8
 from django import forms
 from django.contrib import admin, messages
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
 
 from endorsements.models import Category, Tag
 from wikipedia.models import BulkImport, ImportedEndorsement, \
                              ImportedEndorser, ImportedNewspaper, \
                              ImportedResult, ImportedRepresentative, \
                              ElectoralVotes
+from wikipedia.resolver import get_resolver, resolve_endorsers
+
+
+class LikelyEndorserMixin(object):
+    """Shows the confirmed endorser of each row, or the likely one if there
+    isn't one yet, resolving the whole changelist page at once."""
+    list_select_related = ('confirmed_endorser',)
+
+    def get_changelist(self, request, **kwargs):
+        ChangeList = super(LikelyEndorserMixin, self).get_changelist(
+            request, **kwargs
+        )
+
+        class LikelyEndorserChangeList(ChangeList):
+            def get_results(self, request):
+                super(LikelyEndorserChangeList, self).get_results(request)
+                unconfirmed = [
+                    obj for obj in self.result_list
+                    if obj.confirmed_endorser_id is None
+                ]
+                resolved = resolve_endorsers(unconfirmed)
+                for obj, (endorser, match) in zip(unconfirmed, resolved):
+                    obj.likely_endorser = endorser
+
+        return LikelyEndorserChangeList
+
+    def get_queryset(self, request):
+        queryset = super(LikelyEndorserMixin, self).get_queryset(request)
+        return queryset.prefetch_related('suggestions__endorser')
+
+    def show_suggestions(self, obj):
+        """The similar endorsers found by the suggestendorsers command."""
+        return format_html_join(
+            u'', u'<p><a href="{}">{}</a> ({})</p>',
+            (
+                (suggestion.endorser.get_absolute_url(),
+                 suggestion.endorser.name, '%.2f' % suggestion.score)
+                for suggestion in obj.suggestions.all()
+            )
+        )
+    show_suggestions.short_description = 'Suggestions'
+
+    def get_endorser(self, obj):
+        if obj.confirmed_endorser_id is not None:
+            return obj.confirmed_endorser
+        if not hasattr(obj, 'likely_endorser'):
+            obj.likely_endorser = get_resolver().get_likely_endorser(obj)
+        return obj.likely_endorser
 
 
 @admin.register(BulkImport)
@@ -93,11 +141,9 @@ class NeedsFilter(admin.SimpleListFilter):
 
 def confirm_endorsers(modeladmin, request, queryset):
     num_confirmed = 0
-    for endorsement in queryset:
-        if endorsement.confirmed_endorser is not None:
-            continue
-
-        endorser = endorsement.get_likely_endorser()
+    queryset = queryset.filter(confirmed_endorser__isnull=True)
+    for endorsement, (endorser, match) in zip(
+            queryset, resolve_endorsers(queryset)):
         endorsement.confirmed_endorser = endorser
         endorsement.save()
         if endorser is not None:
@@ -225,9 +271,9 @@ class ExcludedCategoriesFilter(admin.SimpleListFilter):
 
 
 @admin.register(ImportedEndorsement)
-class ImportedEndorsementAdmin(admin.ModelAdmin):
+class ImportedEndorsementAdmin(LikelyEndorserMixin, admin.ModelAdmin):
     list_display = ('get_image', 'get_display', 'is_confirmed', 'sections',
-                    'get_import_date', 'show_raw_text')
+                    'get_import_date', 'show_raw_text', 'show_suggestions')
     list_filter = (ConfirmedEndorserFilter, NeedsFilter,
                    ExcludedCategoriesFilter,
                   'bulk_import__slug', 'sections')
@@ -265,9 +311,6 @@ class ImportedEndorsementAdmin(admin.ModelAdmin):
         return obj.confirmed_endorser is not None
     is_confirmed.boolean = True
 
-    def get_endorser(self, obj):
-        return obj.confirmed_endorser or obj.get_likely_endorser()
-
     def show_endorser(self, obj):
         endorser = self.get_endorser(obj)
         if endorser:
@@ -296,15 +339,12 @@ class ImportedEndorserAdmin(admin.ModelAdmin):
 
 
 @admin.register(ImportedNewspaper)
-class ImportedNewspaperAdmin(admin.ModelAdmin):
+class ImportedNewspaperAdmin(LikelyEndorserMixin, admin.ModelAdmin):
     list_display = ('name', 'show_endorser', 'get_section_display',
-                    'city', 'state')
+                    'city', 'state', 'show_suggestions')
     actions = [confirm_endorsers]
     list_filter = (ConfirmedEndorserFilter, 'section')
 
-    def get_endorser(self, obj):
-        return obj.confirmed_endorser or obj.get_likely_endorser()
-
     def show_endorser(self, obj):
         endorser = self.get_endorser(obj)
         if endorser:
@@ -335,8 +375,10 @@ class HasEndorsementsFilter(admin.SimpleListFilter):
 
 
 @admin.register(ImportedRepresentative)
-class ImportedRepresentativeAdmin(admin.ModelAdmin):
-    list_display = ('get_display', 'get_image', 'show_endorser', 'is_confirmed')
+class ImportedRepresentativeAdmin(LikelyEndorserMixin,
+                                  admin.ModelAdmin):
+    list_display = ('get_display', 'get_image', 'show_endorser', 'is_confirmed',
+                    'show_suggestions')
     list_filter = [HasEndorsementsFilter, 'party', 'state']
     action_form = EndorserActionForm
     actions = [add_tag, remove_tag, confirm_endorsers, make_personal, make_org]
@@ -355,13 +397,13 @@ class ImportedRepresentativeAdmin(admin.ModelAdmin):
         )
 
     def get_image(self, obj):
-        endorser = obj.confirmed_endorser or obj.get_likely_endorser()
+        endorser = self.get_endorser(obj)
         if endorser:
             return endorser.get_image()
     get_image.allow_tags = True
 
     def show_endorser(self, obj):
-        endorser = obj.confirmed_endorser or obj.get_likely_endorser()
+        endorser = self.get_endorser(obj)
         if endorser:
             return format_html(
                 u'<h3><a href="{url}">{name}</a> ({pk})</h3>'
@@ -5,3 +5,7 @@ from django.apps import AppConfig
 
 class WikipediaConfig(AppConfig):
     name = 'wikipedia'
+
+    def ready(self):
+        # Connect the signal handlers that invalidate cached data.
+        from wikipedia import signals
@@ -4,6 +4,7 @@ from BeautifulSoup import BeautifulSoup as BS
 from django.core.management.base import BaseCommand, CommandError
 import requests
 
+from election.stats import refresh_stats
 from endorsements.models import Tag, Candidate
 from wikipedia.models import BulkImport, ImportedResult
 
@@ -111,6 +112,9 @@ class Command(BaseCommand):
                         count=candidate_stats['count'],
                         percent=candidate_stats['percent'],
                     )
+
+            # Don't make the first visitor after the import wait for these.
+            refresh_stats(['states', 'predictions'])
         else:
             print "Would have created", len(results)
             print results
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from endorsements.caching import bump_versions
+from wikipedia.models import ImportedEndorsement
+from wikipedia.utils import PARSER_VERSION
+
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Re-parse imported endorsements parsed by an older parser'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            dest='all',
+            default=False,
+            help='Re-parse every imported endorsement, not just stale ones',
+        )
+
+    def handle(self, *args, **options):
+        endorsements = ImportedEndorsement.objects.order_by('pk')
+        if not options['all']:
+            endorsements = endorsements.exclude(parser_version=PARSER_VERSION)
+        pks = list(endorsements.values_list('pk', flat=True))
+
+        for start in xrange(0, len(pks), BATCH_SIZE):
+            batch = ImportedEndorsement.objects.filter(
+                pk__in=pks[start:start + BATCH_SIZE]
+            ).only('pk', 'raw_text')
+            # Use update() so that no signals are sent for each row.
+            with transaction.atomic():
+                for endorsement in batch:
+                    endorsement.refresh_parsed_fields()
+                    ImportedEndorsement.objects.filter(
+                        pk=endorsement.pk
+                    ).update(
+                        endorser_name=endorsement.endorser_name,
+                        endorser_details=endorsement.endorser_details,
+                        citation_url=endorsement.citation_url,
+                        citation_date=endorsement.citation_date,
+                        citation_name=endorsement.citation_name,
+                        parser_version=endorsement.parser_version,
+                    )
+
+        if pks:
+            bump_versions('imports')
+        print "Re-parsed", len(pks), "imported endorsements"
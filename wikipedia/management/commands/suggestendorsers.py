@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from wikipedia.matching import DEFAULT_LIMIT, DEFAULT_MIN_SCORE, \
+                               IMPORTED_FIELDS, get_candidate_index, \
+                               get_imported_names, suggest_endorsers, \
+                               write_suggestions
+
+
+class Command(BaseCommand):
+    help = 'Find the endorsers with names most like those of imported rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=None,
+            help='Number of worker processes (default: one per CPU)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=DEFAULT_LIMIT,
+            help='The most suggestions to keep for each imported row',
+        )
+        parser.add_argument(
+            '--min-score',
+            type=float,
+            default=DEFAULT_MIN_SCORE,
+            dest='min_score',
+            help='The lowest similarity (from 0 to 1) worth suggesting',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            dest='all',
+            default=False,
+            help='Include rows that already have a confirmed endorser',
+        )
+
+    def handle(self, *args, **options):
+        start = time.time()
+        index = get_candidate_index()
+        print "Indexed", len(index.pks), "endorsers in %.1fs" % (
+            time.time() - start
+        )
+
+        imported = [
+            (model, get_imported_names(model, options['all']))
+            for model in IMPORTED_FIELDS
+        ]
+        start = time.time()
+        suggestions = suggest_endorsers(
+            index,
+            [name for model, names in imported for pk, name in names],
+            limit=options['limit'],
+            min_score=options['min_score'],
+            processes=options['processes'],
+        )
+        print "Scored", len(suggestions), "names in %.1fs" % (
+            time.time() - start
+        )
+
+        for model, names in imported:
+            num_written = write_suggestions(model, names, suggestions)
+            print "Wrote", num_written, "suggestions for", len(names), \
+                model._meta.verbose_name_plural
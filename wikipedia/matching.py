@@ -0,0 +1,342 @@
+from __future__ import unicode_literals
+
+import collections
+import itertools
+import multiprocessing
+import re
+import unicodedata
+
+from django.db import transaction
+
+from endorsements.models import Endorser
+from wikipedia import utils
+from wikipedia.models import ImportedEndorsement, ImportedNewspaper, \
+                             ImportedRepresentative, SuggestedEndorser
+
+
+# How many suggestions to keep for each imported row.
+DEFAULT_LIMIT = 5
+
+# Pairs that score lower than this aren't worth suggesting.
+DEFAULT_MIN_SCORE = 0.85
+
+# A block with more endorsers than this (e.g., everyone with a last name
+# that sounds like "Smith") is narrowed down to the endorsers whose first
+# names also start with the same letter.
+MAX_BLOCK_SIZE = 100
+
+# Names are handed to worker processes in chunks of this many.
+CHUNK_SIZE = 1000
+
+# Suggestions are inserted in batches of this many.
+BATCH_SIZE = 1000
+
+# Words that don't help tell names apart.
+TITLES = frozenset([
+    'the', 'sen', 'senator', 'rep', 'representative', 'gov', 'governor',
+    'mayor', 'dr', 'mr', 'mrs', 'ms', 'hon', 'rev', 'gen',
+])
+SUFFIXES = frozenset(['jr', 'sr', 'ii', 'iii', 'iv'])
+
+# Nickname: the name it's short for.
+NICKNAMES = {
+    'al': 'albert',
+    'alex': 'alexander',
+    'andy': 'andrew',
+    'ben': 'benjamin',
+    'bill': 'william',
+    'billy': 'william',
+    'bob': 'robert',
+    'bobby': 'robert',
+    'chris': 'christopher',
+    'chuck': 'charles',
+    'dan': 'daniel',
+    'dave': 'david',
+    'dick': 'richard',
+    'don': 'donald',
+    'ed': 'edward',
+    'jim': 'james',
+    'jimmy': 'james',
+    'joe': 'joseph',
+    'jon': 'jonathan',
+    'ken': 'kenneth',
+    'larry': 'lawrence',
+    'liz': 'elizabeth',
+    'matt': 'matthew',
+    'mike': 'michael',
+    'nick': 'nicholas',
+    'pat': 'patrick',
+    'pete': 'peter',
+    'rick': 'richard',
+    'rob': 'robert',
+    'ron': 'ronald',
+    'sam': 'samuel',
+    'steve': 'steven',
+    'ted': 'edward',
+    'tom': 'thomas',
+    'tony': 'anthony',
+    'will': 'william',
+}
+
+SOUNDEX_CODES = {}
+for letters, code in [('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'),
+                      ('l', '4'), ('mn', '5'), ('r', '6')]:
+    for letter in letters:
+        SOUNDEX_CODES[letter] = code
+
+
+def get_tokens(name):
+    """Returns the lowercased words of a name, without accents, punctuation,
+    titles or suffixes."""
+    name = unicodedata.normalize('NFKD', unicode(name or ''))
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    name = re.sub("['\u2019]", '', name.lower())
+    tokens = re.findall('[a-z0-9]+', name)
+    words = [
+        token for token in tokens
+        if token not in TITLES and token not in SUFFIXES
+    ]
+    return words or tokens
+
+
+def get_canonical_tokens(tokens):
+    """Drops initials and expands nicknames, so that "Bill J. Smith" and
+    "William Smith" end up the same."""
+    words = [token for token in tokens if len(token) > 1] or tokens
+    return [NICKNAMES.get(word, word) for word in words]
+
+
+def soundex(word):
+    """Returns the American Soundex code for a word (or the word itself if
+    it has no letters, e.g. a number)."""
+    letters = ''.join(c for c in word if c.isalpha())
+    if not letters:
+        return word
+
+    code = [letters[0]]
+    last = SOUNDEX_CODES.get(letters[0], '')
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES.get(letter, '')
+        if digit and digit != last:
+            code.append(digit)
+        # Letters separated by an H or W count as adjacent; vowels don't.
+        if letter not in 'hw':
+            last = digit
+    return (''.join(code) + '000')[:4]
+
+
+NameForms = collections.namedtuple('NameForms', ['full', 'canonical', 'keys'])
+
+
+def get_name_forms(name):
+    """Returns the forms of a name that are compared when scoring, and the
+    keys of the blocks it falls into: (coarse key, fine key) pairs, where
+    the fine key is only used if the coarse key's block is too big."""
+    tokens = get_tokens(name)
+    canonical = get_canonical_tokens(tokens)
+    keys = []
+    if canonical:
+        last = soundex(canonical[-1])
+        first_initial = canonical[0][0]
+        keys.append(('l:' + last, 'lf:' + last + ':' + first_initial))
+        if len(canonical) > 1:
+            first = soundex(canonical[0])
+            keys.append(('f:' + first, 'fl:' + first + ':' + last))
+    return NameForms(' '.join(tokens), ' '.join(canonical), keys)
+
+
+def jaro_winkler(a, b, prefix_scale=0.1):
+    """Returns the Jaro-Winkler similarity of two strings, from 0 (nothing
+    in common) to 1 (the same)."""
+    if a == b:
+        return 1.0
+    len_a = len(a)
+    len_b = len(b)
+    if not len_a or not len_b:
+        return 0.0
+
+    window = max(max(len_a, len_b) // 2 - 1, 0)
+    matched_b = [False] * len_b
+    matches_a = []
+    for i, c in enumerate(a):
+        # Look for the first unmatched c in b within the window (with find,
+        # which is much faster than comparing each character in Python).
+        end = i + window + 1
+        j = b.find(c, max(0, i - window), end)
+        while j != -1 and matched_b[j]:
+            j = b.find(c, j + 1, end)
+        if j != -1:
+            matched_b[j] = True
+            matches_a.append(c)
+    num_matches = len(matches_a)
+    if not num_matches:
+        return 0.0
+
+    matches_b = [c for c, matched in itertools.izip(b, matched_b) if matched]
+    transpositions = sum(
+        x != y for x, y in itertools.izip(matches_a, matches_b)
+    ) // 2
+    jaro = (
+        num_matches / float(len_a) +
+        num_matches / float(len_b) +
+        (num_matches - transpositions) / float(num_matches)
+    ) / 3
+
+    prefix = 0
+    for x, y in itertools.izip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * prefix_scale * (1 - jaro)
+
+
+def get_similarity(forms_a, forms_b):
+    score = jaro_winkler(forms_a.full, forms_b.full)
+    if forms_a.canonical != forms_a.full or forms_b.canonical != forms_b.full:
+        score = max(
+            score, jaro_winkler(forms_a.canonical, forms_b.canonical)
+        )
+    return score
+
+
+class CandidateIndex(object):
+    """Every endorser's name forms, and the blocks they fall into, so that
+    an imported name is only compared with endorsers in the same blocks."""
+    def __init__(self, endorsers):
+        self.pks = []
+        self.forms = []
+        self.blocks = collections.defaultdict(list)
+        for pk, name in endorsers:
+            i = len(self.pks)
+            forms = get_name_forms(name)
+            self.pks.append(pk)
+            self.forms.append(forms)
+            for keys in forms.keys:
+                for key in keys:
+                    self.blocks[key].append(i)
+
+    def get_candidates(self, forms):
+        candidates = set()
+        for coarse_key, fine_key in forms.keys:
+            block = self.blocks.get(coarse_key, ())
+            if len(block) > MAX_BLOCK_SIZE:
+                block = self.blocks.get(fine_key, ())
+            candidates.update(block)
+        return candidates
+
+    def suggest(self, name, limit=DEFAULT_LIMIT, min_score=DEFAULT_MIN_SCORE):
+        """Returns up to `limit` (endorser pk, score) pairs for the endorsers
+        most similar to the given name, best first."""
+        forms = get_name_forms(name)
+        scores = []
+        for i in self.get_candidates(forms):
+            score = get_similarity(forms, self.forms[i])
+            if score >= min_score:
+                scores.append((-score, self.pks[i]))
+        scores.sort()
+        return [(pk, -score) for score, pk in scores[:limit]]
+
+
+def get_candidate_index():
+    return CandidateIndex(Endorser.objects.values_list('pk', 'name'))
+
+
+# Set in each worker process by init_worker.
+_index = None
+_limit = None
+_min_score = None
+
+
+def init_worker(index, limit, min_score):
+    global _index, _limit, _min_score
+    _index = index
+    _limit = limit
+    _min_score = min_score
+
+
+def suggest_names(names):
+    return [
+        (name, _index.suggest(name, _limit, _min_score)) for name in names
+    ]
+
+
+def suggest_endorsers(index, names, limit=DEFAULT_LIMIT,
+                      min_score=DEFAULT_MIN_SCORE, processes=1):
+    """Returns a dict of name: suggestions (see CandidateIndex.suggest) for
+    each of the given names, scored across a pool of processes if processes
+    isn't 1."""
+    names = sorted(set(names))
+    chunks = [
+        names[start:start + CHUNK_SIZE]
+        for start in xrange(0, len(names), CHUNK_SIZE)
+    ]
+    if processes == 1:
+        init_worker(index, limit, min_score)
+        results = itertools.imap(suggest_names, chunks)
+        suggestions = dict(pair for chunk in results for pair in chunk)
+    else:
+        pool = multiprocessing.Pool(
+            processes, init_worker, (index, limit, min_score)
+        )
+        try:
+            results = pool.imap_unordered(suggest_names, chunks)
+            suggestions = dict(pair for chunk in results for pair in chunk)
+        finally:
+            pool.close()
+            pool.join()
+    return suggestions
+
+
+# Imported model: the SuggestedEndorser field that points to it.
+IMPORTED_FIELDS = collections.OrderedDict([
+    (ImportedEndorsement, 'imported_endorsement'),
+    (ImportedNewspaper, 'imported_newspaper'),
+    (ImportedRepresentative, 'imported_representative'),
+])
+
+
+def get_imported_names(model, include_confirmed=False):
+    """Returns (pk, name) for each of the model's rows, without those that
+    already have a confirmed endorser unless include_confirmed is set."""
+    query = model.objects.order_by('pk')
+    if not include_confirmed:
+        query = query.filter(confirmed_endorser__isnull=True)
+
+    if model is not ImportedEndorsement:
+        return list(query.values_list('pk', 'name'))
+
+    names = []
+    rows = query.values_list(
+        'pk', 'endorser_name', 'parser_version', 'raw_text'
+    )
+    for pk, name, parser_version, raw_text in rows.iterator():
+        if parser_version != utils.PARSER_VERSION:
+            try:
+                name = utils.parse_wiki_text(raw_text)['endorser_name']
+            except ValueError:
+                continue
+        if name:
+            names.append((pk, name))
+    return names
+
+
+def write_suggestions(model, imported_names, suggestions):
+    """Replaces the model's suggestions with those for the given (pk, name)
+    rows. Returns the number of suggestions written."""
+    field = IMPORTED_FIELDS[model]
+    objs = [
+        SuggestedEndorser(**{
+            field + '_id': pk,
+            'endorser_id': endorser_pk,
+            'score': score,
+            'rank': rank,
+        })
+        for pk, name in imported_names
+        for rank, (endorser_pk, score) in enumerate(suggestions[name])
+    ]
+    with transaction.atomic():
+        SuggestedEndorser.objects.filter(**{
+            field + '__isnull': False
+        }).delete()
+        SuggestedEndorser.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+    return len(objs)
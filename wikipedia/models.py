@@ -135,9 +135,44 @@ class ImportedEndorsement(models.Model):
     confirmed_endorser = models.ForeignKey(Endorser, blank=True, null=True)
     sections = models.TextField(blank=True, null=True)
     notes = models.TextField(blank=True, null=True)
+    # The fields below are parsed from raw_text (see parse_text) when the row
+    # is saved, by the parser version in parser_version.
+    endorser_name = models.TextField(blank=True, null=True)
+    endorser_details = models.TextField(blank=True, null=True)
+    citation_url = models.TextField(blank=True, null=True)
+    citation_date = models.DateField(blank=True, null=True)
+    citation_name = models.TextField(blank=True, null=True)
+    parser_version = models.PositiveSmallIntegerField(default=0,
+                                                      db_index=True)
 
     def parse_text(self):
-        return utils.parse_wiki_text(self.raw_text)
+        """Returns the attributes parsed from raw_text, from the stored
+        fields unless they were parsed by an older version of the
+        parser."""
+        if self.parser_version != utils.PARSER_VERSION:
+            return utils.parse_wiki_text(self.raw_text)
+
+        return {
+            'endorser_name': self.endorser_name,
+            'endorser_details': self.endorser_details,
+            'citation_url': self.citation_url,
+            'citation_date': self.citation_date,
+            'citation_name': self.citation_name,
+        }
+
+    def refresh_parsed_fields(self):
+        """Parses raw_text again and stores the results (without saving)."""
+        try:
+            attributes = utils.parse_wiki_text(self.raw_text)
+        except ValueError:
+            # E.g., a citation date in a format the parser doesn't know.
+            # Leave it to parse_text, which raises as before.
+            self.parser_version = 0
+            return
+
+        for key, value in attributes.iteritems():
+            setattr(self, key, value)
+        self.parser_version = utils.PARSER_VERSION
 
     def get_likely_endorser(self):
         name = self.parse_text()['endorser_name']
@@ -183,6 +218,35 @@ class ImportedEndorsement(models.Model):
         return self.raw_text
 
 
+class SuggestedEndorser(models.Model):
+    """An existing endorser whose name is similar to an imported row's, as
+    found by the suggestendorsers command (see wikipedia.matching). Exactly
+    one of the imported_* fields is set."""
+    imported_endorsement = models.ForeignKey(
+        ImportedEndorsement, blank=True, null=True, related_name='suggestions'
+    )
+    imported_newspaper = models.ForeignKey(
+        ImportedNewspaper, blank=True, null=True, related_name='suggestions'
+    )
+    imported_representative = models.ForeignKey(
+        ImportedRepresentative, blank=True, null=True,
+        related_name='suggestions'
+    )
+    endorser = models.ForeignKey(Endorser, related_name='+')
+    score = models.FloatField()
+    # 0 for the most similar endorser.
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['rank']
+
+    def __unicode__(self):
+        return "{endorser} ({score:.2f})".format(
+            endorser=self.endorser,
+            score=self.score
+        )
+
+
 class ElectoralVotes(models.Model):
     """Technically not imported from Wikipedia (entered manually), but this
     model fits better in the Wikipedia app."""
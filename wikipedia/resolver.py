@@ -0,0 +1,183 @@
+import bisect
+import collections
+import threading
+
+from endorsements.caching import get_data_version
+from endorsements.models import Endorser
+from wikipedia.models import ImportedEndorsement, ImportedNewspaper, \
+                             ImportedRepresentative
+
+
+Match = collections.namedtuple(
+    'Match', ['endorser_pk', 'match_type', 'confidence']
+)
+
+# match type: how sure we can be that it's the right endorser
+CONFIDENCE = {
+    'exact': 1.0,
+    'the': 0.9,
+    'name-prefix': 0.6,
+    'contains': 0.3,
+}
+
+
+class EndorserResolver(object):
+    """Matches imported rows to existing endorsers by name, with the same
+    rules as the get_likely_endorser methods on the imported models, but
+    against an in-memory index of every endorser's (lowercased) name instead
+    of a few queries per row.
+
+    Where those methods use first(), the endorser with the most followers
+    wins (Endorser's default ordering), with ties going to the lowest pk.
+    """
+    def __init__(self, version=None):
+        self.version = version
+
+        # (-max_followers, pk, lowercased name), in the order first() uses.
+        entries = sorted(
+            (-max_followers, pk, name.lower())
+            for pk, name, max_followers in Endorser.objects.values_list(
+                'pk', 'name', 'max_followers'
+            )
+        )
+
+        self.by_name = collections.defaultdict(list)
+        # The first one, two and three characters of each name.
+        self.by_prefix = collections.defaultdict(list)
+        for entry in entries:
+            name = entry[2]
+            self.by_name[name].append(entry)
+            for length in range(1, 4):
+                if len(name) >= length:
+                    self.by_prefix[name[:length]].append(entry)
+        self.entries = entries
+
+        # All the names in one string, for substring searches. A match can't
+        # span a newline, and the first match is the first in order.
+        self.all_names = '\n'.join(entry[2] for entry in entries)
+        self.name_offsets = []
+        offset = 0
+        for entry in entries:
+            self.name_offsets.append(offset)
+            offset += len(entry[2]) + 1
+
+    def match_exact(self, name, latest=False):
+        entries = self.by_name.get(name)
+        if not entries:
+            return None
+        if latest:
+            return max(entry[1] for entry in entries)
+        return entries[0][1]
+
+    def match_the(self, name):
+        """Tries putting "The" in front of the name (or removing it)."""
+        if name.startswith('the '):
+            return self.match_exact(name[4:])
+        return self.match_exact('the ' + name)
+
+    def match_name_prefix(self, name):
+        """Tries the last name plus the start of the first name."""
+        if ' ' not in name:
+            return None
+
+        split_name = name.split(' ')
+        first_name_start = split_name[0][:3]
+        last_name = split_name[-1]
+        if len(last_name) <= 3:
+            return None
+
+        if first_name_start:
+            entries = self.by_prefix.get(first_name_start, [])
+        else:
+            entries = self.entries
+        for entry in entries:
+            if entry[2].endswith(last_name):
+                return entry[1]
+
+    def match_contains(self, name):
+        if not name:
+            return self.entries[0][1] if self.entries else None
+        offset = self.all_names.find(name)
+        if offset == -1:
+            return None
+        i = bisect.bisect_right(self.name_offsets, offset) - 1
+        return self.entries[i][1]
+
+    def apply_rules(self, name, rules):
+        for match_type, rule in rules:
+            endorser_pk = rule(name)
+            if endorser_pk is not None:
+                return Match(endorser_pk, match_type, CONFIDENCE[match_type])
+
+    def resolve_endorsement(self, name):
+        """The rules of ImportedEndorsement.get_likely_endorser, for the
+        endorser name parsed from its text."""
+        if not name:
+            return None
+        return self.apply_rules(name.lower(), [
+            ('exact', lambda name: self.match_exact(name, latest=True)),
+            ('the', self.match_the),
+            ('name-prefix', self.match_name_prefix),
+        ])
+
+    def resolve_newspaper(self, name):
+        return self.apply_rules(name.lower(), [
+            ('exact', self.match_exact),
+            ('the', self.match_the),
+        ])
+
+    def resolve_representative(self, name):
+        return self.apply_rules(name.lower(), [
+            ('exact', self.match_exact),
+            ('name-prefix', self.match_name_prefix),
+            ('contains', self.match_contains),
+        ])
+
+    def resolve(self, obj):
+        """Returns the Match for an ImportedEndorsement, ImportedNewspaper
+        or ImportedRepresentative, or None if nothing matches."""
+        if isinstance(obj, ImportedEndorsement):
+            return self.resolve_endorsement(obj.parse_text()['endorser_name'])
+        elif isinstance(obj, ImportedNewspaper):
+            return self.resolve_newspaper(obj.name)
+        elif isinstance(obj, ImportedRepresentative):
+            return self.resolve_representative(obj.name)
+        raise TypeError('Cannot resolve %r' % obj)
+
+    def get_likely_endorser(self, obj):
+        """Like obj.get_likely_endorser(), but with a single query."""
+        match = self.resolve(obj)
+        if match is not None:
+            return Endorser.objects.filter(pk=match.endorser_pk).first()
+
+
+def resolve_endorsers(objs):
+    """Returns a (likely endorser or None, Match or None) tuple for each of
+    the given imported rows, with one query for all the endorsers."""
+    resolver = get_resolver()
+    matches = [resolver.resolve(obj) for obj in objs]
+    endorsers = Endorser.objects.in_bulk(
+        set(match.endorser_pk for match in matches if match is not None)
+    )
+    return [
+        (endorsers.get(match.endorser_pk) if match else None, match)
+        for match in matches
+    ]
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    """Returns the resolver for the current data version, rebuilding it if
+    any endorsers have changed since it was built."""
+    global _resolver
+    version = get_data_version()
+    resolver = _resolver
+    if resolver is None or resolver.version != version:
+        with _resolver_lock:
+            if _resolver is None or _resolver.version != version:
+                _resolver = EndorserResolver(version)
+            resolver = _resolver
+    return resolver
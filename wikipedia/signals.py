@@ -0,0 +1,38 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from endorsements.caching import bump_versions
+from wikipedia.models import BulkImport, ElectoralVotes, ImportedEndorsement, \
+                             ImportedEndorser, ImportedNewspaper, \
+                             ImportedRepresentative, ImportedResult
+
+
+@receiver(post_save, sender=ImportedResult)
+@receiver(post_delete, sender=ImportedResult)
+@receiver(post_save, sender=ElectoralVotes)
+@receiver(post_delete, sender=ElectoralVotes)
+def result_changed(sender, raw=False, **kwargs):
+    if not raw:
+        bump_versions('results')
+
+
+@receiver(post_save, sender=BulkImport)
+@receiver(post_delete, sender=BulkImport)
+@receiver(post_save, sender=ImportedEndorsement)
+@receiver(post_delete, sender=ImportedEndorsement)
+@receiver(post_save, sender=ImportedEndorser)
+@receiver(post_delete, sender=ImportedEndorser)
+@receiver(post_save, sender=ImportedNewspaper)
+@receiver(post_delete, sender=ImportedNewspaper)
+@receiver(post_save, sender=ImportedRepresentative)
+@receiver(post_delete, sender=ImportedRepresentative)
+def import_changed(sender, raw=False, **kwargs):
+    if not raw:
+        bump_versions('imports')
+
+
+@receiver(pre_save, sender=ImportedEndorsement)
+def imported_endorsement_saving(sender, instance, raw=False, **kwargs):
+    # raw_text may have changed, so the parsed fields have to be redone.
+    if not raw:
+        instance.refresh_parsed_fields()
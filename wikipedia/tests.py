@@ -4,6 +4,16 @@ from datetime import date
 
 import unittest
 
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from endorsements.models import Endorser
+from endorsements.tests import TEST_CACHES
+from wikipedia import matching, utils
+from wikipedia.models import BulkImport, ImportedEndorsement, \
+                             ImportedNewspaper, ImportedRepresentative
+from wikipedia.resolver import get_resolver, resolve_endorsers
 from wikipedia.utils import parse_wiki_text, get_ref_definitions, \
                             replace_refs, split_endorsements
 
@@ -331,3 +341,169 @@ class TestTeamLoveRecords(__TestParseWikiText):
         'citation_name': 'Twitter',
         'citation_date': date(2016, 8, 30),
     }
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestStoredParse(TestCase):
+    raw_text = (
+        '[[Rick Moore]], [[Mayor]] of [[Some Town]]<ref>{{cite web|url='
+        'http://example.com/rick|date=2016-08-01|publisher=Example}}</ref>'
+    )
+
+    def runTest(self):
+        bulk_import = BulkImport.objects.create(slug='test', text='')
+        endorsement = ImportedEndorsement.objects.create(
+            bulk_import=bulk_import,
+            raw_text=self.raw_text,
+        )
+        endorsement = ImportedEndorsement.objects.get(pk=endorsement.pk)
+        self.assertEqual(endorsement.parser_version, utils.PARSER_VERSION)
+        self.assertEqual(endorsement.endorser_name, 'Rick Moore')
+        self.assertEqual(endorsement.citation_date, date(2016, 8, 1))
+        self.assertEqual(
+            endorsement.parse_text(), parse_wiki_text(self.raw_text)
+        )
+
+        # Rows parsed by an older parser are parsed on the fly until the
+        # command catches them up.
+        ImportedEndorsement.objects.update(
+            parser_version=0, endorser_name='Old'
+        )
+        endorsement = ImportedEndorsement.objects.get(pk=endorsement.pk)
+        self.assertEqual(endorsement.parse_text()['endorser_name'],
+                         'Rick Moore')
+        call_command('reparseendorsements', stdout=None)
+        endorsement = ImportedEndorsement.objects.get(pk=endorsement.pk)
+        self.assertEqual(endorsement.parser_version, utils.PARSER_VERSION)
+        self.assertEqual(endorsement.endorser_name, 'Rick Moore')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestResolver(TransactionTestCase):
+    endorsers = [
+        ('Rick Moore', 10),
+        ('Rick Moore', 5),
+        ('The Daily Herald', 0),
+        ('Boston Globe', 100),
+        ('The Boston Globe', 50),
+        ('Richard Moores', 20),
+        ('Jennifer Smithers', 0),
+        ('Sen. Al Franken', 0),
+    ]
+    names = [
+        'Rick Moore', 'rick moore', 'Daily Herald', 'The Boston Globe',
+        'Boston Globe', 'Ricardo Moores', 'Jen Smithers', 'Al Franken',
+        'Franken', 'Nobody Here', 'Smithers', 'Al Al',
+    ]
+
+    def setUp(self):
+        cache.clear()
+
+    def runTest(self):
+        for name, max_followers in self.endorsers:
+            Endorser.objects.create(name=name, max_followers=max_followers)
+
+        resolver = get_resolver()
+        for name in self.names:
+            imported = [
+                ImportedEndorsement(raw_text='[[%s]], someone' % name),
+                ImportedNewspaper(name=name),
+                ImportedRepresentative(name=name),
+            ]
+            for obj in imported:
+                self.assertEqual(
+                    resolver.get_likely_endorser(obj),
+                    obj.get_likely_endorser(),
+                    '%s: %s' % (type(obj).__name__, name),
+                )
+
+        match = resolver.resolve(ImportedNewspaper(name='Daily Herald'))
+        self.assertEqual(match.match_type, 'the')
+        imported = [ImportedNewspaper(name=name) for name in self.names]
+        self.assertEqual(
+            [endorser for endorser, match in resolve_endorsers(imported)],
+            [obj.get_likely_endorser() for obj in imported],
+        )
+
+        # The resolver is rebuilt once the endorsers change.
+        endorser = Endorser.objects.create(name='Nobody Here')
+        self.assertEqual(
+            get_resolver().get_likely_endorser(
+                ImportedNewspaper(name='Nobody Here')
+            ),
+            endorser,
+        )
+
+
+class TestNameMatching(unittest.TestCase):
+    def runTest(self):
+        self.assertEqual(matching.soundex('robert'), 'r163')
+        self.assertEqual(matching.soundex('rupert'), 'r163')
+        self.assertEqual(matching.soundex('ashcraft'), 'a261')
+        self.assertEqual(matching.soundex('tymczak'), 't522')
+        self.assertEqual(matching.soundex('1776'), '1776')
+
+        self.assertEqual(matching.jaro_winkler('martha', 'martha'), 1.0)
+        self.assertAlmostEqual(
+            matching.jaro_winkler('martha', 'marhta'), 0.961, places=3
+        )
+        self.assertAlmostEqual(
+            matching.jaro_winkler('dixon', 'dicksonx'), 0.813, places=3
+        )
+        self.assertEqual(matching.jaro_winkler('abc', ''), 0.0)
+
+        forms = matching.get_name_forms('Sen. Bill J. Sm\xedth, Jr.')
+        self.assertEqual(forms.full, 'bill j smith')
+        self.assertEqual(forms.canonical, 'william smith')
+        self.assertEqual(
+            forms.keys, [('l:s530', 'lf:s530:w'), ('f:w450', 'fl:w450:s530')]
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestSuggestEndorsers(TestCase):
+    def runTest(self):
+        william = Endorser.objects.create(name='William Smith')
+        Endorser.objects.create(name='Jennifer Smith')
+        globe = Endorser.objects.create(name='The Boston Globe')
+        bulk_import = BulkImport.objects.create(slug='test', text='')
+        endorsement = ImportedEndorsement.objects.create(
+            bulk_import=bulk_import,
+            raw_text='[[Bill J. Smith]], someone',
+        )
+        ImportedEndorsement.objects.create(
+            bulk_import=bulk_import,
+            raw_text='[[Somebody Else]], someone',
+        )
+        newspaper = ImportedNewspaper.objects.create(
+            bulk_import=bulk_import,
+            section=1,
+            name='Boston Globe',
+            endorsement_2016='Clinton',
+        )
+
+        call_command('suggestendorsers', processes=1, stdout=None)
+        self.assertEqual(
+            [s.endorser for s in endorsement.suggestions.all()], [william]
+        )
+        self.assertEqual(
+            [s.endorser for s in newspaper.suggestions.all()], [globe]
+        )
+
+        # Blocks that are too big are narrowed down by first initial.
+        index = matching.get_candidate_index()
+        matching.MAX_BLOCK_SIZE, max_block_size = 1, matching.MAX_BLOCK_SIZE
+        try:
+            self.assertEqual(
+                [pk for pk, score in index.suggest('Willy Smith', 5, 0.5)],
+                [william.pk],
+            )
+        finally:
+            matching.MAX_BLOCK_SIZE = max_block_size
+
+        # Running it again replaces the old suggestions.
+        endorsement.confirmed_endorser = william
+        endorsement.save()
+        call_command('suggestendorsers', processes=1, stdout=None)
+        self.assertFalse(endorsement.suggestions.exists())
+        self.assertEqual(newspaper.suggestions.count(), 1)
@@ -39,6 +39,11 @@ def split_endorsements(line):
         yield match.group(0).strip()
 
 
+# Bump this whenever parse_wiki_text's output changes, so that the parsed
+# fields stored on ImportedEndorsement get re-derived (see the
+# reparseendorsements command).
+PARSER_VERSION = 1
+
 BRACES_REGEX = re.compile(r'{{[^}]+}}')
 USEFUL_REF_REGEX = re.compile(r'<ref( [^>/]*|)(?!/)>(?P<ref>.*?)</ref>')
 ANY_REF_REGEX = re.compile(r'(<ref[^>]*(?!/)>.*?</ref>|<ref[^/]*?/>)')